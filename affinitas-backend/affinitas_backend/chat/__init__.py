@@ -1,2 +1,2 @@
-from affinitas_backend.chat.chat import npc_chat_service, master_llm_service
-from affinitas_backend.chat.utils import get_message
+from affinitas_backend.chat.chat import services
+from affinitas_backend.chat.messages import get_message
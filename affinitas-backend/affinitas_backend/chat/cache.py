@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import random
+import re
+from collections import OrderedDict
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from affinitas_backend.chat.state import ChatHistory, NPCState
+from affinitas_backend.config import Config
+from affinitas_backend.models.chat.chat import OpenAI_NPCChatResponse
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(content: str) -> str:
+    """Lowercases the message and drops punctuation and repeated whitespace, so "Hello!" matches "hello"."""
+    return _WHITESPACE.sub(" ", _PUNCTUATION.sub("", content.lower())).strip()
+
+
+class ResponseCache:
+    """
+    Shared cache of NPC replies to the opening exchanges of a conversation.
+
+    Every player starts from the same default save, so early turns are sent against an identical NPC state
+    and history. Replies are keyed by the normalized user message and a hash of the NPC state and history
+    window, and up to `variants` replies are stored per key so that players do not all get the same line.
+    Only the first `max_turns` user turns are cached. Bumping `npc_catalog_version` or `default_save_version`
+    invalidates all entries.
+    """
+
+    def __init__(self, config: Config):
+        self.enabled = config.response_cache_enabled
+        self.max_entries = config.response_cache_max_entries
+        self.variants = config.response_cache_variants
+        self.max_turns = config.response_cache_max_turns
+        self.version = f"{config.npc_catalog_version}:{config.default_save_version}"
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[str, list[OpenAI_NPCChatResponse]] = OrderedDict()
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def key_for(
+            self,
+            npc_id: str,
+            npc: NPCState,
+            history: ChatHistory,
+            message: BaseMessage,
+            quest_context: str = ""
+    ) -> str | None:
+        """Returns the cache key for the conversation, or `None` if it is not an early user turn."""
+        if not self.enabled or not isinstance(message, HumanMessage):
+            return None
+
+        if history.user_turns() >= self.max_turns:
+            return None
+
+        state = {
+            "version": self.version,
+            "npc_id": str(npc_id),
+            "affinitas": npc.affinitas,
+            "occupation": npc.occupation,
+            "likes": sorted(npc.likes),
+            "dislikes": sorted(npc.dislikes),
+            "quests": [list(npc.quest_statuses), npc.quest_names, npc.quest_descriptions],
+            "completed_quests": sorted(map(str, npc.completed_quests)),
+            "quest_context": quest_context,
+            "history": list(history),
+            "message": normalize_message(message.content),
+        }
+
+        return hashlib.blake2b(json.dumps(state, default=str).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> OpenAI_NPCChatResponse | None:
+        """
+        Returns a random stored reply for the key. Misses are returned until all variants are stored,
+        so that the variants are filled from real model replies.
+        """
+        replies = self._entries.get(key)
+        if replies is None or len(replies) < self.variants:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        logging.debug(f"Response cache hit (hit ratio: {self.hit_ratio:.2%})")
+
+        return random.choice(replies)
+
+    def put(self, key: str, reply: OpenAI_NPCChatResponse):
+        replies = self._entries.setdefault(key, [])
+        if len(replies) < self.variants:
+            replies.append(reply)
+
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self):
+        self._entries.clear()
@@ -0,0 +1,185 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Literal, TypedDict
+
+from langchain_core.messages import BaseMessage, HumanMessage, message_to_dict, messages_from_dict
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+from pydantic import BaseModel
+
+from affinitas_backend.chat.stand_in import StandInChatModel
+from affinitas_backend.config import Config
+
+
+class CassetteEntry(TypedDict):
+    key: str
+    operation: str
+    latency: float
+    prompt: list[dict[str, Any]]
+    output: dict[str, Any]
+
+
+class Cassette:
+    """
+    Recorded model calls, stored as gzip-compressed JSON lines and looked up by a hash of the operation and
+    the prompt. Prompts recorded more than once are replayed with a randomly chosen recording. Only replaying
+    cassettes keep their calls in memory.
+    """
+
+    def __init__(self, path: str, mode: Literal["record", "replay"]):
+        self.path = path
+        self.mode = mode
+
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+        self._entries: dict[str, list[CassetteEntry]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+        if mode == "replay":
+            self._load()
+
+    def get(self, key: str) -> CassetteEntry | None:
+        entries = self._entries.get(key)
+        if not entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return random.choice(entries)
+
+    async def record(self, entry: CassetteEntry):
+        await asyncio.to_thread(self.record_sync, entry)
+
+    def record_sync(self, entry: CassetteEntry):
+        line = json.dumps(entry, default=str) + "\n"
+        # Appending creates a new gzip member, which `gzip.open` reads back as one stream
+        with self._lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(line)
+            self.recorded += 1
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logging.warning(f"Cassette {self.path} not found; all model calls will be answered by the stand-in")
+            return
+
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self._entries[entry["key"]].append(entry)
+
+        logging.info(f"Loaded {sum(map(len, self._entries.values()))} recorded model calls from {self.path}")
+
+
+class CassetteModel(Runnable):
+    """
+    Wraps a model (or its structured output runnable, given its `schema`) to record its calls to a cassette,
+    or to replay them from it without calling the model.
+
+    Replayed calls wait for the recorded latency multiplied by `latency_scale`. Prompts missing from the
+    cassette are answered by the stand-in model. The operation is read from the `operation` metadata of the
+    call, as with tracing.
+    """
+
+    def __init__(self, model: Runnable, cassette: Cassette, stand_in: StandInChatModel,
+                 schema: type[BaseModel] | None = None, latency_scale: float = 1.0):
+        self.model = model
+        self.cassette = cassette
+        self.schema = schema
+        self.latency_scale = latency_scale
+        self.stand_in = stand_in.with_structured_output(schema, include_raw=True) if schema else stand_in
+
+    def invoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        operation, messages, key = _lookup(input, config)
+
+        if self.cassette.mode == "replay":
+            entry = self.cassette.get(key)
+            if entry is None:
+                return self.stand_in.invoke(input, config, **kwargs)
+
+            time.sleep(entry["latency"] * self.latency_scale)
+            return self._decode(entry["output"])
+
+        start = time.perf_counter()
+        output = self.model.invoke(input, config, **kwargs)
+        if entry := self._entry(key, operation, messages, output, time.perf_counter() - start):
+            self.cassette.record_sync(entry)
+
+        return output
+
+    async def ainvoke(self, input: Any, config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        operation, messages, key = _lookup(input, config)
+
+        if self.cassette.mode == "replay":
+            entry = self.cassette.get(key)
+            if entry is None:
+                return await self.stand_in.ainvoke(input, config, **kwargs)
+
+            await asyncio.sleep(entry["latency"] * self.latency_scale)
+            return self._decode(entry["output"])
+
+        start = time.perf_counter()
+        output = await self.model.ainvoke(input, config, **kwargs)
+        if entry := self._entry(key, operation, messages, output, time.perf_counter() - start):
+            await self.cassette.record(entry)
+
+        return output
+
+    def _entry(self, key: str, operation: str, messages: list[BaseMessage], output: Any,
+               latency: float) -> CassetteEntry | None:
+        """The cassette entry of a recorded call, or `None` if its output could not be parsed."""
+        if self.schema is not None and output["parsing_error"]:
+            return None
+
+        return {
+            "key": key,
+            "operation": operation,
+            "latency": latency,
+            "prompt": [message_to_dict(message) for message in messages],
+            "output": self._encode(output),
+        }
+
+    def _encode(self, output: Any) -> dict[str, Any]:
+        if self.schema is None:
+            return {"message": message_to_dict(output)}
+        return {"message": message_to_dict(output["raw"]), "parsed": output["parsed"].model_dump(mode="json")}
+
+    def _decode(self, output: dict[str, Any]) -> Any:
+        message = messages_from_dict([output["message"]])[0]
+        if self.schema is None:
+            return message
+        return {"raw": message, "parsed": self.schema.model_validate(output["parsed"]), "parsing_error": None}
+
+
+def _lookup(model_input: Any, config: RunnableConfig | None) -> tuple[str, list[BaseMessage], str]:
+    operation = (config or {}).get("metadata", {}).get("operation", "unknown")
+    messages = _to_messages(model_input)
+    return operation, messages, _key(operation, messages)
+
+
+def _to_messages(model_input: Any) -> list[BaseMessage]:
+    if isinstance(model_input, PromptValue):
+        return model_input.to_messages()
+    if isinstance(model_input, str):
+        return [HumanMessage(model_input)]
+    return list(model_input)
+
+
+def _key(operation: str, messages: list[BaseMessage]) -> str:
+    prompt = json.dumps([[operation]] + [[message.type, message.content] for message in messages])
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+def create_cassette(config: Config) -> Cassette | None:
+    if config.llm_cassette_mode == "off":
+        return None
+    return Cassette(config.llm_cassette_path, config.llm_cassette_mode)
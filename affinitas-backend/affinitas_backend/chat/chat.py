@@ -1,8 +1,133 @@
-from affinitas_backend.chat.master_chat import MasterLLM
-from affinitas_backend.chat.npc_chat import NPCChatService
-from affinitas_backend.config import Config
+"""
+Registry of the chat services shared by the routes. Each service is built on first use, with its imports, so
+that importing the application does not construct model and tracing clients or import their SDKs. Its stats
+are exported as metrics from then on.
+"""
+from functools import cached_property
+from typing import TYPE_CHECKING
 
-config = Config()  # noqa
+from affinitas_backend.chat.fallback import degraded_stats
+from affinitas_backend.chat.usage import cancellation_stats
+from affinitas_backend.config import Config, get_config
+from affinitas_backend.metrics import CallbackMetric
 
-npc_chat_service = NPCChatService(config=config)
-master_llm_service = MasterLLM(config=config)
+if TYPE_CHECKING:
+    from affinitas_backend.chat.cassette import Cassette
+    from affinitas_backend.chat.http_pool import HTTPClientPool
+    from affinitas_backend.chat.master_chat import MasterLLM
+    from affinitas_backend.chat.npc_chat import NPCChatService
+    from affinitas_backend.chat.resilience import LLMResilience
+    from affinitas_backend.chat.scheduler import LLMScheduler
+    from affinitas_backend.chat.tracing import TelemetryPipeline
+
+CallbackMetric("affinitas_llm_cancelled_calls_total", "LLM calls cancelled before completion", lambda: {
+    ("client_gone",): cancellation_stats.cancelled_calls,
+    ("timeout",): cancellation_stats.timed_out_calls,
+}, ("reason",), type="counter")
+CallbackMetric("affinitas_llm_cancelled_tokens_saved_total", "Estimated tokens saved by cancelled LLM calls",
+               lambda: {(): cancellation_stats.saved_tokens_estimate}, type="counter")
+CallbackMetric("affinitas_llm_responses_total", "Model-backed NPC replies", lambda: {
+    (operation,): count for operation, count in degraded_stats.responses.items()
+}, ("operation",), type="counter")
+CallbackMetric("affinitas_llm_degraded_responses_total", "NPC replies answered in degraded mode",
+               lambda: dict(degraded_stats.degraded), ("operation", "reason"), type="counter")
+
+
+class ServiceRegistry:
+    def __init__(self, config: Config):
+        self.config = config
+
+    def created(self, name: str) -> bool:
+        """Whether the service has been built, i.e. whether using it is free of startup costs."""
+        return name in self.__dict__
+
+    @cached_property
+    def scheduler(self) -> "LLMScheduler":
+        from affinitas_backend.chat.scheduler import LLMScheduler, Priority
+
+        scheduler = LLMScheduler(config=self.config)
+        CallbackMetric("affinitas_llm_concurrency_limit", "Current AIMD limit of concurrent LLM calls",
+                       lambda: {(): scheduler.limit})
+        CallbackMetric("affinitas_llm_in_flight", "LLM calls in flight", lambda: {(): scheduler.in_flight})
+        CallbackMetric("affinitas_llm_queued", "LLM calls waiting for a slot",
+                       lambda: {(p.name.lower(),): scheduler.queue_length(p) for p in Priority}, ("priority",))
+        return scheduler
+
+    @cached_property
+    def resilience(self) -> "LLMResilience":
+        from affinitas_backend.chat.resilience import LLMResilience
+
+        resilience = LLMResilience(config=self.config)
+        CallbackMetric("affinitas_llm_circuit_open", "Whether the LLM circuit breaker is open or half-open",
+                       lambda: {(): int(resilience.breaker.state != "closed")})
+        CallbackMetric("affinitas_llm_retries_total", "Retried LLM call attempts",
+                       lambda: {(): resilience.retries}, type="counter")
+        CallbackMetric("affinitas_llm_hedged_calls_total", "Hedged LLM call attempts",
+                       lambda: {(): resilience.hedged_calls}, type="counter")
+        return resilience
+
+    @cached_property
+    def http_pool(self) -> "HTTPClientPool":
+        from affinitas_backend.chat.http_pool import HTTPClientPool
+
+        http_pool = HTTPClientPool(config=self.config)
+        CallbackMetric("affinitas_http_pool_requests_total", "Requests sent through the shared HTTP client pool",
+                       lambda: {(): http_pool.requests}, type="counter")
+        CallbackMetric("affinitas_http_pool_connections_total", "Connections opened by the shared HTTP client pool",
+                       lambda: {(): http_pool.new_connections}, type="counter")
+        return http_pool
+
+    @cached_property
+    def telemetry(self) -> "TelemetryPipeline":
+        from affinitas_backend.chat.tracing import TelemetryPipeline, create_exporter
+
+        telemetry = TelemetryPipeline(config=self.config, exporter=create_exporter(self.config))
+        CallbackMetric("affinitas_tracing_spans_total", "Spans handled by the telemetry pipeline", lambda: {
+            ("exported",): telemetry.exported_spans,
+            ("dropped",): telemetry.dropped_spans,
+        }, ("result",), type="counter")
+        return telemetry
+
+    @cached_property
+    def cassette(self) -> "Cassette | None":
+        from affinitas_backend.chat.cassette import create_cassette
+
+        cassette = create_cassette(self.config)
+        if cassette is not None:
+            CallbackMetric("affinitas_llm_cassette_calls_total",
+                           "Model calls recorded to or replayed from the cassette", lambda: {
+                                ("recorded",): cassette.recorded,
+                                ("hit",): cassette.hits,
+                                ("miss",): cassette.misses,
+                            }, ("result",), type="counter")
+        return cassette
+
+    @cached_property
+    def npc_chat(self) -> "NPCChatService":
+        from affinitas_backend.chat.npc_chat import NPCChatService
+
+        npc_chat = NPCChatService(
+            config=self.config, scheduler=self.scheduler, resilience=self.resilience,
+            http_client=self.http_pool.client, telemetry=self.telemetry, cassette=self.cassette
+        )
+        CallbackMetric("affinitas_response_cache_lookups_total", "NPC response cache lookups", lambda: {
+            ("hit",): npc_chat.response_cache.hits,
+            ("miss",): npc_chat.response_cache.misses,
+        }, ("result",), type="counter")
+        CallbackMetric("affinitas_quest_trigger_cache_lookups_total", "Quest trigger index cache lookups", lambda: {
+            ("hit",): npc_chat.quest_triggers.hits,
+            ("miss",): npc_chat.quest_triggers.misses,
+        }, ("result",), type="counter")
+        return npc_chat
+
+    @cached_property
+    def master_llm(self) -> "MasterLLM":
+        from affinitas_backend.chat.master_chat import MasterLLM
+
+        return MasterLLM(
+            config=self.config, scheduler=self.scheduler, resilience=self.resilience,
+            http_client=self.http_pool.client, telemetry=self.telemetry, cassette=self.cassette
+        )
+
+
+services = ServiceRegistry(get_config())
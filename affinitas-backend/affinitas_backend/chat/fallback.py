@@ -0,0 +1,106 @@
+import logging
+import random
+from collections import Counter
+
+from beanie import PydanticObjectId
+
+from affinitas_backend.models.beanie.npc import NPC
+from affinitas_backend.models.chat.chat import OpenAI_NPCChatResponse, NPCDataDelta
+
+
+class DegradedModeStats:
+    """Model-backed replies per operation, and how many of them were answered by the fallback responder."""
+
+    def __init__(self):
+        self.responses: Counter[str] = Counter()
+        self.degraded: Counter[tuple[str, str]] = Counter()  # (operation, reason) -> count
+
+    def record(self, operation: str, degraded_reason: str | None = None):
+        self.responses[operation] += 1
+        if degraded_reason:
+            self.degraded[(operation, degraded_reason)] += 1
+
+    def degraded_rate(self, operation: str) -> float:
+        responses = self.responses[operation]
+        degraded = sum(count for (op, _), count in self.degraded.items() if op == operation)
+        return degraded / responses if responses else 0.0
+
+
+degraded_stats = DegradedModeStats()
+
+
+class FallbackResponder:
+    """
+    Answers NPC turns locally when the model cannot answer in time. The reply is picked from a template bank
+    by the tone of the NPC's personality, and leaves affinitas, the NPC's profile and quests unchanged.
+    """
+
+    def __init__(self):
+        # npc_id -> (name, tone); the NPC catalog does not change at runtime
+        self._personas: dict[PydanticObjectId, tuple[str, str]] = {}
+
+    async def respond(self, npc_id: PydanticObjectId, operation: str, reason: str) -> OpenAI_NPCChatResponse:
+        name, tone = await self._get_persona(npc_id)
+        templates = FALLBACK_TEMPLATES.get(operation, FALLBACK_TEMPLATES["npc_chat"])
+
+        degraded_stats.record(operation, reason)
+        logging.warning(f"Answering {operation} for NPC {npc_id} in degraded mode ({reason}, "
+                        f"degraded rate: {degraded_stats.degraded_rate(operation):.2%})")
+
+        return OpenAI_NPCChatResponse(
+            response=random.choice(templates[tone]).format(name=name),
+            affinitas_change="neutral",
+            delta=NPCDataDelta(),
+            completed_quests=[],
+        )
+
+    async def _get_persona(self, npc_id: PydanticObjectId) -> tuple[str, str]:
+        if npc_id not in self._personas:
+            npc = await NPC.get_motor_collection().find_one({"_id": npc_id}, {"name": 1, "personality": 1}) or {}
+            self._personas[npc_id] = (npc.get("name", "The villager"), _personality_tone(npc.get("personality", [])))
+
+        return self._personas[npc_id]
+
+
+def _personality_tone(personality: list[str]) -> str:
+    words = {word.strip(".,;").lower() for trait in personality for word in trait.split()}
+    for tone, keywords in TONE_KEYWORDS.items():
+        if words & keywords:
+            return tone
+
+    return "neutral"
+
+
+TONE_KEYWORDS = {
+    "warm": {"kind", "friendly", "cheerful", "warm", "gentle", "caring", "generous", "optimistic", "compassionate"},
+    "curt": {"grumpy", "rude", "cold", "stern", "gruff", "arrogant", "suspicious", "cynical", "irritable", "bitter"},
+}
+
+FALLBACK_TEMPLATES = {
+    "npc_chat": {
+        "warm": [
+            "*{name} smiles, but seems lost in thought.* Forgive me, friend, my mind is elsewhere. Ask me again "
+            "in a moment?",
+            "*{name} nods warmly.* I hear you. Let me gather my thoughts before I answer properly.",
+        ],
+        "curt": [
+            "*{name} waves a hand dismissively.* Not now. Come back later.",
+            "*{name} grunts without looking up.* I'm busy. Ask me again in a bit.",
+        ],
+        "neutral": [
+            "*{name} pauses, distracted.* Hm? Sorry, I didn't quite catch that. Give me a moment.",
+            "*{name} looks away for a moment.* Let me think about that. We can talk again shortly.",
+        ],
+    },
+    "give_item": {
+        "warm": [
+            "*{name} takes it gently.* Oh, for me? Thank you, I'll keep it safe.",
+        ],
+        "curt": [
+            "*{name} takes it without a word and sets it aside.*",
+        ],
+        "neutral": [
+            "*{name} turns it over in their hands.* I'll hold on to this. Thank you.",
+        ],
+    },
+}
@@ -0,0 +1,74 @@
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+
+from affinitas_backend.config import Config
+
+
+class HTTPClientPool:
+    """
+    Process-wide async HTTP client shared by all model wrappers, so that connections to the provider are
+    pooled and kept alive across services instead of being re-established after idle periods.
+
+    Connection reuse is tracked through httpcore's trace extension: every request that does not open a new
+    TCP connection reused a pooled one.
+    """
+
+    def __init__(self, config: Config):
+        self.warm_connections = config.http_warm_connections
+        # The stand-in provider makes no HTTP calls
+        self.warm_url = config.http_warm_url if config.llm_provider == "openai" else None
+
+        http2 = config.http2_enabled
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("HTTP/2 requires the `h2` package (`pip install httpx[http2]`); falling back to HTTP/1.1")
+            http2 = False
+
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.http_max_connections,
+                max_keepalive_connections=config.http_max_keepalive_connections,
+                keepalive_expiry=config.http_keepalive_expiry_seconds,
+            ),
+            timeout=httpx.Timeout(config.llm_client_timeout_seconds, connect=config.http_connect_timeout_seconds),
+            event_hooks={"request": [self._on_request]},
+        )
+
+    @property
+    def reuse_ratio(self) -> float:
+        return 1 - self.new_connections / self.requests if self.requests else 0.0
+
+    async def warm_up(self):
+        """Opens `warm_connections` keep-alive connections to the provider, so the first requests skip the handshake."""
+        if not self.warm_connections or not self.warm_url:
+            return
+
+        res = await asyncio.gather(
+            *(self.client.head(self.warm_url) for _ in range(self.warm_connections)),
+            return_exceptions=True
+        )
+        failures = [r for r in res if isinstance(r, Exception)]
+        if failures:
+            logging.warning(f"Failed to warm {len(failures)} HTTP connections to {self.warm_url}: {failures[0]!r}")
+
+    async def aclose(self):
+        await self.client.aclose()
+        logging.info(f"Closed HTTP client pool ({self.requests} requests, {self.new_connections} connections, "
+                     f"reuse ratio: {self.reuse_ratio:.2%})")
+
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.new_connections += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
@@ -2,36 +2,49 @@ import asyncio
 from typing import Any
 
 import bson.json_util
+import httpx
 from beanie import PydanticObjectId
-from langchain.chat_models import init_chat_model
 from pydantic import TypeAdapter
 
-from affinitas_backend.chat.utils import NPC_DATA_TEMPLATE, pretty_quests, QUEST_PROMPT_TEMPLATE, \
-    ENDING_PROMPT_TEMPLATE, with_tracing, get_npc_data
+from affinitas_backend.chat.cassette import Cassette
+from affinitas_backend.chat.resilience import LLMResilience
+from affinitas_backend.chat.scheduler import LLMScheduler, Priority
+from affinitas_backend.chat.tracing import TelemetryPipeline
+from affinitas_backend.chat.usage import record_usage
+from affinitas_backend.chat.utils import QUEST_PROMPT_TEMPLATE, ENDING_PROMPT_TEMPLATE, with_tracing, get_npc_data, \
+    init_model, format_npc_data, with_cassette
 from affinitas_backend.config import Config
 from affinitas_backend.models.chat.chat import NPCData
+from affinitas_backend.timing import timed
 
 
 class MasterLLM:
-    def __init__(self, config: Config):
+    def __init__(
+            self,
+            config: Config,
+            scheduler: LLMScheduler,
+            resilience: LLMResilience,
+            http_client: httpx.AsyncClient,
+            telemetry: TelemetryPipeline,
+            cassette: Cassette | None = None
+    ):
         self.config = config
-        self.model = init_chat_model(
-            model=config.openai_model_name,
-            model_provider="openai",
-            api_key=config.openai_api_key,
-        )
+        self.scheduler = scheduler
+        self.resilience = resilience
+        self.model = with_cassette(init_model(config, http_client), config, cassette)
 
         if self.config.langsmith_tracing:
-            self.model = with_tracing(self.model, self.config)
+            self.model = with_tracing(self.model, telemetry)
 
     async def get_quest_responses(self, quests: list[dict], shadow_save_id: PydanticObjectId,
                                   npc_id: PydanticObjectId) -> list[dict]:
-        npc = await get_npc_data(
-            shadow_save_id,
-            npc_id,
-            include_chat_history=False,
-            include_static_data=True,
-        )
+        with timed("db"):
+            npc = await get_npc_data(
+                shadow_save_id,
+                npc_id,
+                include_chat_history=False,
+                include_static_data=True,
+            )
 
         if not npc:
             raise ValueError(f"NPC with ID {npc_id} not found in shadow save {shadow_save_id}.")
@@ -40,36 +53,21 @@ class MasterLLM:
             npc_data_validator = TypeAdapter(NPCData)
             npc_data_validator.validate_python(npc, strict=True)
 
-        affinitas_increase = npc["affinitas_config"]["increase"]
-        affinitas_decrease = npc["affinitas_config"]["decrease"]
-
+        npc_data = format_npc_data(npc)
         messages = [
-            self.model.ainvoke(
+            self._paraphrase_quest(
                 QUEST_PROMPT_TEMPLATE.format(
-                    npc_data=NPC_DATA_TEMPLATE.format(
-                        name=npc["name"],
-                        age=npc["age"],
-                        occupation=npc.get("occupation", "Unknown"),
-                        backstory=npc["backstory"],
-                        personality=", ".join(npc["personality"]),
-                        motivations=", ".join(npc["motivations"]),
-                        likes=", ".join(npc["likes"] or ["Unspecified"]),
-                        dislikes=", ".join(npc["dislikes"] or ["Unspecified"]),
-                        dialogue_unlocks=", ".join(npc["dialogue_unlocks"]),
-                        quests=pretty_quests(npc["quests"]),
-                        affinitas=npc["affinitas"],
-                        affinitas_up=isinstance(affinitas_increase, float) and f"{affinitas_increase:.2f}" or ", ".join(
-                            affinitas_increase),
-                        affinitas_down=isinstance(affinitas_decrease,
-                                                  float) and f"{affinitas_decrease:.2f}" or ", ".join(
-                            affinitas_decrease),
-                    ),
+                    npc_data=npc_data,
                     quest_description=quest["description"]
                 )
             ) for quest in quests if quest["description"] is not None
         ]
 
-        res = await asyncio.gather(*messages)
+        # The calls run concurrently, so they are timed together
+        with timed("llm"):
+            res = await asyncio.gather(*messages)
+        for message in res:
+            record_usage(message, "quest")
 
         return [
             {
@@ -79,7 +77,23 @@ class MasterLLM:
             for quest, message in zip(quests, res)
         ]
 
-    def generate_ending(self, npc_infos: list[dict[str, Any]]):
-        return self.model.invoke(
-            ENDING_PROMPT_TEMPLATE.format(game_state=bson.json_util.dumps(npc_infos))
+    async def _paraphrase_quest(self, prompt: str):
+        self.resilience.breaker.check()
+        return await self.scheduler.run(
+            Priority.QUEST, lambda: self.resilience.call(
+                "quest", lambda: self.model.ainvoke(prompt, config={"metadata": {"operation": "quest"}})
+            )
         )
+
+    async def generate_ending(self, npc_infos: list[dict[str, Any]]):
+        prompt = ENDING_PROMPT_TEMPLATE.format(game_state=bson.json_util.dumps(npc_infos))
+        self.resilience.breaker.check()
+        with timed("llm"):
+            res = await self.scheduler.run(
+                Priority.ENDING, lambda: self.resilience.call(
+                    "ending", lambda: self.model.ainvoke(prompt, config={"metadata": {"operation": "ending"}})
+                )
+            )
+        record_usage(res, "ending")
+
+        return res
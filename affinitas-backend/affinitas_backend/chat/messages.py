@@ -0,0 +1,19 @@
+from typing import Literal, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+
+def get_message(role: Literal["user", "ai", "system"], content: str) -> "BaseMessage":
+    # Imported here, so that importing the routes does not import langchain
+    from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+    match role:
+        case "user":
+            return HumanMessage(content)
+        case "ai":
+            return AIMessage(content)
+        case "system":
+            return SystemMessage(content)
+
+    raise ValueError(f"Unknown message type: {role}")
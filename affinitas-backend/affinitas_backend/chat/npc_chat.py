@@ -1,22 +1,32 @@
-from typing import cast, TypedDict
+import asyncio
+from typing import cast, TypedDict, Any
 
+import httpx
 from beanie import PydanticObjectId
-from langchain.chat_models import init_chat_model
-from langchain_core.messages import HumanMessage, AIMessage, BaseMessage, trim_messages
-from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.messages import HumanMessage, AIMessage, BaseMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from pydantic import TypeAdapter
 
+from affinitas_backend.chat.cache import ResponseCache
+from affinitas_backend.chat.cassette import Cassette
+from affinitas_backend.chat.fallback import FallbackResponder, degraded_stats
+from affinitas_backend.chat.resilience import LLMResilience, CircuitOpenError
+from affinitas_backend.chat.scheduler import LLMScheduler, Priority
+from affinitas_backend.chat.state import ChatHistory, NPCState
+from affinitas_backend.chat.tracing import TelemetryPipeline
+from affinitas_backend.chat.triggers import QuestTriggerCache
+from affinitas_backend.chat.usage import record_usage
 from affinitas_backend.chat.utils import (
     NPC_PROMPT_TEMPLATE,
     AFFINITAS_CHANGE_MAP,
-    get_message,
     pretty_quests,
-    with_tracing, get_npc_data
+    pretty_linked_quests,
+    with_tracing, get_npc_data, init_model, with_cassette
 )
 from affinitas_backend.config import Config
 from affinitas_backend.db.utils import get_thread_id
 from affinitas_backend.models.chat.chat import OpenAI_NPCChatResponse, NPCChatState
+from affinitas_backend.timing import timed
 
 
 class UpdatedNPCData(TypedDict):
@@ -30,82 +40,134 @@ class GetResponse(TypedDict):
     message: str
     updated_npc_data: UpdatedNPCData
     completed_quests: list[str]
+    # Index of the reply in the NPC's chat history if it was answered in degraded mode
+    degraded_turn: int | None
 
 
 class NPCChatService:
-    def __init__(self, config: Config):
+    def __init__(
+            self,
+            config: Config,
+            scheduler: LLMScheduler,
+            resilience: LLMResilience,
+            http_client: httpx.AsyncClient,
+            telemetry: TelemetryPipeline,
+            cassette: Cassette | None = None
+    ):
         self.config = config
-        self.model = init_chat_model(
-            model=config.openai_model_name,
-            model_provider="openai",
-            api_key=config.openai_api_key,
-        ).with_structured_output(OpenAI_NPCChatResponse)
+        self.scheduler = scheduler
+        self.resilience = resilience
+        self.model = with_cassette(
+            init_model(config, http_client).with_structured_output(OpenAI_NPCChatResponse, include_raw=True),
+            config, cassette, OpenAI_NPCChatResponse
+        )
 
         if self.config.langsmith_tracing:
-            self.model = with_tracing(self.model, self.config)
-
-        self.trimmer = trim_messages(
-            max_tokens=config.langchain_max_tokens,
-            include_system=True,
-            start_on="human",
-            token_counter=count_tokens_approximately
-        )
+            self.model = with_tracing(self.model, telemetry)
 
         self.prompt_template = ChatPromptTemplate.from_messages([
             ("system", NPC_PROMPT_TEMPLATE),
             MessagesPlaceholder(variable_name="messages")
         ])
 
+        self.response_cache = ResponseCache(config)
+        self.quest_triggers = QuestTriggerCache(config)
+        self.fallback = FallbackResponder()
+
     async def get_response(
             self,
             message: BaseMessage,
             npc_id: PydanticObjectId,
             shadow_save_id: PydanticObjectId,
-            *, invoke_model: bool = False
+            *, invoke_model: bool = False,
+            operation: str = "npc_chat",
+            client_uuid: str | None = None
     ) -> GetResponse | None:
-        thread_id = await get_thread_id(shadow_save_id, npc_id)
+        with timed("db"):
+            thread_id = await get_thread_id(shadow_save_id, npc_id)
 
         if thread_id is None:
             raise ValueError(f"Thread ID not found for NPC ID {npc_id} and ShadowSave ID {shadow_save_id}")
 
-        npc, chat_history = await self._get_npc_state(shadow_save_id, npc_id)
-        prev_completed_quests = npc["completed_quests"].copy() if npc else []
+        with timed("db"):
+            npc, chat_history = await self._get_npc_state(shadow_save_id, npc_id)
         if npc is None:
             raise ValueError(f"NPC with ID {npc_id} not found")
+        prev_completed_quests = npc.completed_quests.copy()
 
         invoke_model = invoke_model or isinstance(message, HumanMessage)
 
-        res = self.call_model(chat_history + [message], npc)
+        # Only the quests whose triggers occur in the player's message are brought up to the model
+        linked_quests = []
+        if isinstance(message, HumanMessage):
+            with timed("db"):
+                linked_quests = await self.quest_triggers.match(shadow_save_id, npc_id, message.content, client_uuid)
+
+        res = await self.call_model(
+            chat_history, message, npc, npc_id=npc_id, linked_quests=linked_quests, operation=operation
+        )
 
         if invoke_model:
             return cast(GetResponse, {
                 "message": res["messages"][-1].content,
                 "updated_npc_data": {
-                    "affinitas": npc["affinitas"],
-                    "occupation": npc["occupation"],
-                    "likes": npc["likes"],
-                    "dislikes": npc["dislikes"],
+                    "affinitas": npc.affinitas,
+                    "occupation": npc.occupation,
+                    "likes": npc.likes,
+                    "dislikes": npc.dislikes,
                 },
                 "completed_quests": list(
-                    set(npc["completed_quests"]) - set(prev_completed_quests)
-                )
+                    set(npc.completed_quests) - set(prev_completed_quests)
+                ),
+                # The message and the reply are appended after the current history
+                "degraded_turn": len(chat_history) + 1 if res["degraded"] else None,
             })
 
         return None
 
-    def call_model(self, messages: list[BaseMessage], npc: NPCChatState):
-        trimmed_messages = messages
-
-        prompt = self.prompt_template.format_prompt(
-            messages=trimmed_messages,
-            occupation=npc["occupation"] or "Unknown",
-            likes=", ".join(npc["likes"] or ["Unspecified"]),
-            dislikes=", ".join(npc["dislikes"] or ["Unspecified"]),
-            quests=pretty_quests(npc["quests"]),
-            affinitas=npc["affinitas"],
-        )
-
-        res = self.model.invoke(prompt)
+    async def call_model(
+            self,
+            history: ChatHistory,
+            message: BaseMessage,
+            npc: NPCState, *,
+            npc_id: PydanticObjectId = None,
+            linked_quests: list[dict[str, Any]] = None,
+            operation: str = "npc_chat"
+    ):
+        linked_quests_context = pretty_linked_quests(linked_quests)
+        # The key is computed before `_update_npc` mutates the state
+        cache_key = npc_id and self.response_cache.key_for(npc_id, npc, history, message, linked_quests_context)
+
+        degraded = False
+        res = cache_key and self.response_cache.get(cache_key)
+        if not res:
+            prompt = self.prompt_template.format_prompt(
+                # Messages are only built for the part of the history that is sent
+                messages=history.window(self.config.langchain_max_tokens) + [message],
+                occupation=npc.occupation or "Unknown",
+                likes=", ".join(npc.likes or ["Unspecified"]),
+                dislikes=", ".join(npc.dislikes or ["Unspecified"]),
+                quests=pretty_quests(npc.quests),
+                linked_quests=linked_quests_context,
+                affinitas=npc.affinitas,
+            )
+
+            slo = self.config.llm_latency_slo_seconds.get(operation) if self.config.degraded_mode_enabled else None
+            try:
+                res = await asyncio.wait_for(self._invoke_model(prompt, operation), slo)
+            except (asyncio.TimeoutError, CircuitOpenError) as e:
+                if isinstance(e, CircuitOpenError) and not self.config.degraded_mode_enabled:
+                    raise
+
+                reason = "circuit_open" if isinstance(e, CircuitOpenError) else "slo_timeout"
+                res = await self.fallback.respond(npc_id, operation, reason=reason)
+                degraded = True
+            else:
+                if cache_key:
+                    self.response_cache.put(cache_key, res)
+
+        if not degraded:
+            degraded_stats.record(operation)
 
         response = res.response
         affinitas_change = res.affinitas_change
@@ -127,13 +189,29 @@ class NPCChatService:
 
         return {
             "messages": [AIMessage(response)],
+            "degraded": degraded,
         }
 
+    async def _invoke_model(self, prompt, operation: str) -> OpenAI_NPCChatResponse:
+        self.resilience.breaker.check()
+        with timed("llm"):
+            output = await self.scheduler.run(
+                Priority.CHAT, lambda: self.resilience.call(
+                    operation, lambda: self.model.ainvoke(prompt, config={"metadata": {"operation": operation}})
+                )
+            )
+        record_usage(output["raw"], operation)
+
+        if output["parsing_error"]:
+            raise output["parsing_error"]
+
+        return output["parsed"]
+
     async def _get_npc_state(
             self,
             shadow_save_id: PydanticObjectId,
             npc_id: PydanticObjectId,
-    ) -> tuple[NPCChatState | None, list[BaseMessage]]:
+    ) -> tuple[NPCState | None, ChatHistory]:
         npc = await get_npc_data(
             shadow_save_id,
             npc_id,
@@ -143,17 +221,17 @@ class NPCChatService:
 
         if npc:
             if self.config.env == "dev":
-                npc_state_validator = TypeAdapter(NPCChatState)
-                npc_state_validator.validate_python(npc, strict=True)
+                with timed("validate"):
+                    npc_state_validator = TypeAdapter(NPCChatState)
+                    npc_state_validator.validate_python(npc, strict=True)
 
-            return cast(NPCChatState, npc), [get_message(msg_type, msg_content) for msg_type, msg_content in
-                                             npc.pop("chat_history")]
+            return NPCState.from_bson(npc), ChatHistory.from_bson(npc.pop("chat_history"))
 
-        return None, []
+        return None, ChatHistory(bytearray(), [])
 
 
 def _update_npc(
-        npc: NPCChatState, *,
+        npc: NPCState, *,
         affinitas_change: int = 0,
         occupation: str | None = None,
         likes: list[str] = None,
@@ -161,20 +239,16 @@ def _update_npc(
         completed_quests: list[str] = None
 ):
     if affinitas_change:
-        npc["affinitas"] += affinitas_change
-        npc["affinitas"] = max(0, min(100, npc["affinitas"]))
+        npc.affinitas = max(0, min(100, npc.affinitas + affinitas_change))
 
-    if occupation and not npc["occupation"]:
-        npc["occupation"] = occupation
+    if occupation and not npc.occupation:
+        npc.occupation = occupation
 
     if likes:
-        npc["likes"].extend(likes)
-        npc["likes"] = list(set(npc["likes"]))
+        npc.likes = list(set(npc.likes + likes))
 
     if dislikes:
-        npc["dislikes"].extend(dislikes)
-        npc["dislikes"] = list(set(npc["dislikes"]))
+        npc.dislikes = list(set(npc.dislikes + dislikes))
 
     if completed_quests:
-        npc["completed_quests"].extend(completed_quests)
-        npc["completed_quests"] = list(set(npc["completed_quests"]))
+        npc.completed_quests = list(set(npc.completed_quests + completed_quests))
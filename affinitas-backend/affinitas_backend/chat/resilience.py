@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar, Literal
+
+from affinitas_backend.chat.scheduler import LLMOverloadedError
+from affinitas_backend.config import Config
+from affinitas_backend.metrics import llm_call_duration
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(LLMOverloadedError):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling the provider while it is failing.
+
+    The circuit opens when at least `error_rate` of the calls in the last `window` seconds failed, provided
+    there were at least `min_calls` of them. While open, calls fail fast with `CircuitOpenError`. After
+    `open_seconds`, the circuit is half-open: one probe call is let through every `open_seconds`, and the
+    circuit closes on the first success.
+    """
+
+    def __init__(self, window: float, min_calls: int, error_rate: float, open_seconds: float):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+
+        self.state: Literal["closed", "open", "half_open"] = "closed"
+        self.times_opened = 0
+
+        self._outcomes: deque[tuple[float, bool]] = deque()  # (time, failed)
+        self._next_probe_at = 0.0
+
+    def check(self):
+        if self.state == "closed":
+            return
+
+        now = time.monotonic()
+        if now < self._next_probe_at:
+            raise CircuitOpenError("LLM provider circuit breaker is open", self._next_probe_at - now)
+
+        self.state = "half_open"
+        self._next_probe_at = now + self.open_seconds
+
+    def record(self, failed: bool):
+        now = time.monotonic()
+
+        if self.state != "closed":
+            if failed:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._outcomes.clear()
+                logging.warning("LLM provider circuit breaker closed")
+            return
+
+        self._outcomes.append((now, failed))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+
+        failures = sum(failed for _, failed in self._outcomes)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_rate:
+            self._open(now)
+
+    def _open(self, now: float):
+        self.state = "open"
+        self.times_opened += 1
+        self._next_probe_at = now + self.open_seconds
+        logging.warning(f"LLM provider circuit breaker opened for {self.open_seconds:.0f}s")
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries and hedged requests to `ratio` extra attempts per call, so that a provider
+    brownout does not multiply the load on it. Up to `max_tokens` unused tokens are kept for bursts.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class LLMResilience:
+    """
+    Wraps single model calls with per-operation timeouts, retries with full jitter limited by a `RetryBudget`,
+    optional hedged requests and a `CircuitBreaker` shared by all operations.
+
+    A hedged request is a second attempt started when the first one has been running for longer than the
+    p95 latency of the operation; whichever finishes first is used and the other one is cancelled.
+
+    Callers check `breaker` before taking a scheduler slot, so that calls failing fast while the circuit is
+    open neither occupy a slot nor count as completed calls.
+    """
+
+    def __init__(self, config: Config):
+        self.timeouts = config.llm_timeout_seconds
+        self.default_timeout = config.llm_client_timeout_seconds
+        self.max_retries = config.llm_max_retries
+        self.retry_base_delay = config.llm_retry_base_delay_seconds
+        self.hedge_enabled = config.llm_hedge_enabled
+        self.hedge_min_samples = config.llm_hedge_min_samples
+
+        self.breaker = CircuitBreaker(
+            config.llm_circuit_window_seconds,
+            config.llm_circuit_min_calls,
+            config.llm_circuit_error_rate,
+            config.llm_circuit_open_seconds,
+        )
+        self.retry_budget = RetryBudget(config.llm_retry_budget_ratio, config.llm_retry_budget_max_tokens)
+
+        self.retries = 0
+        self.timed_out_attempts = 0
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+
+        self._latencies: dict[str, deque[float]] = {}
+
+    async def call(self, operation: str, call: Callable[[], Awaitable[T]]) -> T:
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                return await self._hedged_attempt(operation, call)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise
+
+                attempt += 1
+                self.retries += 1
+                delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+                logging.info(f"Retrying {operation} model call in {delay:.2f}s (attempt {attempt}): {e!r}")
+
+                await asyncio.sleep(delay)
+                self.breaker.check()
+
+    def p95_latency(self, operation: str) -> float | None:
+        latencies = self._latencies.get(operation)
+        if not latencies or len(latencies) < self.hedge_min_samples:
+            return None
+
+        return sorted(latencies)[int(len(latencies) * 0.95)]
+
+    async def _hedged_attempt(self, operation: str, call: Callable[[], Awaitable[T]]) -> T:
+        hedge_delay = self.hedge_enabled and self.p95_latency(operation)
+        if not hedge_delay:
+            return await self._attempt(operation, call)
+
+        tasks = [asyncio.ensure_future(self._attempt(operation, call))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done or not self.retry_budget.withdraw():
+                return await tasks[0]
+
+            self.hedged_calls += 1
+            tasks.append(asyncio.ensure_future(self._attempt(operation, call)))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.hedge_wins += task is tasks[1]
+                        return task.result()
+
+                    error = task.exception()
+
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _attempt(self, operation: str, call: Callable[[], Awaitable[T]]) -> T:
+        start = time.monotonic()
+        try:
+            res = await asyncio.wait_for(call(), self.timeouts.get(operation, self.default_timeout))
+        except asyncio.TimeoutError:
+            self.timed_out_attempts += 1
+            self.breaker.record(failed=True)
+            llm_call_duration.observe(time.monotonic() - start, operation, "timeout")
+            raise
+        except Exception as e:
+            # Errors such as parsing failures or local overload say nothing about the provider's health
+            if is_retryable(e):
+                self.breaker.record(failed=True)
+            llm_call_duration.observe(time.monotonic() - start, operation, "error")
+            raise
+
+        latency = time.monotonic() - start
+        self.breaker.record(failed=False)
+        self._latencies.setdefault(operation, deque(maxlen=200)).append(latency)
+        llm_call_duration.observe(latency, operation, "ok")
+
+        return res
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, LLMOverloadedError):
+        return False
+
+    import openai  # Imported on the first failed call instead of at startup
+
+    return (
+            isinstance(e, (asyncio.TimeoutError, openai.APIConnectionError))
+            or getattr(e, "status_code", None) in RETRYABLE_STATUS_CODES
+    )
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Awaitable, Callable, TypeVar
+
+from affinitas_backend.chat.usage import record_cancellation, CLIENT_GONE
+from affinitas_backend.config import Config
+
+T = TypeVar("T")
+
+# `time.monotonic()` deadline announced by the client for the current request, if any
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+class Priority(IntEnum):
+    """Priority classes of outbound LLM calls. Lower values are dispatched first."""
+    CHAT = 0
+    QUEST = 1
+    ENDING = 2
+
+
+class LLMOverloadedError(Exception):
+    """Raised when an LLM call cannot be started before the client gives up on the request."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """
+    Central dispatcher for outbound LLM calls.
+
+    At most `limit` calls run at once. The limit follows AIMD: it grows by `1 / limit` after every call that
+    succeeded within the latency target, and is halved when the provider rate limits us, a call times out or
+    exceeds the latency target. Only calls started after the last decrease can decrease it again, so a burst
+    of slow calls halves it once. Calls cancelled by a timeout of the caller count as timed out, calls
+    cancelled because the client went away say nothing about the provider and leave it as is.
+    Calls beyond the limit wait in bounded per-priority queues and are dispatched in priority order. A call
+    is rejected early if its queue is full or it would not finish before the client times out.
+    """
+
+    def __init__(self, config: Config):
+        self.min_limit = config.llm_min_concurrency
+        self.max_limit = config.llm_max_concurrency
+        self.max_queue_size = config.llm_max_queue_size
+        self.latency_target = config.llm_latency_target_seconds
+        self.client_timeout = config.llm_client_timeout_seconds
+
+        self.limit = float(config.llm_initial_concurrency)
+        self.in_flight = 0
+        self.avg_latency = self.latency_target / 2  # EWMA of observed call latencies
+        self._last_decrease = float("-inf")
+
+        self._queues: dict[Priority, deque[asyncio.Future]] = {priority: deque() for priority in Priority}
+
+    async def run(self, priority: Priority, call: Callable[[], Awaitable[T]]) -> T:
+        deadline = time.monotonic() + self.client_timeout
+        if (client_deadline := request_deadline.get()) is not None:
+            deadline = min(deadline, client_deadline)
+
+        if self.in_flight < int(self.limit) and not self._queued_ahead(priority):
+            self.in_flight += 1
+        else:
+            try:
+                await self._wait_for_slot(priority, deadline)  # The slot is reserved by `_dispatch`
+            except asyncio.CancelledError as e:
+                record_cancellation(started=False, by_client=CLIENT_GONE in e.args)
+                raise
+
+        start = time.monotonic()
+        try:
+            res = await call()
+        except asyncio.CancelledError as e:
+            by_client = CLIENT_GONE in e.args
+            record_cancellation(started=True, by_client=by_client)
+            if by_client:
+                self._release()
+            else:
+                # Cancelled by the caller's timeout, e.g. the latency SLO of the operation
+                self._on_complete(start, overloaded=True)
+            raise
+        except Exception as e:
+            if getattr(e, "status_code", None) == 429 or isinstance(e, asyncio.TimeoutError):
+                self._on_complete(start, overloaded=True)
+            else:
+                self._release()  # Failed calls do not show that there is capacity to spare
+            raise
+
+        self._on_complete(start, overloaded=False)
+        return res
+
+    async def _wait_for_slot(self, priority: Priority, deadline: float):
+        queue = self._queues[priority]
+        if len(queue) >= self.max_queue_size:
+            raise LLMOverloadedError(f"LLM queue for {priority.name} is full", self.avg_latency)
+
+        # Everything queued at the same or a higher priority runs first, `limit` calls at a time
+        expected_wait = (self._queued_ahead(priority) + 1) / max(self.limit, 1) * self.avg_latency
+        if time.monotonic() + expected_wait + self.avg_latency > deadline:
+            raise LLMOverloadedError(
+                f"LLM call for {priority.name} would not finish before the client timeout", expected_wait
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, deadline - self.avg_latency - time.monotonic())
+        except BaseException as e:
+            if waiter in queue:
+                queue.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # A slot was handed over while the call was giving up; pass it on
+                self._release()
+
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMOverloadedError(
+                    f"LLM call for {priority.name} timed out in the queue", self.avg_latency
+                ) from None
+            raise
+
+    def queue_length(self, priority: Priority) -> int:
+        return len(self._queues[priority])
+
+    def _queued_ahead(self, priority: Priority) -> int:
+        return sum(len(self._queues[p]) for p in Priority if p <= priority)
+
+    def _on_complete(self, start: float, overloaded: bool):
+        now = time.monotonic()
+        latency = now - start
+        self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+
+        if overloaded or latency > self.latency_target:
+            # Calls started before the last decrease ran under the previous limit
+            if start >= self._last_decrease:
+                self.limit = max(self.min_limit, self.limit / 2)
+                self._last_decrease = now
+                logging.info(f"LLM concurrency limit decreased to {self.limit:.2f} "
+                             f"(overloaded: {overloaded}, latency: {latency:.2f}s)")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+        self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        free_slots = int(self.limit) - self.in_flight
+        for priority in Priority:
+            queue = self._queues[priority]
+            while free_slots > 0 and queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self.in_flight += 1
+                    waiter.set_result(None)
+                    free_slots -= 1
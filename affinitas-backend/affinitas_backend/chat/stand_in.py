@@ -0,0 +1,105 @@
+import asyncio
+import random
+import time
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForLLMRun, AsyncCallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatResult, ChatGeneration
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+
+class StandInProviderError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"Stand-in provider error {status_code}")
+        self.status_code = status_code
+
+
+class StandInChatModel(BaseChatModel):
+    """
+    Local stand-in for the OpenAI chat model, selected with `LLM_PROVIDER=stand-in`.
+
+    Replies with canned text after `latency_seconds` (with up to `latency_jitter_seconds` added), and fails with
+    a 429/5xx `StandInProviderError` at `error_rate`, so that load tests and the resilience layer can be
+    exercised without spending tokens. Structured output returns a valid instance of the schema.
+    """
+
+    latency_seconds: float = 0.5
+    latency_jitter_seconds: float = 0.0
+    error_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stand-in"
+
+    def _generate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: CallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self._latency())
+        return self._reply(messages)
+
+    async def _agenerate(
+            self,
+            messages: list[BaseMessage],
+            stop: list[str] | None = None,
+            run_manager: AsyncCallbackManagerForLLMRun | None = None,
+            **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self._latency())
+        return self._reply(messages)
+
+    def with_structured_output(self, schema: type[BaseModel], *, include_raw: bool = False, **kwargs: Any):
+        def parse(raw: AIMessage) -> Any:
+            parsed = schema.model_validate(_stand_in_fields(schema, raw.content))
+            return {"raw": raw, "parsed": parsed, "parsing_error": None} if include_raw else parsed
+
+        def respond(model_input: Any) -> Any:
+            return parse(self.invoke(model_input))
+
+        async def arespond(model_input: Any) -> Any:
+            return parse(await self.ainvoke(model_input))
+
+        return RunnableLambda(respond, afunc=arespond)
+
+    def _latency(self) -> float:
+        return self.latency_seconds + random.uniform(0, self.latency_jitter_seconds)
+
+    def _reply(self, messages: list[BaseMessage]) -> ChatResult:
+        if random.random() < self.error_rate:
+            raise StandInProviderError(random.choice([429, 500, 503]))
+
+        last_message = str(messages[-1].content) if messages else ""
+        content = f"*nods* I hear you. ({last_message[:40]})"
+
+        input_tokens = count_tokens_approximately(messages)
+        output_tokens = count_tokens_approximately([AIMessage(content)])
+        message = AIMessage(content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def _stand_in_fields(schema: type[BaseModel], text: str) -> dict[str, Any]:
+    """Fills the required fields of the schema; optional ones keep their defaults."""
+    fields = {}
+    for name, field in schema.model_fields.items():
+        if not field.is_required():
+            continue
+
+        annotation = field.annotation
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            fields[name] = _stand_in_fields(annotation, text)
+        else:
+            fields[name] = text
+
+    return fields
@@ -0,0 +1,117 @@
+"""
+Compact per-turn state of an NPC conversation.
+
+The chat history of an NPC grows by two messages per turn and is read on every turn, so it is kept as one byte
+per message role and a list of the message texts decoded from BSON, which are shared rather than copied.
+LangChain messages are only built for the window of the history that is sent to the model.
+"""
+import math
+from enum import IntEnum
+from typing import Any, Iterator
+
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+
+from affinitas_backend.models.chat.chat import QuestState
+
+
+class Role(IntEnum):
+    USER = 0
+    AI = 1
+    SYSTEM = 2
+
+
+class QuestStatus(IntEnum):
+    PENDING = 0
+    ACTIVE = 1
+    COMPLETED = 2
+
+
+_ROLE_NAMES = tuple(role.name.lower() for role in Role)
+_ROLES = {name: Role(i) for i, name in enumerate(_ROLE_NAMES)}
+_MESSAGE_CLASSES = (HumanMessage, AIMessage, SystemMessage)
+
+_STATUS_NAMES = tuple(status.name.lower() for status in QuestStatus)
+_STATUSES = {name: QuestStatus(i) for i, name in enumerate(_STATUS_NAMES)}
+
+
+class ChatHistory:
+    __slots__ = ("roles", "contents")
+
+    def __init__(self, roles: bytearray, contents: list[str]):
+        self.roles = roles
+        self.contents = contents
+
+    @classmethod
+    def from_bson(cls, history: list[list[str]]) -> "ChatHistory":
+        return cls(bytearray(_ROLES[role] for role, _ in history), [content for _, content in history])
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def __iter__(self) -> Iterator[tuple[str, str]]:
+        return zip((_ROLE_NAMES[role] for role in self.roles), self.contents)
+
+    def user_turns(self) -> int:
+        return self.roles.count(Role.USER)
+
+    def window(self, max_tokens: int) -> list[BaseMessage]:
+        """
+        Builds the messages of the longest suffix of the history within `max_tokens` (estimated like
+        `count_tokens_approximately`). A trimmed history starts on a user message.
+        """
+        start = len(self.contents)
+        tokens = 0
+        while start > 0:
+            role, content = self.roles[start - 1], self.contents[start - 1]
+            tokens += math.ceil((len(content) + len(_ROLE_NAMES[role])) / 4) + 3
+            if tokens > max_tokens:
+                break
+            start -= 1
+
+        if start > 0:
+            while start < len(self.roles) and self.roles[start] != Role.USER:
+                start += 1
+
+        return [_MESSAGE_CLASSES[self.roles[i]](self.contents[i]) for i in range(start, len(self.contents))]
+
+
+class NPCState:
+    """The NPC data of `get_dynamic_npc_data_pipeline` needed for a chat turn; quests are stored column-wise."""
+
+    __slots__ = (
+        "affinitas", "occupation", "likes", "dislikes", "completed_quests",
+        "quest_statuses", "quest_names", "quest_descriptions",
+    )
+
+    def __init__(self, affinitas: int, occupation: str | None, likes: list[str], dislikes: list[str],
+                 completed_quests: list[str], quest_statuses: bytearray, quest_names: tuple[str, ...],
+                 quest_descriptions: tuple[str | None, ...]):
+        self.affinitas = affinitas
+        self.occupation = occupation
+        self.likes = likes
+        self.dislikes = dislikes
+        self.completed_quests = completed_quests
+        self.quest_statuses = quest_statuses
+        self.quest_names = quest_names
+        self.quest_descriptions = quest_descriptions
+
+    @classmethod
+    def from_bson(cls, npc: dict[str, Any]) -> "NPCState":
+        quests = npc["quests"]
+        return cls(
+            affinitas=npc["affinitas"],
+            occupation=npc.get("occupation"),
+            likes=npc["likes"],
+            dislikes=npc["dislikes"],
+            completed_quests=npc["completed_quests"],
+            quest_statuses=bytearray(_STATUSES[quest["status"]] for quest in quests),
+            quest_names=tuple(quest["name"] for quest in quests),
+            quest_descriptions=tuple(quest["description"] for quest in quests),
+        )
+
+    @property
+    def quests(self) -> list[QuestState]:
+        return [
+            {"status": _STATUS_NAMES[status], "name": name, "description": description}
+            for status, name, description in zip(self.quest_statuses, self.quest_names, self.quest_descriptions)
+        ]
@@ -0,0 +1,250 @@
+import abc
+import asyncio
+import json
+import logging
+import random
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, TypedDict, TYPE_CHECKING
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+from affinitas_backend.config import Config
+
+if TYPE_CHECKING:
+    from langsmith import Client
+
+
+class Span(TypedDict):
+    run_id: str
+    name: str
+    operation: str
+    start_time: str
+    end_time: str | None
+    inputs: list[dict[str, Any]]
+    outputs: list[dict[str, Any]] | None
+    token_usage: dict[str, int] | None
+    error: str | None
+
+
+class SpanExporter(abc.ABC):
+    @abc.abstractmethod
+    async def export(self, spans: list[Span]):
+        ...
+
+
+class NDJSONFileExporter(SpanExporter):
+    """Appends spans to a local newline-delimited JSON file; works offline."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def export(self, spans: list[Span]):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines: str):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class LangSmithExporter(SpanExporter):
+    """Uploads spans to LangSmith as root `llm` runs in a single batch request."""
+
+    def __init__(self, client: "Client", project_name: str):
+        self.client = client
+        self.project_name = project_name
+
+    async def export(self, spans: list[Span]):
+        await asyncio.to_thread(
+            self.client.batch_ingest_runs,
+            create=[self._to_run(span) for span in spans],
+            pre_sampled=True
+        )
+
+    def _to_run(self, span: Span) -> dict[str, Any]:
+        start_time = datetime.fromisoformat(span["start_time"])
+        return {
+            "id": span["run_id"],
+            "trace_id": span["run_id"],
+            "dotted_order": f"{start_time:%Y%m%dT%H%M%S%fZ}{span['run_id']}",
+            "session_name": self.project_name,
+            "name": span["name"],
+            "run_type": "llm",
+            "start_time": span["start_time"],
+            "end_time": span["end_time"],
+            "inputs": {"messages": span["inputs"]},
+            "outputs": {"generations": span["outputs"]} if span["outputs"] is not None else None,
+            "error": span["error"],
+            "extra": {"metadata": {"operation": span["operation"], "usage_metadata": span["token_usage"]}},
+        }
+
+
+class TelemetryPipeline:
+    """
+    Collects spans of model calls off the hot path.
+
+    The callback handler only samples calls and appends finished spans to a bounded in-memory queue; a
+    background task exports them in batches of `batch_size` every `flush_interval` seconds (or as soon as a
+    batch is full). When the queue is full, new spans are dropped and counted, so tracing never blocks a
+    request or grows memory without bound. Export failures are logged and the batch is discarded.
+    """
+
+    def __init__(self, config: Config, exporter: SpanExporter | None):
+        self.exporter = exporter
+        self.sample_rates = config.tracing_sample_rates
+        self.max_queue_size = config.tracing_queue_size
+        self.batch_size = config.tracing_batch_size
+        self.flush_interval = config.tracing_flush_interval_seconds
+
+        self.handler = TelemetryCallbackHandler(self)
+
+        self.exported_spans = 0
+        self.dropped_spans = 0
+        self.failed_exports = 0
+
+        self._queue: deque[Span] = deque()
+        self._batch_ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def sampled(self, operation: str) -> bool:
+        return self.enabled and random.random() < self.sample_rates.get(operation, 1.0)
+
+    def enqueue(self, span: Span):
+        if len(self._queue) >= self.max_queue_size:
+            self.dropped_spans += 1
+            return
+
+        self._queue.append(span)
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        while self._queue:
+            await self._export_batch()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._batch_ready.clear()
+            while self._queue:
+                await self._export_batch()
+
+    async def _export_batch(self):
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        try:
+            await self.exporter.export(batch)
+            self.exported_spans += len(batch)
+        except Exception as e:
+            self.failed_exports += 1
+            logging.warning(f"Failed to export {len(batch)} spans: {e!r}")
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """
+    Records chat model calls as spans. The operation is read from the `operation` metadata of the call.
+    Runs inline on the event loop; it does no I/O.
+    """
+
+    run_inline = True
+
+    def __init__(self, pipeline: TelemetryPipeline):
+        self.pipeline = pipeline
+        self._spans: dict[UUID, Span] = {}  # Sampled calls in flight
+
+    def on_chat_model_start(
+            self,
+            serialized: dict[str, Any],
+            messages: list[list[BaseMessage]],
+            *,
+            run_id: UUID,
+            metadata: dict[str, Any] | None = None,
+            **kwargs: Any,
+    ):
+        operation = (metadata or {}).get("operation", "unknown")
+        if not self.pipeline.sampled(operation):
+            return
+        if len(self._spans) >= self.pipeline.max_queue_size:
+            self.pipeline.dropped_spans += 1
+            return
+
+        self._spans[run_id] = {
+            "run_id": str(run_id),
+            "name": kwargs.get("name") or (serialized or {}).get("name", "chat_model"),
+            "operation": operation,
+            "start_time": _now(),
+            "end_time": None,
+            "inputs": [{"type": msg.type, "content": msg.content} for msg in messages[0]] if messages else [],
+            "outputs": None,
+            "token_usage": None,
+            "error": None,
+        }
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+
+        generations = response.generations[0] if response.generations else []
+        message = getattr(generations[0], "message", None) if generations else None
+
+        span["end_time"] = _now()
+        span["outputs"] = [
+            {"text": generation.text, "tool_calls": getattr(getattr(generation, "message", None), "tool_calls", None)}
+            for generation in generations
+        ]
+        span["token_usage"] = getattr(message, "usage_metadata", None)
+        self.pipeline.enqueue(span)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+
+        span["end_time"] = _now()
+        span["error"] = repr(error)
+        self.pipeline.enqueue(span)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def create_exporter(config: Config) -> SpanExporter | None:
+    if not config.langsmith_tracing or config.tracing_exporter == "none":
+        return None
+
+    if config.tracing_exporter == "ndjson":
+        return NDJSONFileExporter(config.tracing_ndjson_path)
+
+    from langsmith import Client  # Only imported when spans are exported to LangSmith
+
+    return LangSmithExporter(
+        Client(api_key=config.langsmith_api_key, api_url=config.langsmith_endpoint),
+        config.langsmith_project
+    )
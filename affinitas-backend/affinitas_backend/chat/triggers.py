@@ -0,0 +1,173 @@
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable
+
+from beanie import PydanticObjectId
+
+from affinitas_backend.config import Config
+from affinitas_backend.db.utils import get_linked_active_quests_pipeline
+from affinitas_backend.models.beanie.save import ShadowSave
+
+
+class TriggerIndex:
+    """
+    Aho-Corasick automaton over the `triggers` of a set of quests.
+
+    `match` scans a message once, in time linear to its length, and returns the quests that have a trigger
+    occurring in it as a whole word (case-insensitive). Quests without triggers cannot be pre-screened and
+    are always returned.
+    """
+
+    def __init__(self, quests: list[dict[str, Any]]):
+        self.quests = quests
+        self.always_match = [quest for quest in quests if not quest.get("triggers")]
+
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[tuple[int, int]]] = [[]]  # (quest index, trigger length) per state
+
+        for i, quest in enumerate(quests):
+            for trigger in quest.get("triggers") or []:
+                self._add(trigger.lower(), i)
+
+        self._build_failure_links()
+
+    def _add(self, pattern: str, quest_index: int):
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+
+        self._output[state].append((quest_index, len(pattern)))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] += self._output[self._fail[next_state]]
+
+    def match(self, text: str) -> list[dict[str, Any]]:
+        text = text.lower()
+        matched: set[int] = set()
+
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+
+            for quest_index, length in self._output[state]:
+                start = end - length
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    matched.add(quest_index)
+
+        return self.always_match + [self.quests[i] for i in sorted(matched) if self.quests[i].get("triggers")]
+
+
+class QuestTriggerCache:
+    """
+    Per-session `TriggerIndex`es over the active quests that an NPC can complete, i.e. the quests linked to
+    the NPC. Entries expire after `ttl` seconds and must be invalidated when quest statuses change.
+    """
+
+    def __init__(self, config: Config):
+        self.ttl = config.quest_trigger_cache_ttl_seconds
+        self.max_sessions = config.quest_trigger_cache_max_sessions
+
+        # shadow_save_id -> npc_id -> (expires at, index)
+        self._sessions: OrderedDict[PydanticObjectId, dict[PydanticObjectId, tuple[float, TriggerIndex]]] = (
+            OrderedDict()
+        )
+        self._clients: dict[PydanticObjectId, str] = {}  # shadow_save_id -> client UUID, for the session hand-off
+
+        self.hits = 0
+        self.misses = 0
+
+    async def match(
+            self,
+            shadow_save_id: PydanticObjectId,
+            npc_id: PydanticObjectId,
+            message: str,
+            client_uuid: str | None = None
+    ) -> list[dict[str, Any]]:
+        """Returns the active quests linked to the NPC whose triggers occur in the message."""
+        index = await self.get_index(shadow_save_id, npc_id, client_uuid)
+        return index.match(message)
+
+    async def get_index(self, shadow_save_id: PydanticObjectId, npc_id: PydanticObjectId,
+                        client_uuid: str | None = None) -> TriggerIndex:
+        session = self._sessions.get(shadow_save_id, {})
+        expires_at, index = session.get(npc_id, (0, None))
+
+        if index is None or expires_at <= time.monotonic():
+            self.misses += 1
+            quests = await ShadowSave.aggregate(get_linked_active_quests_pipeline(shadow_save_id, npc_id)).to_list()
+            index = TriggerIndex(quests)
+
+            session = self._sessions.setdefault(shadow_save_id, {})
+            session[npc_id] = (time.monotonic() + self.ttl, index)
+        else:
+            self.hits += 1
+
+        if client_uuid:
+            self._clients[shadow_save_id] = client_uuid
+        self._sessions.move_to_end(shadow_save_id)
+        self._evict()
+
+        return index
+
+    def invalidate(self, shadow_save_id: PydanticObjectId):
+        self._sessions.pop(shadow_save_id, None)
+        self._clients.pop(shadow_save_id, None)
+
+    def export_sessions(self, moved: Callable[[str], bool]) -> list[dict[str, Any]]:
+        """Removes the sessions of the clients for which `moved` is true and returns their unexpired indexes."""
+        now = time.monotonic()
+        sessions = []
+        for shadow_save_id, client_uuid in list(self._clients.items()):
+            if not moved(client_uuid):
+                continue
+
+            del self._clients[shadow_save_id]
+            session = self._sessions.pop(shadow_save_id, {})
+            sessions.append({
+                "client_uuid": client_uuid,
+                "shadow_save_id": shadow_save_id,
+                "npcs": [
+                    {"npc_id": npc_id, "expires_in": expires_at - now, "quests": index.quests}
+                    for npc_id, (expires_at, index) in session.items() if expires_at > now
+                ],
+            })
+
+        return sessions
+
+    def import_sessions(self, sessions: list[dict[str, Any]]):
+        """Adds sessions exported by another worker, unless this worker has built them again meanwhile."""
+        now = time.monotonic()
+        for session in sessions:
+            shadow_save_id = session["shadow_save_id"]
+            if shadow_save_id in self._sessions:
+                continue
+
+            self._sessions[shadow_save_id] = {
+                npc["npc_id"]: (now + npc["expires_in"], TriggerIndex(npc["quests"])) for npc in session["npcs"]
+            }
+            self._clients[shadow_save_id] = session["client_uuid"]
+
+        self._evict()
+
+    def _evict(self):
+        while len(self._sessions) > self.max_sessions:
+            shadow_save_id, _ = self._sessions.popitem(last=False)
+            self._clients.pop(shadow_save_id, None)
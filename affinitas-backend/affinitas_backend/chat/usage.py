@@ -0,0 +1,96 @@
+import logging
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+from affinitas_backend.metrics import llm_tokens
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+
+
+class TokenUsage:
+    """Prompt and completion tokens spent by the model calls of a single request."""
+
+    def __init__(self):
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+
+class CancellationStats:
+    """
+    Model calls cancelled because the client went away. Since a cancelled call reports no usage, the tokens
+    it would have spent are estimated from the average usage of completed calls.
+
+    Calls cancelled for other reasons, e.g. by their latency SLO, are only counted: the request goes on
+    with a fallback, so nothing is saved.
+    """
+
+    def __init__(self):
+        self.cancelled_calls = 0
+        self.cancelled_queued_calls = 0
+        self.saved_tokens_estimate = 0.0
+        self.timed_out_calls = 0
+
+        self.avg_input_tokens = 0.0
+        self.avg_output_tokens = 0.0
+
+
+cancellation_stats = CancellationStats()
+
+# Message of the cancellation of a request whose client went away, see `cancel_on_disconnect`
+CLIENT_GONE = "client gone"
+
+# Set per request by the token budget dependency. Tasks spawned by the request (e.g. `asyncio.gather`)
+# copy the context and therefore share the same `TokenUsage` instance.
+token_usage: ContextVar[TokenUsage | None] = ContextVar("token_usage", default=None)
+
+
+def record_usage(message: "BaseMessage", operation: str):
+    """
+    Adds the usage metadata of a model response to the usage of the current request, if any, to the
+    per-call averages used to estimate the cost of cancelled calls, and to the token metrics of the operation.
+    """
+    usage = token_usage.get()
+    usage_metadata = getattr(message, "usage_metadata", None)
+
+    if not usage_metadata:
+        return
+
+    input_tokens = usage_metadata.get("input_tokens", 0)
+    output_tokens = usage_metadata.get("output_tokens", 0)
+    llm_tokens.inc(operation, "prompt", amount=input_tokens)
+    llm_tokens.inc(operation, "completion", amount=output_tokens)
+
+    stats = cancellation_stats
+    stats.avg_input_tokens = 0.9 * stats.avg_input_tokens + 0.1 * input_tokens
+    stats.avg_output_tokens = 0.9 * stats.avg_output_tokens + 0.1 * output_tokens
+
+    if usage is not None:
+        usage.input_tokens += input_tokens
+        usage.output_tokens += output_tokens
+
+
+def record_cancellation(started: bool, by_client: bool):
+    """
+    Records a cancelled model call. Calls cancelled by a client disconnect while queued save the whole call,
+    calls cancelled in flight only save the completion, since the prompt has already been sent.
+    """
+    stats = cancellation_stats
+    if not by_client:
+        stats.timed_out_calls += 1
+        return
+
+    stats.cancelled_calls += 1
+    saved_tokens = stats.avg_output_tokens
+
+    if not started:
+        stats.cancelled_queued_calls += 1
+        saved_tokens += stats.avg_input_tokens
+
+    stats.saved_tokens_estimate += saved_tokens
+    logging.info(f"Cancelled model call (started: {started}, ~{saved_tokens:.0f} tokens saved, "
+                 f"{stats.cancelled_calls} cancelled, ~{stats.saved_tokens_estimate:.0f} tokens saved in total)")
@@ -1,12 +1,13 @@
-from typing import Literal, Any
+from typing import Any
 
+import httpx
 from beanie import PydanticObjectId
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from langchain_core.tracers import LangChainTracer
-from langsmith import Client
-from langsmith.wrappers import wrap_openai
-from openai import OpenAI
+from langchain_core.language_models import BaseChatModel
+from pydantic import BaseModel
 
+from affinitas_backend.chat.cassette import Cassette, CassetteModel
+from affinitas_backend.chat.stand_in import StandInChatModel
+from affinitas_backend.chat.tracing import TelemetryPipeline
 from affinitas_backend.config import Config
 from affinitas_backend.db.utils import get_dynamic_npc_data_pipeline
 from affinitas_backend.models.beanie.save import ShadowSave
@@ -54,7 +55,8 @@ Dislikes        : {dislikes}
 ──────────────────  QUEST THREADS  ──────────────────
 Current quests attached to you:  
 {quests}
-"""
+Quests marked [COMPLETED] are already done; never add them to the `completed_quests` array.
+{linked_quests}"""
 
 ENDING_PROMPT_TEMPLATE = """\
 Generate an ending for the following game state:
@@ -83,19 +85,22 @@ Paraphrase the following text like this person would speak:
 Only include the paraphrased text and nothing else.\
 """
 
-AFFINITAS_CHANGE_MAP = {"very positive": 5, "positive": 2, "neutral": 0, "negative": -2, "very negative": -5}
-
+LINKED_QUESTS_TEMPLATE = """
+──────────────────  QUESTS YOU JUDGE  ──────────────────
+The player has accepted the quests below. Make use of the keywords and the quest name and description \
+(if non-null) to decide whether the player completes one of them with this message. \
+If so, append its quest ID to the `completed_quests` array.
+{quests}
+"""
 
-def get_message(role: Literal["user", "ai", "system"], content: str) -> BaseMessage:
-    match role:
-        case "user":
-            return HumanMessage(content)
-        case "ai":
-            return AIMessage(content)
-        case "system":
-            return SystemMessage(content)
+LINKED_QUEST_TEMPLATE = """\
+• Quest ID: {quest_id}
+  Quest Name: {quest_name}
+  Quest Description: {quest_description}
+  Keywords: {keywords}\
+"""
 
-    raise ValueError(f"Unknown message type: {role}")
+AFFINITAS_CHANGE_MAP = {"very positive": 5, "positive": 2, "neutral": 0, "negative": -2, "very negative": -5}
 
 
 async def get_npc_data(
@@ -135,10 +140,85 @@ def pretty_quests(quests: list[QuestState]) -> str:
     return "\n".join(lines)
 
 
-def with_tracing(model, cfg: Config):
-    if not cfg.langsmith_tracing:
+def pretty_linked_quests(quests: list[dict[str, Any]]) -> str:
+    """
+    Renders the active quests linked to an NPC whose completion the NPC should judge in the current turn.
+    Returns an empty string if there are none, so that the section is left out of the prompt.
+    """
+    if not quests:
+        return ""
+
+    return LINKED_QUESTS_TEMPLATE.format(quests="\n".join(
+        LINKED_QUEST_TEMPLATE.format(
+            quest_id=quest["quest_id"],
+            quest_name=quest["name"],
+            quest_description=quest["description"],
+            keywords=", ".join(map(repr, quest.get("triggers") or [])),
+        ) for quest in quests
+    ))
+
+
+def format_npc_data(npc: dict[str, Any]) -> str:
+    """Renders `NPC_DATA_TEMPLATE` from the NPC data returned by `get_npc_data(..., include_static_data=True)`."""
+    affinitas_increase = npc["affinitas_config"]["increase"]
+    affinitas_decrease = npc["affinitas_config"]["decrease"]
+
+    return NPC_DATA_TEMPLATE.format(
+        name=npc["name"],
+        age=npc["age"],
+        occupation=npc.get("occupation", "Unknown"),
+        backstory=npc["backstory"],
+        personality=", ".join(npc["personality"]),
+        motivations=", ".join(npc["motivations"]),
+        likes=", ".join(npc["likes"] or ["Unspecified"]),
+        dislikes=", ".join(npc["dislikes"] or ["Unspecified"]),
+        dialogue_unlocks=", ".join(npc["dialogue_unlocks"]),
+        quests=pretty_quests(npc["quests"]),
+        affinitas=npc["affinitas"],
+        affinitas_up=isinstance(affinitas_increase, float) and f"{affinitas_increase:.2f}" or ", ".join(
+            affinitas_increase),
+        affinitas_down=isinstance(affinitas_decrease, float) and f"{affinitas_decrease:.2f}" or ", ".join(
+            affinitas_decrease),
+    )
+
+
+def init_model(cfg: Config, http_client: httpx.AsyncClient) -> BaseChatModel:
+    """
+    Creates the chat model of the configured provider on top of the shared HTTP client. Retries and timeouts
+    are left to `LLMResilience`, the client timeout only guards against hung connections.
+    """
+    if cfg.llm_provider == "stand-in":
+        return init_stand_in(cfg)
+
+    from langchain.chat_models import init_chat_model
+
+    return init_chat_model(
+        model=cfg.openai_model_name,
+        model_provider="openai",
+        api_key=cfg.openai_api_key,
+        max_retries=0,
+        timeout=max(cfg.llm_timeout_seconds.values(), default=cfg.llm_client_timeout_seconds),
+        http_async_client=http_client,
+    )
+
+
+def init_stand_in(cfg: Config) -> StandInChatModel:
+    return StandInChatModel(
+        latency_seconds=cfg.stand_in_latency_seconds,
+        latency_jitter_seconds=cfg.stand_in_latency_jitter_seconds,
+        error_rate=cfg.stand_in_error_rate,
+    )
+
+
+def with_cassette(model, cfg: Config, cassette: Cassette | None, schema: type[BaseModel] | None = None):
+    """Records the model's calls to the cassette or replays them from it, depending on `LLM_CASSETTE_MODE`."""
+    if cassette is None:
+        return model
+    return CassetteModel(model, cassette, init_stand_in(cfg), schema, cfg.llm_cassette_latency_scale)
+
+
+def with_tracing(model, telemetry: TelemetryPipeline):
+    """Records the model's calls as spans in the telemetry pipeline, which exports them in the background."""
+    if not telemetry.enabled:
         return model
-    client = Client(api_key=cfg.langsmith_api_key, api_url=cfg.langsmith_endpoint)
-    tracer = LangChainTracer(client=client, project_name=cfg.langsmith_project)
-    return model.with_config(callbacks=[tracer],
-                             client=wrap_openai(OpenAI(api_key=cfg.openai_api_key)))
+    return model.with_config(callbacks=[telemetry.handler])
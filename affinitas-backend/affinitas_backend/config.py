@@ -1,17 +1,133 @@
+from functools import cache
+from typing import Literal
+
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
 
+class ReadPreferenceConfig(BaseModel):
+    mode: Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"] = "primary"
+    max_staleness_seconds: int = Field(
+        -1,
+        description="Maximum replication lag tolerated for secondary reads. "
+                    "-1 disables the check; otherwise MongoDB requires at least 90 seconds."
+    )
+
+
 class Config(BaseSettings):
     mongodb_uri: str
     mongodb_dbname: str
 
+    mongodb_max_pool_size: int = 100
+    mongodb_min_pool_size: int = 0
+    mongodb_max_idle_time_ms: int | None = None
+    mongodb_connect_timeout_ms: int = 20_000
+    mongodb_server_selection_timeout_ms: int = 30_000
+    mongodb_socket_timeout_ms: int | None = None
+    mongodb_wait_queue_timeout_ms: int | None = None
+
+    # Query name -> read preference. Queries not listed here are routed to the primary,
+    # which is what read-your-writes-sensitive queries (chat state, shadow saves) need.
+    mongodb_read_preferences: dict[str, ReadPreferenceConfig] = Field(default_factory=lambda: {
+        "new_game": ReadPreferenceConfig(mode="secondaryPreferred", max_staleness_seconds=90),
+        "quest_catalog": ReadPreferenceConfig(mode="secondaryPreferred", max_staleness_seconds=90),
+        # Players expect a game they just saved to show up in the list
+        "list_game_saves": ReadPreferenceConfig(mode="primary"),
+        "load_game_save": ReadPreferenceConfig(mode="primary"),
+        "generate_ending": ReadPreferenceConfig(mode="primary"),
+    })
+
+    rate_limit_enabled: bool = True  # Disables the request limits and token budgets, e.g. for load tests
+    # Any `limits` storage URI, e.g. "mongodb://host:27017" or "redis://localhost:6379" (requires `redis`)
+    rate_limit_storage_uri: str = "memory://"
+    rate_limit_strategy: Literal["fixed-window", "moving-window", "sliding-window-counter"] = "sliding-window-counter"
+    rate_limit_lease_size: int = 1  # Hits leased from the shared store at once; 1 disables leasing
+    rate_limit_local_max_keys: int = 10_000
+    # Prompt + completion tokens a client may spend on LLM-backed routes, in `limits` notation
+    token_budget_limits: str = "60000/10 minutes;400000/day"
+
+    idempotency_ttl_seconds: float = 300.0
+    idempotency_max_entries: int = 10_000
+
     openai_api_key: str
     openai_model_name: str = "gpt-4.1"
+    # "stand-in" replaces OpenAI with a local fake model for load and resilience testing
+    llm_provider: Literal["openai", "stand-in"] = "openai"
+    stand_in_latency_seconds: float = 0.5
+    stand_in_latency_jitter_seconds: float = 0.5
+    stand_in_error_rate: float = 0.0
+    # "record" saves model calls to the cassette, "replay" answers them from it (and with the stand-in on a miss)
+    llm_cassette_mode: Literal["off", "record", "replay"] = "off"
+    llm_cassette_path: str = "llm_cassette.jsonl.gz"
+    llm_cassette_latency_scale: float = 1.0  # Multiplies the recorded latencies on replay; 0 replays instantly
+
+    # Shared HTTP client pool of the model and tracing clients
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 120.0
+    http_connect_timeout_seconds: float = 5.0
+    http2_enabled: bool = False  # Requires `h2`
+    http_warm_connections: int = 2
+    http_warm_url: str = "https://api.openai.com/v1"
+
+    llm_initial_concurrency: int = 16
+    llm_min_concurrency: int = 1
+    llm_max_concurrency: int = 64
+    llm_max_queue_size: int = 128  # Per priority class
+    llm_latency_target_seconds: float = 12.0  # Calls slower than this decrease the concurrency limit
+    llm_client_timeout_seconds: float = 30.0  # How long the Unity client waits for a response
+    client_disconnect_poll_seconds: float = 0.5
+    # Operation -> latency SLO of its model call. Calls exceeding it are cancelled and answered by the fallback
+    # responder; operations not listed here wait for the model. Cancelled calls count as slow for the concurrency
+    # limit, so the SLOs should not be shorter than `llm_latency_target_seconds`.
+    llm_latency_slo_seconds: dict[str, float] = Field(default_factory=lambda: {
+        "npc_chat": 12.0,
+        "give_item": 12.0,
+    })
+    degraded_mode_enabled: bool = True
+
+    # Per-attempt timeouts of model calls by operation; other operations use `llm_client_timeout_seconds`.
+    # Operations with a latency SLO need attempts short enough for a retry to fit inside it.
+    llm_timeout_seconds: dict[str, float] = Field(default_factory=lambda: {
+        "npc_chat": 5.0,
+        "give_item": 5.0,
+        "quest": 20.0,
+        "ending": 60.0,
+    })
+    llm_max_retries: int = 2
+    llm_retry_base_delay_seconds: float = 0.5
+    llm_retry_budget_ratio: float = 0.2  # Retries and hedged requests allowed per model call
+    llm_retry_budget_max_tokens: float = 10.0
+    llm_hedge_enabled: bool = False  # Start a second attempt once a call exceeds the p95 latency
+    llm_hedge_min_samples: int = 20
+    llm_circuit_window_seconds: float = 30.0
+    llm_circuit_min_calls: int = 10
+    llm_circuit_error_rate: float = 0.5
+    llm_circuit_open_seconds: float = 15.0
+
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 4096
+    response_cache_variants: int = 3  # Replies stored per key before the cache starts answering
+    response_cache_max_turns: int = 2  # Only the first N user turns of a conversation are cached
+    npc_catalog_version: int = 1  # Bump when the `npcs` collection changes to invalidate cached replies
+
+    quest_trigger_cache_ttl_seconds: float = 60.0
+    quest_trigger_cache_max_sessions: int = 10_000
 
     langsmith_tracing: bool = True
     langsmith_endpoint: str
     langsmith_api_key: str
     langsmith_project: str
+    # Spans of model calls are queued in memory and exported in batches by a background task
+    tracing_exporter: Literal["langsmith", "ndjson", "none"] = "langsmith"
+    tracing_ndjson_path: str = "traces.ndjson"
+    # Operation -> fraction of its model calls that are traced; unlisted operations are always traced
+    tracing_sample_rates: dict[str, float] = Field(default_factory=lambda: {
+        "npc_chat": 0.2,
+    })
+    tracing_queue_size: int = 10_000  # Spans beyond this are dropped
+    tracing_batch_size: int = 100
+    tracing_flush_interval_seconds: float = 5.0
 
     env: str = "production"
     default_save_version: int = 9
@@ -20,6 +136,33 @@ class Config(BaseSettings):
     daily_ap_limit: int = 15
 
     log_level: str = "WARNING"
+    # Fraction of requests that get a `Server-Timing` header and a JSON access log line; 0 disables both
+    server_timing_sample_rate: float = 0.0
+    server_timing_header: bool = True
+
+    admin_token: str | None = None  # Bearer token of the admin endpoints; they are disabled when unset
+    profiler_interval_seconds: float = 0.005
+    profiler_max_seconds: float = 60.0
+
+    loop_lag_interval_seconds: float = 0.25
+    loop_block_threshold_seconds: float = 0.1
+    # Logs the stack of callbacks blocking the event loop past the threshold; always on when env is "dev"
+    loop_block_detection_enabled: bool = False
+
+    # `/readyz` reports ready once the warm-up is done; disabled, the worker is ready as soon as it starts
+    warmup_enabled: bool = True
+    warmup_timeout_seconds: float = 30.0
+    warmup_mongo_connections: int = 4  # Connections opened ahead of the first requests
+    warmup_retry_seconds: float = 5.0  # Delay before retrying a warm-up whose MongoDB steps failed
+
+    # Set by the multi-worker runner for its workers; enables the session hand-off endpoints under /cluster
+    cluster_token: str | None = None
 
     class Config:
         env_file = ".env"
+
+
+@cache
+def get_config() -> Config:
+    """The settings of the process, parsed from the environment once and shared by all modules."""
+    return Config()  # noqa
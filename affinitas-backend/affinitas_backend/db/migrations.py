@@ -0,0 +1,65 @@
+"""
+One-off data migrations. Run with `python -m affinitas_backend.db.migrations`.
+"""
+import asyncio
+import logging
+
+from affinitas_backend.db.mongo import init_db
+from affinitas_backend.models.beanie.save import Save, ShadowSave, DefaultSave
+
+# Prefixes of the system messages that quest acceptance and completion used to store in the chat history.
+# The quest instructions are now rendered from the quest state on every turn instead.
+QUEST_SYSTEM_MESSAGE_PATTERN = r"^The player has (accepted|completed) this quest:"
+
+
+def quest_system_messages_filter():
+    """Matches the documents with at least one quest system message, so that other saves are not rewritten."""
+    return {"npcs.chat_history": {"$elemMatch": {"0": "system", "1": {"$regex": QUEST_SYSTEM_MESSAGE_PATTERN}}}}
+
+
+def strip_quest_system_messages_update():
+    """Returns the update pipeline that removes quest system messages from the chat history of every NPC."""
+    return [
+        {"$set": {
+            "npcs": {"$map": {
+                # `$map` and `$filter` return null for missing inputs, which would not validate as a save
+                "input": {"$ifNull": ["$npcs", []]},
+                "as": "npc",
+                "in": {"$mergeObjects": [
+                    "$$npc",
+                    {"chat_history": {"$filter": {
+                        "input": {"$ifNull": ["$$npc.chat_history", []]},
+                        "as": "msg",
+                        "cond": {"$not": [{"$and": [
+                            {"$eq": [{"$arrayElemAt": ["$$msg", 0]}, "system"]},
+                            {"$regexMatch": {
+                                "input": {"$arrayElemAt": ["$$msg", 1]},
+                                "regex": QUEST_SYSTEM_MESSAGE_PATTERN
+                            }}
+                        ]}]}
+                    }}}
+                ]}
+            }}
+        }}
+    ]
+
+
+async def strip_quest_system_messages():
+    # Only documents with quest system messages are updated, so running it twice is a no-op
+    for document in (ShadowSave, Save, DefaultSave):
+        res = await document.get_motor_collection().update_many(
+            quest_system_messages_filter(), strip_quest_system_messages_update()
+        )
+        logging.warning(f"Removed quest system messages from {res.modified_count} {document.Settings.name} documents")
+
+
+async def main():
+    client = await init_db()
+    try:
+        await strip_quest_system_messages()
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,21 +2,66 @@ import logging
 
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 
-from affinitas_backend.config import Config
+from affinitas_backend.config import get_config
+from affinitas_backend.metrics import mongo_command_duration
 from affinitas_backend.models.beanie.npc import NPC
 from affinitas_backend.models.beanie.save import Save, ShadowSave, DefaultSave
 
 
 async def init_db():
-    config = Config()  # noqa
-    client = AsyncIOMotorClient(config.mongodb_uri, uuidRepresentation="standard")
+    config = get_config()
+    client = AsyncIOMotorClient(
+        config.mongodb_uri,
+        uuidRepresentation="standard",
+        maxPoolSize=config.mongodb_max_pool_size,
+        minPoolSize=config.mongodb_min_pool_size,
+        maxIdleTimeMS=config.mongodb_max_idle_time_ms,
+        connectTimeoutMS=config.mongodb_connect_timeout_ms,
+        serverSelectionTimeoutMS=config.mongodb_server_selection_timeout_ms,
+        socketTimeoutMS=config.mongodb_socket_timeout_ms,
+        waitQueueTimeoutMS=config.mongodb_wait_queue_timeout_ms,
+        event_listeners=[CommandMetricsListener()],
+    )
     await init_beanie(database=client[config.mongodb_dbname], document_models=[NPC, Save, ShadowSave, DefaultSave])
     await test_connection(client)
 
     return client
 
 
+class CommandMetricsListener(monitoring.CommandListener):
+    """
+    Records the latency of data commands per command and collection. Handshakes, heartbeats and other
+    administrative commands are skipped so that the label set stays bounded.
+    """
+
+    COMMANDS = {"find", "getMore", "aggregate", "insert", "update", "delete", "findAndModify", "count", "distinct"}
+
+    def __init__(self):
+        self._collections: dict[tuple, str] = {}  # (connection, request ID) -> collection of in-flight commands
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name not in self.COMMANDS:
+            return
+
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")  # `getMore` names the cursor first
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._record(event, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._record(event, "error")
+
+    def _record(self, event: monitoring.CommandSucceededEvent | monitoring.CommandFailedEvent, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name, collection, outcome)
+
+
 # Verify connection
 async def test_connection(client: AsyncIOMotorClient):
     try:
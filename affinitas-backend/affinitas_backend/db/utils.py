@@ -1,10 +1,42 @@
+from functools import cache
 from typing import Any
 
-from beanie import PydanticObjectId
+from beanie import PydanticObjectId, Document
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name, Primary
 
+from affinitas_backend.config import get_config
 from affinitas_backend.models.beanie.save import ShadowSave
 from affinitas_backend.models.chat.chat import ThreadInfo
 
+config = get_config()
+
+
+@cache
+def get_read_preference(query_name: str):
+    """
+    Returns the read preference configured for the given query name in `Config.mongodb_read_preferences`.
+    Queries that are not configured are pinned to the primary.
+    """
+    read_pref = config.mongodb_read_preferences.get(query_name)
+    if read_pref is None:
+        return Primary()
+
+    return make_read_preference(
+        read_pref_mode_from_name(read_pref.mode),
+        None,
+        read_pref.max_staleness_seconds
+    )
+
+
+def get_collection(document: type[Document], query_name: str) -> AsyncIOMotorCollection:
+    """
+    Returns the collection of the given document model routed with the read preference of `query_name`.
+    Beanie queries do not accept a read preference, so read-only paths that should be served by secondaries
+    run their queries on the returned collection instead.
+    """
+    return document.get_motor_collection().with_options(read_preference=get_read_preference(query_name))
+
 
 def get_save_pipeline(match: dict[str, Any]):
     """
@@ -186,6 +218,41 @@ def get_npc_quests_pipeline(npc_id: PydanticObjectId, shadow_save_id: PydanticOb
     ]
 
 
+def get_linked_active_quests_pipeline(shadow_save_id: PydanticObjectId, npc_id: PydanticObjectId):
+    """
+    Returns the aggregation pipeline for the active quests of a shadow save that are linked to the given NPC,
+    i.e. the quests the NPC decides the completion of, along with their static data from the NPC catalog.
+    """
+    return [
+        {"$match": {"_id": shadow_save_id}},
+        {"$unwind": "$npcs"},
+        {"$unwind": "$npcs.quests"},
+        {"$match": {"npcs.quests.status": "active"}},
+        {"$lookup": {
+            "from": "npcs",
+            "let": {"questId": "$npcs.quests.quest_id"},
+            "pipeline": [
+                {"$match": {"quests.linked_npc": npc_id}},
+                {"$unwind": "$quests"},
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$quests._id", "$$questId"]},
+                    {"$eq": ["$quests.linked_npc", npc_id]}
+                ]}}},
+                {"$replaceRoot": {"newRoot": "$quests"}}
+            ],
+            "as": "quest_config"
+        }},
+        {"$unwind": "$quest_config"},
+        {"$project": {
+            "_id": 0,
+            "quest_id": "$quest_config._id",
+            "name": "$quest_config.name",
+            "description": "$quest_config.description",
+            "triggers": "$quest_config.triggers"
+        }}
+    ]
+
+
 def get_dynamic_npc_data_pipeline(
         shadow_save_id: PydanticObjectId,
         npc_id: PydanticObjectId, *,
@@ -0,0 +1,155 @@
+"""
+Minimal in-process metrics in the Prometheus text exposition format.
+
+Recording a sample is a dict lookup and a few additions, so it is cheap enough for the request path.
+Every metric keeps at most `max_series` label combinations; further combinations are folded into a
+single series whose labels are all `other`, which keeps the label cardinality bounded.
+Values derived from existing stats objects are registered as callbacks and only computed on scrape.
+"""
+import abc
+from bisect import bisect_left
+from typing import Callable, Literal
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+
+class _Metric(abc.ABC):
+    type: str
+
+    def __init__(self, name: str, description: str, labelnames: tuple[str, ...] = (), max_series: int = 200):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.max_series = max_series
+        self._overflow_key = ("other",) * len(labelnames)
+        self._series = {}
+
+        registry.register(self)
+
+    def _key(self, labels: tuple[str, ...]) -> tuple[str, ...]:
+        if labels in self._series or len(self._series) < self.max_series:
+            return labels
+        return self._overflow_key
+
+    @abc.abstractmethod
+    def render(self) -> list[str]:
+        ...
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        # Samples may be recorded from driver threads while rendering, hence the copy
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in list(self._series.items())]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS, max_series: int = 200):
+        super().__init__(name, description, labelnames, max_series)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), sum
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _labels((*self.labelnames, "le"), (*key, str(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A gauge or counter read from existing state when scraped. The callback returns label values -> value."""
+
+    def __init__(self, name: str, description: str, callback: Callable[[], dict[tuple[str, ...], float]],
+                 labelnames: tuple[str, ...] = (), type: Literal["gauge", "counter"] = "gauge"):
+        self.type = type
+        self.callback = callback
+        super().__init__(name, description, labelnames)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in self.callback().items()]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+
+http_requests = Counter(
+    "affinitas_http_requests_total", "HTTP requests by route template and status code",
+    ("method", "route", "status")
+)
+http_request_duration = Histogram(
+    "affinitas_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")
+)
+mongo_command_duration = Histogram(
+    "affinitas_mongo_command_duration_seconds", "MongoDB command latency", ("command", "collection", "outcome")
+)
+llm_call_duration = Histogram(
+    "affinitas_llm_call_duration_seconds", "Latency of single LLM call attempts", ("operation", "outcome")
+)
+llm_tokens = Counter("affinitas_llm_tokens_total", "Tokens spent on LLM calls", ("operation", "kind"))
+background_write_duration = Histogram(
+    "affinitas_background_write_duration_seconds",
+    "Duration of the database writes deferred to after the response", ("route",)
+)
+rate_limit_rejections = Counter(
+    "affinitas_rate_limit_rejections_total", "Requests rejected by the request or token budget limiters",
+    ("limiter",)
+)
+event_loop_lag = Histogram(
+    "affinitas_event_loop_lag_seconds", "How late the event loop ran a scheduled callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+event_loop_blocks = Counter(
+    "affinitas_event_loop_blocks_total", "Times the event loop was blocked for longer than the block threshold"
+)
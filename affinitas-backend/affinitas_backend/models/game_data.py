@@ -26,6 +26,8 @@ class NPCSaveData(BaseModel):
     chat_history: list[tuple[Literal["user", "system", "ai"], str]] = Field(default_factory=list)
     # Quests completed by this NPC; the quest does not have to belong to this NPC
     completed_quests: list[PydanticObjectId] = Field(default_factory=list)
+    # Indices of the `chat_history` replies answered in degraded mode, to be regenerated by the model later
+    degraded_turns: list[int] = Field(default_factory=list)
 
 
 class GameData(BaseModel):
@@ -14,3 +14,4 @@ class NPCChatResponse(BaseModel):
     response: str
     affinitas_new: int
     completed_quests: list[PydanticObjectId] = Field(default_factory=list)
+    degraded: bool = Field(False, description="Whether the reply was generated locally because the LLM was too slow")
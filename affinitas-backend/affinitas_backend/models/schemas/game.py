@@ -3,11 +3,11 @@ from datetime import datetime
 from beanie import PydanticObjectId
 from pydantic import BaseModel, Field
 
-from affinitas_backend.config import Config
+from affinitas_backend.config import get_config
 from affinitas_backend.models.game_data import GameData
 from affinitas_backend.models.schemas.npcs import NPCResponse
 
-config = Config()  # noqa
+config = get_config()
 
 
 class SaveSessionRequest(BaseModel):
@@ -1,8 +1,86 @@
-from typing import Annotated
+import hmac
+from typing import Annotated, AsyncIterator, TYPE_CHECKING
 
-from fastapi import Header
+from fastapi import Depends, Header, HTTPException, status
+from fastapi.requests import Request
 from pydantic import UUID4
 
+from affinitas_backend.chat import services
+from affinitas_backend.chat.usage import TokenUsage, token_usage
+from affinitas_backend.config import get_config
+from affinitas_backend.server.limiter import get_client_key, token_budget
+
+if TYPE_CHECKING:
+    from affinitas_backend.chat.master_chat import MasterLLM
+    from affinitas_backend.chat.npc_chat import NPCChatService
+
+config = get_config()
+
 XClientUUIDHeader = Annotated[
     UUID4, Header(description="Unique identifier assigned to the client by the server. Uses UUID4 format.",
                   alias="X-Client-UUID")]
+
+IdempotencyKeyHeader = Annotated[
+    str | None, Header(description="Client-chosen key that identifies a request across retries. Retries with "
+                                   "the same key replay the first result instead of running the request again.",
+                       alias="Idempotency-Key", max_length=255)]
+
+
+# Async so that a service is built on the event loop, not concurrently in the threadpool
+async def get_npc_chat_service() -> "NPCChatService":
+    return services.npc_chat
+
+
+async def get_master_llm_service() -> "MasterLLM":
+    return services.master_llm
+
+
+NPCChatServiceDep = Annotated["NPCChatService", Depends(get_npc_chat_service)]
+MasterLLMServiceDep = Annotated["MasterLLM", Depends(get_master_llm_service)]
+
+
+async def charge_token_budget(request: Request) -> AsyncIterator[TokenUsage]:
+    """
+    Rejects the request with 429 if the client's token budget is exhausted, and charges the tokens
+    spent by the model calls of the request once it has been handled.
+    """
+    key = get_client_key(request)
+    await token_budget.check(key)
+
+    usage = TokenUsage()
+    reset_token = token_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        token_usage.reset(reset_token)
+        if usage.total_tokens:
+            await token_budget.charge(key, usage.total_tokens)
+
+
+async def require_admin(authorization: Annotated[str | None, Header()] = None):
+    """
+    Allows the request only with `Authorization: Bearer <ADMIN_TOKEN>`. Admin endpoints do not exist
+    (404) while no admin token is configured.
+    """
+    _check_bearer_token(authorization, config.admin_token, "admin")
+
+
+async def require_cluster_token(authorization: Annotated[str | None, Header()] = None):
+    """
+    Allows the request only with `Authorization: Bearer <CLUSTER_TOKEN>`, which the multi-worker runner passes
+    to its workers. Cluster endpoints do not exist (404) outside of it.
+    """
+    _check_bearer_token(authorization, config.cluster_token, "cluster")
+
+
+def _check_bearer_token(authorization: str | None, expected: str | None, name: str):
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), expected.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid {name} token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
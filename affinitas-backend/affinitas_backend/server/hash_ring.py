@@ -0,0 +1,41 @@
+import bisect
+import hashlib
+from typing import Iterable
+from uuid import UUID
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to nodes. Every node is placed on the ring `replicas` times, and a key belongs to
+    the first node after it; adding or removing one of n nodes therefore only moves about 1/n of the keys.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 128):
+        self.nodes = tuple(sorted(set(nodes)))
+        self.replicas = replicas
+
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def owner(self, key: str) -> str | None:
+        if not self._hashes:
+            return None
+        return self._owners[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest())
+
+
+def client_key(client_uuid: str | None) -> str | None:
+    """The routing key of an `X-Client-UUID` header, i.e. the UUID in canonical form, or None if it is invalid."""
+    if not client_uuid:
+        return None
+    try:
+        return str(UUID(client_uuid))
+    except ValueError:
+        return None
@@ -0,0 +1,159 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from bson import ObjectId
+from fastapi import HTTPException, status, Response
+from fastapi.encoders import jsonable_encoder
+
+from affinitas_backend.config import get_config
+
+config = get_config()
+
+_FAILED = object()
+
+
+class IdempotencyCache:
+    """
+    Results of requests carrying an `Idempotency-Key`, keyed by `(client_uuid, key)`.
+
+    The first request with a key runs the handler; retries within `ttl` seconds get the stored result, and
+    concurrent duplicates wait for the in-flight request instead of starting a second model call. Failed
+    requests are not stored, so they can be retried with the same key.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires at, request path, result future)
+        self._entries: OrderedDict[tuple[str, str], tuple[float, str, asyncio.Future]] = OrderedDict()
+
+    async def run(self, key: tuple[str, str], path: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        while entry := self._get(key):
+            _, entry_path, future = entry
+            if entry_path != path:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="Idempotency-Key was already used for a different request",
+                )
+
+            result = await asyncio.shield(future)
+            if result is not _FAILED:
+                return _replayable(result)
+
+        future = asyncio.get_running_loop().create_future()
+        self._put(key, (time.monotonic() + self.ttl, path, future))
+
+        try:
+            result = await call()
+        except BaseException:
+            self._entries.pop(key, None)
+            future.set_result(_FAILED)
+            raise
+
+        future.set_result(result)
+        return result
+
+    def export_sessions(self, moved: Callable[[str], bool]) -> list[dict[str, Any]]:
+        """
+        Removes the results of the clients for which `moved` is true and returns the unexpired ones. Requests
+        still in flight are left to finish here, their retries are routed to the new worker anyway.
+        """
+        now = time.monotonic()
+        entries = []
+        for key, (expires_at, path, future) in list(self._entries.items()):
+            if not moved(key[0]) or not future.done():
+                continue
+
+            del self._entries[key]
+            if expires_at > now and future.result() is not _FAILED:
+                entries.append({
+                    "client_uuid": key[0],
+                    "key": key[1],
+                    "path": path,
+                    "expires_in": expires_at - now,
+                    "result": _exportable(future.result()),
+                })
+
+        return entries
+
+    def import_sessions(self, entries: list[dict[str, Any]]):
+        now = time.monotonic()
+        for entry in entries:
+            key = (entry["client_uuid"], entry["key"])
+            if key in self._entries:
+                continue
+
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(_imported(entry["result"]))
+            self._put(key, (now + entry["expires_in"], entry["path"], future))
+
+    def _get(self, key: tuple[str, str]):
+        entry = self._entries.get(key)
+        if entry and entry[0] <= time.monotonic() and entry[2].done():
+            del self._entries[key]
+            return None
+
+        return entry
+
+    def _put(self, key: tuple[str, str], entry: tuple[float, str, asyncio.Future]):
+        now = time.monotonic()
+        while self._entries:
+            oldest_key, (expires_at, _, future) = next(iter(self._entries.items()))
+            if len(self._entries) < self.max_entries and expires_at > now:
+                break
+            if not future.done():
+                break  # Never drop in-flight requests, their duplicates are waiting on them
+
+            del self._entries[oldest_key]
+
+        self._entries[key] = entry
+
+
+def _replayable(result: Any) -> Any:
+    if isinstance(result, Response):
+        # The original response carries the background tasks of the first request, which must not run again
+        return Response(content=result.body, status_code=result.status_code, headers=dict(result.headers))
+
+    return result
+
+
+def _exportable(result: Any) -> dict[str, Any]:
+    if isinstance(result, Response):
+        return {"status_code": result.status_code, "headers": dict(result.headers), "body": bytes(result.body)}
+
+    # Response models are replayed as their JSON, which FastAPI validates against the model again
+    return {"content": jsonable_encoder(result, custom_encoder={ObjectId: str})}
+
+
+def _imported(result: dict[str, Any]) -> Any:
+    if "content" in result:
+        return result["content"]
+
+    return Response(content=result["body"], status_code=result["status_code"], headers=result["headers"])
+
+
+idempotency_cache = IdempotencyCache(config.idempotency_ttl_seconds, config.idempotency_max_entries)
+
+
+def idempotent(func):
+    """
+    Makes an endpoint replay its result for retries that carry the same `Idempotency-Key` header.
+    The endpoint must take `request`, `x_client_uuid` and `idempotency_key` parameters.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        idempotency_key = kwargs["idempotency_key"]
+        if not idempotency_key:
+            return await func(*args, **kwargs)
+
+        return await idempotency_cache.run(
+            (str(kwargs["x_client_uuid"]), idempotency_key),
+            kwargs["request"].url.path,
+            lambda: func(*args, **kwargs),
+        )
+
+    return wrapper
@@ -4,15 +4,26 @@ from typing import AsyncIterator
 
 from fastapi import FastAPI
 
+from affinitas_backend.chat import services
 from affinitas_backend.db.mongo import init_db
+from affinitas_backend.server.loop_monitor import loop_monitor
+from affinitas_backend.server.warmup import warm_up
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     client = await init_db()
     app.db = client.account
+    services.telemetry.start()
+    loop_monitor.start()
+    warm_up.start(client)
 
     logging.info("Startup complete")
     yield
+    await warm_up.stop()
+    await loop_monitor.stop()
     client.close()
+    await services.telemetry.stop()
+    if services.created("http_pool"):
+        await services.http_pool.aclose()
     logging.info("Shutdown complete")
@@ -1,4 +1,261 @@
+import functools
+import logging
+import math
+import time
+from typing import Any, Callable
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from fastapi.requests import Request
+from limits import RateLimitItem, parse_many
+from limits.aio import strategies as aio
+from limits.storage import storage_from_string
+from limits.util import WindowStats
 from slowapi import Limiter
+from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
 
-limiter = Limiter(key_func=get_remote_address)
+from affinitas_backend.config import get_config
+from affinitas_backend.metrics import rate_limit_rejections
+
+config = get_config()
+
+
+def get_client_key(request: Request) -> str:
+    """
+    Rate limit key of the request. Clients are identified by their `X-Client-UUID` header so that players
+    behind the same NAT do not share a budget. Requests without a valid UUID fall back to the remote address.
+    """
+    client_uuid = request.headers.get("X-Client-UUID")
+    if client_uuid:
+        try:
+            return f"client:{UUID(client_uuid)}"
+        except ValueError:
+            pass
+
+    return f"ip:{get_remote_address(request)}"
+
+
+def _async_storage_uri(storage_uri: str) -> str:
+    """URI of the `limits.aio` storage for `storage_uri`, e.g. "async+redis://..." for "redis://..."."""
+    return storage_uri if storage_uri.startswith("async+") else f"async+{storage_uri}"
+
+
+class LocalBucketRateLimiter(aio.RateLimiter):
+    """
+    Wraps a rate limiter backed by a shared store with per-process micro-buckets.
+
+    Hits are leased from the shared store in batches of `lease_size` and spent locally until the window they
+    were charged to resets, and keys that the shared store rejected are rejected locally until then as well.
+    Hot keys therefore only reach the shared store once per lease or window.
+    """
+
+    def __init__(self, limiter: aio.RateLimiter, *, lease_size: int, max_keys: int):
+        super().__init__(limiter.storage)
+        self.limiter = limiter
+        self.lease_size = lease_size
+        self.max_keys = max_keys
+
+        self._leases: dict[str, tuple[int, float]] = {}  # key -> (remaining hits, window reset time)
+        self._blocked: dict[str, tuple[int, float]] = {}  # key -> (0, window reset time)
+
+    async def hit(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        key = item.key_for(*identifiers)
+        now = time.time()
+
+        if self._blocked.get(key, (0, 0))[1] > now:
+            return False
+
+        remaining, reset_time = self._leases.get(key, (0, 0))
+        if reset_time > now and remaining >= cost:
+            self._leases[key] = (remaining - cost, reset_time)
+            return True
+
+        if self.lease_size > cost:
+            # Failed hits may still be counted by the store, so leases are sized to what is left of the window
+            stats = await self.limiter.get_window_stats(item, *identifiers)
+            lease = min(self.lease_size, stats.remaining)
+            if lease > cost and await self.limiter.hit(item, *identifiers, cost=lease):
+                # Leased hits count against the current window, so they stay usable until it resets
+                remaining, _ = self._leases.get(key, (0, 0))  # Another request may have leased in the meantime
+                self._store(self._leases, key, (remaining + lease - cost, stats.reset_time))
+                return True
+
+        if await self.limiter.hit(item, *identifiers, cost=cost):
+            return True
+
+        self._leases.pop(key, None)
+        reset_time = (await self.limiter.get_window_stats(item, *identifiers)).reset_time
+        self._store(self._blocked, key, (0, reset_time))
+        return False
+
+    async def test(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        key = item.key_for(*identifiers)
+        if self._blocked.get(key, (0, 0))[1] > time.time():
+            return False
+
+        return await self.limiter.test(item, *identifiers, cost=cost)
+
+    async def get_window_stats(self, item: RateLimitItem, *identifiers: str) -> WindowStats:
+        return await self.limiter.get_window_stats(item, *identifiers)
+
+    async def clear(self, item: RateLimitItem, *identifiers: str) -> None:
+        key = item.key_for(*identifiers)
+        self._leases.pop(key, None)
+        self._blocked.pop(key, None)
+        await self.limiter.clear(item, *identifiers)
+
+    def _store(self, buckets: dict[str, tuple[int, float]], key: str, value: tuple[int, float]):
+        if len(buckets) >= self.max_keys:
+            now = time.time()
+            for stale_key in [k for k, (_, expires_at) in buckets.items() if expires_at <= now]:
+                del buckets[stale_key]
+
+            if len(buckets) >= self.max_keys:
+                buckets.pop(next(iter(buckets)))
+
+        buckets[key] = value
+
+
+class SharedStoreLimiter(Limiter):
+    """
+    slowapi `Limiter` that checks the route limits against a shared store through the async `limits` API,
+    wrapped with `LocalBucketRateLimiter`.
+
+    slowapi itself only checks limits synchronously, so it is given in-memory storage: its checks are skipped
+    for requests that passed the shared store, and enforce per-process limits while the shared store is
+    unreachable. The shared store is retried every `retry_interval` seconds.
+    """
+
+    def __init__(self, *args, storage_uri: str, strategy: str, lease_size: int, max_keys: int,
+                 retry_interval: float = 5.0, **kwargs):
+        super().__init__(*args, storage_uri="memory://", strategy=strategy, **kwargs)
+        self.shared_limiter = LocalBucketRateLimiter(
+            aio.STRATEGIES[strategy](storage_from_string(_async_storage_uri(storage_uri))),
+            lease_size=lease_size,
+            max_keys=max_keys,
+        )
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0  # While the shared store is unreachable, the next time it is tried
+
+    def limit(self, *args, **kwargs) -> Callable[..., Any]:
+        decorator = super().limit(*args, **kwargs)
+
+        def wrap(func: Callable[..., Any]) -> Callable[..., Any]:
+            checked = decorator(func)
+
+            @functools.wraps(checked)
+            async def wrapper(*f_args, **f_kwargs):
+                request = f_kwargs.get("request")
+                if self.enabled and isinstance(request, Request) and time.monotonic() >= self._retry_at:
+                    await self._check_shared_limits(request, func)
+                return await checked(*f_args, **f_kwargs)
+
+            return wrapper
+
+        return wrap
+
+    async def _check_shared_limits(self, request: Request, func: Callable[..., Any]):
+        """Evaluates the route limits of `func` like slowapi does, but against the shared store."""
+        name = f"{func.__module__}.{func.__name__}"
+        endpoint_key = request["path"] if self._key_style == "url" else name
+        if not endpoint_key or name in self._exempt_routes or any(fn() for fn in self._request_filters):
+            return
+
+        limit_for_header = None
+        try:
+            for lim in self._route_limits.get(name, []):
+                if lim.is_exempt or lim.methods is not None and request.method.lower() not in lim.methods:
+                    continue
+
+                scope = (lim.scope or endpoint_key) + (f":{request.method}" if lim.per_method else "")
+                args = [self._key_prefix, lim.key_func(request), scope] if self._key_prefix \
+                    else [lim.key_func(request), scope]
+                if not limit_for_header or lim.limit < limit_for_header[0]:
+                    limit_for_header = (lim.limit, args)
+
+                cost = lim.cost(request) if callable(lim.cost) else lim.cost
+                if not await self.shared_limiter.hit(lim.limit, *args, cost=cost):
+                    request.state.view_rate_limit = (lim.limit, args)
+                    raise RateLimitExceeded(lim)
+        except RateLimitExceeded:
+            raise
+        except Exception as e:
+            logging.warning(f"Rate limit storage unreachable, using in-memory limits: {e!r}")
+            self._retry_at = time.monotonic() + self.retry_interval
+            return
+
+        if self._retry_at:
+            logging.info("Rate limit storage recovered")
+            self._retry_at = 0.0
+
+        request.state.view_rate_limit = limit_for_header
+        request.state._rate_limiting_complete = True
+
+
+class TokenBudget:
+    """
+    Per-client token quotas for LLM-backed routes.
+
+    A request is admitted as long as the client has budget left in every window, and is charged the actual
+    prompt and completion tokens of its model calls afterwards. Since the cost of a call is only known once
+    it has finished, the last admitted call of a window may overshoot the budget.
+
+    Budgets fail open: while the store is unreachable, requests are admitted and their tokens are not charged.
+    The store is retried every `retry_interval` seconds.
+    """
+
+    def __init__(self, storage_uri: str, limits: str, enabled: bool = True, retry_interval: float = 5.0):
+        self.limits = parse_many(limits) if enabled else []
+        # Fixed windows are used because they record the charged tokens even when a window overflows
+        self.limiter = aio.FixedWindowRateLimiter(storage_from_string(_async_storage_uri(storage_uri)))
+        self.retry_interval = retry_interval
+        self._retry_at = 0.0  # While the store is unreachable, the next time it is tried
+
+    async def check(self, key: str):
+        if time.monotonic() < self._retry_at:
+            return
+
+        for item in self.limits:
+            try:
+                if await self.limiter.test(item, key):
+                    continue
+                reset_time = (await self.limiter.get_window_stats(item, key)).reset_time
+            except Exception as e:
+                return self._storage_failed(f"admitting the request: {e!r}")
+
+            rate_limit_rejections.inc("token_budget")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=f"Token budget exceeded: {item}",
+                headers={"Retry-After": str(max(1, math.ceil(reset_time - time.time())))},
+            )
+
+        self._retry_at = 0.0
+
+    async def charge(self, key: str, tokens: int):
+        if time.monotonic() < self._retry_at:
+            return
+
+        for item in self.limits:
+            try:
+                await self.limiter.hit(item, key, cost=tokens)
+            except Exception as e:
+                return self._storage_failed(f"{tokens} tokens of {key} not charged: {e!r}")
+
+    def _storage_failed(self, message: str):
+        logging.warning(f"Token budget storage unreachable, {message}")
+        self._retry_at = time.monotonic() + self.retry_interval
+
+
+limiter = SharedStoreLimiter(
+    key_func=get_client_key,
+    storage_uri=config.rate_limit_storage_uri,
+    strategy=config.rate_limit_strategy,
+    key_prefix="affinitas",
+    enabled=config.rate_limit_enabled,
+    lease_size=config.rate_limit_lease_size,
+    max_keys=config.rate_limit_local_max_keys,
+)
+
+token_budget = TokenBudget(config.rate_limit_storage_uri, config.token_budget_limits, config.rate_limit_enabled)
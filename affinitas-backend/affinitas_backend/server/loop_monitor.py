@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from affinitas_backend.config import get_config
+from affinitas_backend.metrics import event_loop_blocks, event_loop_lag
+
+config = get_config()
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping for `interval` seconds, which is the delay every
+    other callback scheduled at that time suffered too. The lag is exported as a histogram.
+
+    With the blocking-call detector on (by default in dev), a watchdog thread also checks that the loop woke up
+    on time; when it is more than `block_threshold` seconds late, the watchdog logs the loop thread's current
+    stack, i.e. the code blocking it, once per stall.
+    """
+
+    def __init__(self, interval: float, block_threshold: float, detect_blocking: bool):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.detect_blocking = detect_blocking
+
+        self._expected_wakeup: float | None = None  # None while the loop is not sleeping in the monitor
+        self._task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    def start(self):
+        if self._task is not None:
+            return
+
+        self._task = asyncio.create_task(self._run())
+        if self.detect_blocking:
+            self._stop.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, args=(threading.get_ident(),), name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        if self._watchdog is not None:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            self._expected_wakeup = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._expected_wakeup, 0.0)
+            self._expected_wakeup = None
+
+            event_loop_lag.observe(lag)
+            if lag > self.block_threshold:
+                event_loop_blocks.inc()
+                if self.detect_blocking:
+                    logging.warning(f"Event loop was blocked for {lag * 1000:.0f} ms")
+
+    def _watch(self, thread_id: int):
+        reported = None  # Wakeup of the stall already reported
+        while not self._stop.wait(self.block_threshold / 2):
+            expected = self._expected_wakeup
+            if expected is None or expected == reported:
+                continue
+            if time.monotonic() - expected <= self.block_threshold:
+                continue
+
+            frame = sys._current_frames().get(thread_id)  # noqa
+            if frame is None:
+                continue
+
+            reported = expected
+            stack = "".join(traceback.format_stack(frame))
+            logging.warning(f"Event loop blocked for over {self.block_threshold * 1000:.0f} ms in:\n{stack}")
+
+
+loop_monitor = LoopMonitor(
+    interval=config.loop_lag_interval_seconds,
+    block_threshold=config.loop_block_threshold_seconds,
+    detect_blocking=config.loop_block_detection_enabled or config.env == "dev",
+)
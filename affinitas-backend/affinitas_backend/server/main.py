@@ -2,19 +2,28 @@ import logging
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from slowapi import _rate_limit_exceeded_handler
+from fastapi.responses import ORJSONResponse
 from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
-from affinitas_backend.config import Config
+from affinitas_backend.chat.scheduler import LLMOverloadedError
+from affinitas_backend.config import get_config
 from affinitas_backend.server.lifespan import lifespan
 from affinitas_backend.server.limiter import limiter
+from affinitas_backend.server.profiler import ProfilerMiddleware
+from affinitas_backend.server.routers.admin import router as admin_router
 from affinitas_backend.server.routers.auth import router as auth_router
+from affinitas_backend.server.routers.cluster import router as cluster_router
+from affinitas_backend.server.routers.health import router as health_router
 from affinitas_backend.server.routers.npcs import router as npcs_router
 from affinitas_backend.server.routers.saves import router as saves_router
 from affinitas_backend.server.routers.session import router as session_router
+from affinitas_backend.server.middleware import MetricsMiddleware, ServerTimingMiddleware
+from affinitas_backend.server.routers.metrics import router as metrics_router
+from affinitas_backend.server.utils import llm_overloaded_handler, ClientDisconnectedError, \
+    client_disconnected_handler, rate_limit_exceeded_handler
 
-config = Config()  # noqa
+config = get_config()
 
 logging.basicConfig(level=config.log_level)
 
@@ -56,6 +65,10 @@ This FastAPI service handles player authentication, game‐state persistence, se
 | **POST /npcs/{npc_id}/quest/complete** | Complete a quest and reward affinitas                | 10/min   |
 | **POST /npcs/{npc_id}/item**        | Give an item to an NPC → receive narrative response       | 10/min   |
 
+LLM-backed endpoints (`/npcs/{npc_id}/chat`, `/quest`, `/item` and `/session/generate-ending`) are additionally charged the prompt and completion tokens they spend against a per-client token budget. Exhausted budgets are answered with `429 Too Many Requests` and a `Retry-After` header. When the LLM provider is saturated, calls are queued by priority (chat, then quests, then endings) and answered with `503 Service Unavailable` if they could not complete before the client times out. Chat and item replies that miss their latency SLO are answered in degraded mode: a generic in-character line flagged with `degraded: true`, which leaves affinitas and quests unchanged.
+
+`POST /npcs/{npc_id}/chat`, `/quest` and `/item` accept an `Idempotency-Key` header. Retries that carry the same key within a few minutes replay the first response instead of calling the LLM and updating the save again.
+
 ---
 
 ### Data-Flow Highlights
@@ -86,11 +99,14 @@ app = FastAPI(
         "url": "https://github.com/COMP491-Affinitas/affinitas/blob/main/LICENSE"
     },
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.state.limiter = limiter  # noqa: I'm just following the docs
 
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)  # noqa
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)  # noqa
+app.add_exception_handler(LLMOverloadedError, llm_overloaded_handler)  # noqa
+app.add_exception_handler(ClientDisconnectedError, client_disconnected_handler)  # noqa
 
 app.add_middleware(
     CORSMiddleware,  # noqa
@@ -100,8 +116,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 app.add_middleware(SlowAPIMiddleware)  # noqa
+app.add_middleware(ProfilerMiddleware)  # noqa
+app.add_middleware(MetricsMiddleware)  # noqa
+app.add_middleware(
+    ServerTimingMiddleware,  # noqa
+    sample_rate=config.server_timing_sample_rate,
+    header=config.server_timing_header,
+)
 
 app.include_router(auth_router)
 app.include_router(npcs_router)
 app.include_router(session_router)
 app.include_router(saves_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
+app.include_router(health_router)
+app.include_router(cluster_router)
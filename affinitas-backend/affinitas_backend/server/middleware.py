@@ -0,0 +1,136 @@
+import functools
+import json
+import logging
+import random
+import time
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+from affinitas_backend.metrics import http_requests, http_request_duration
+from affinitas_backend.timing import RequestTimings, request_timings
+
+access_logger = logging.getLogger("affinitas.access")
+
+
+def route_label(scope: Scope) -> str:
+    """Route template of the request (e.g. `/npcs/{npc_id}/chat`), so that IDs do not end up in labels."""
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+class MetricsMiddleware:
+    """
+    Records the latency and status of every request per route template. The latency is measured until the
+    response body is sent, so it does not include background tasks.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        end = None
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal end, status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                end = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_label(scope)
+            http_request_duration.observe((end or time.perf_counter()) - start, scope["method"], route)
+            http_requests.inc(scope["method"], route, str(status_code))
+
+
+class ServerTimingMiddleware:
+    """
+    Breaks down the latency of a sampled fraction of requests into `db`, `llm`, `validate` and `serialize`
+    phases. The breakdown is sent in the `Server-Timing` header and written to the access log as JSON.
+
+    `validate` covers request parsing and dependencies (up to the endpoint call) plus the `timed("validate")`
+    blocks; `serialize` is the time from the endpoint's return to the start of the response.
+    """
+
+    def __init__(self, app: ASGIApp, sample_rate: float, header: bool = True):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.header = header
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.sample_rate or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        breakdown: dict[str, float] = {}
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                breakdown.update(_breakdown(timings))
+                if self.header:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", ", ".join(f"{phase};dur={ms:.1f}" for phase, ms in breakdown.items())
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_timings.reset(token)
+            access_logger.info(json.dumps({
+                "method": scope["method"],
+                "route": route_label(scope),
+                "status": status_code,
+                "timings_ms": {phase: round(ms, 1) for phase, ms in (breakdown or _breakdown(timings)).items()},
+            }))
+
+
+def _breakdown(timings: RequestTimings) -> dict[str, float]:
+    now = time.perf_counter()
+    durations = dict(timings.durations)
+
+    if timings.endpoint_started is not None:
+        durations["validate"] = durations.get("validate", 0.0) + timings.endpoint_started - timings.start
+    if timings.endpoint_finished is not None:
+        durations["serialize"] = durations.get("serialize", 0.0) + now - timings.endpoint_finished
+
+    durations["total"] = now - timings.start
+    return {phase: seconds * 1000 for phase, seconds in durations.items()}
+
+
+class TimedRoute(APIRoute):
+    """Marks when the endpoint starts and returns, so that request validation and serialization can be timed."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        endpoint = self.dependant.call
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            timings = request_timings.get()
+            if timings is None:
+                return await endpoint(*args, **kwargs)
+
+            timings.endpoint_started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                timings.endpoint_finished = time.perf_counter()
+
+        self.dependant.call = timed_endpoint
@@ -0,0 +1,167 @@
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from affinitas_backend.config import get_config
+
+config = get_config()
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the event loop thread of a live worker.
+
+    While sampling, a background thread records the loop thread's Python stack every `interval` seconds and
+    counts identical stacks, which are returned in the collapsed format read by `flamegraph.pl` and
+    speedscope. Nothing runs while the profiler is idle.
+
+    In request mode, sampling is switched on while at least one of the next `count` requests matching a
+    route is in flight. Since the loop is shared, requests running concurrently show up in the samples too.
+    """
+
+    def __init__(self, interval: float, max_seconds: float):
+        self.interval = interval
+        self.max_seconds = max_seconds
+
+        self.armed = False  # Waiting for matching requests
+        self.generation = 0  # Identifies the request profile a matched request belongs to
+        self._busy = False
+        self._path_regex: re.Pattern | None = None
+        self._method: str | None = None
+        self._remaining = 0
+        self._in_flight = 0
+        self._finished: asyncio.Event | None = None
+
+        self._stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    async def profile_for(self, seconds: float) -> str:
+        self._acquire()
+        try:
+            self._start_sampling()
+            await asyncio.sleep(min(seconds, self.max_seconds))
+        finally:
+            self._stop_sampling()
+            self._busy = False
+
+        return self._collapse()
+
+    async def profile_requests(self, path_regex: re.Pattern, method: str, count: int, timeout: float) -> str:
+        """Samples the next `count` requests matching the route, or those that arrive within `timeout` seconds."""
+        self._acquire()
+        self._path_regex, self._method = path_regex, method
+        self._remaining, self._in_flight = count, 0
+        self._finished = asyncio.Event()
+        self.generation += 1
+        self.armed = True
+        try:
+            await asyncio.wait_for(self._finished.wait(), min(timeout, self.max_seconds))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.armed = False
+            # Requests still in flight after a timeout must not stop the sampling of the next profile
+            self.generation += 1
+            self._in_flight = 0
+            self._stop_sampling()
+            self._busy = False
+
+        return self._collapse()
+
+    def match(self, scope: Scope) -> bool:
+        if self._remaining <= 0 or scope["method"] != self._method:
+            return False
+        if not self._path_regex.match(scope["path"]):
+            return False
+
+        self._remaining -= 1
+        if self._in_flight == 0:
+            self._start_sampling()
+        self._in_flight += 1
+        return True
+
+    def request_finished(self, generation: int):
+        if generation != self.generation:
+            return  # The profile it was matched for is over
+
+        self._in_flight -= 1
+        if self._in_flight:
+            return
+
+        self._stop_sampling()
+        if self._remaining <= 0:
+            self._finished.set()
+
+    def _acquire(self):
+        if self._busy:
+            raise ProfilerBusyError("A profile is already being recorded")
+
+        self._busy = True
+        self._stacks = Counter()  # A new one, since a stopped thread may still be finishing its last sample
+
+    def _start_sampling(self):
+        if self._thread is not None:
+            return
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), self._stop, self._stacks),
+            name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def _stop_sampling(self):
+        if self._thread is None:
+            return
+
+        # Not joined, which would block the event loop; the thread exits as soon as it wakes up
+        self._stop.set()
+        self._thread = None
+
+    def _sample(self, thread_id: int, stop: threading.Event, stacks: Counter[str]):
+        deadline = time.monotonic() + self.max_seconds
+        while not stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)  # noqa
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+
+            if stack:
+                stacks[";".join(reversed(stack))] += 1
+
+    def _collapse(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+profiler = SamplingProfiler(config.profiler_interval_seconds, config.profiler_max_seconds)
+
+
+class ProfilerMiddleware:
+    """Switches the profiler on for requests matching an armed request profile. Only checks a flag otherwise."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not profiler.armed or scope["type"] != "http" or not profiler.match(scope):
+            await self.app(scope, receive, send)
+            return
+
+        generation = profiler.generation
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.request_finished(generation)
@@ -0,0 +1,251 @@
+"""
+Consistent-hashing front proxy. The multi-worker runner puts it in front of its workers; on its own, it spreads
+players over several runners (nodes), each of which routes them to one of its workers again.
+
+Usage: python -m affinitas_backend.server.proxy --upstream http://node-a:8000 --upstream http://node-b:8000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+from collections import Counter
+
+import httpx
+import uvicorn
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.types import Scope, Receive, Send
+
+from affinitas_backend.server.hash_ring import HashRing, client_key
+
+# Headers of a single connection, which are not forwarded (RFC 9110, section 7.6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding",
+    "upgrade", "host",
+}
+
+
+class StickyProxy:
+    """
+    Front proxy of the multi-worker runner. Requests carrying a valid `X-Client-UUID` are forwarded to the
+    upstream that owns the UUID on a consistent hash ring, so that all requests of a player are handled by the
+    same worker and hit its in-process caches; requests without one are spread round-robin.
+
+    Only upstreams that answer `/readyz` are on the ring. When the ring changes, each upstream of the previous
+    ring is asked to hand off the sessions that now belong to another upstream, which imports them (see
+    `routers/cluster.py`); upstreams that are gone lose theirs. Hand-offs need the `cluster_token` of the
+    upstreams, without it sessions simply move and are rebuilt by their new owner.
+
+    Upstream responses may take up to `read_timeout` seconds, which should exceed the time the client waits
+    for a model reply (`llm_client_timeout_seconds`).
+    """
+
+    def __init__(self, upstreams: list[str], *, sticky: bool = True, replicas: int = 128,
+                 health_interval: float = 1.0, cluster_token: str | None = None, max_connections: int = 1000,
+                 read_timeout: float = 60.0):
+        self.upstreams = list(upstreams)
+        self.sticky = sticky
+        self.replicas = replicas
+        self.health_interval = health_interval
+        self.cluster_token = cluster_token
+        self.max_connections = max_connections
+        self.timeout = httpx.Timeout(read_timeout, connect=5.0, pool=5.0)
+
+        self.ring = HashRing((), replicas)
+        self.draining: set[str] = set()  # Upstreams taken off the ring before they are stopped
+        self.requests = Counter()  # Requests forwarded per upstream
+        self.handoffs = 0
+
+        self.client: httpx.AsyncClient | None = None
+        self._round_robin = itertools.count()
+        self._health_task: asyncio.Task | None = None
+        self._rebalance_lock = asyncio.Lock()
+
+    def route(self, client_uuid: str | None) -> str | None:
+        if not self.ring:
+            return None
+
+        key = client_key(client_uuid)
+        if self.sticky and key:
+            return self.ring.owner(key)
+        return self.ring.nodes[next(self._round_robin) % len(self.ring)]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']}")
+
+        if scope["path"] == "/healthz":
+            return await JSONResponse({"status": "ok"})(scope, receive, send)
+        if scope["path"] == "/readyz":
+            if not self.ring:
+                return await JSONResponse({"status": "no ready workers"}, status_code=503)(scope, receive, send)
+            return await JSONResponse({"status": "ready", "workers": list(self.ring.nodes)})(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        upstream = self.route(headers.get("x-client-uuid"))
+        if upstream is None:
+            return await JSONResponse({"detail": "No worker is ready"}, status_code=503)(scope, receive, send)
+
+        response = await self._forward(upstream, scope, receive, headers)
+        if response is not None:
+            await response(scope, receive, send)
+
+    async def _forward(self, upstream: str, scope: Scope, receive: Receive, headers: Headers):
+        """
+        Forwards the request and returns the upstream response, or `None` if the client disconnected first.
+        In that case the upstream request is cancelled, which closes its connection, so that the worker
+        notices the disconnect too and stops paying for the model call.
+        """
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        forwarded = [(k, v) for k, v in headers.items() if k not in HOP_BY_HOP_HEADERS]
+        client = scope.get("client")
+        if client:
+            forwarded_for = headers.get("x-forwarded-for")
+            forwarded.append(("x-forwarded-for", f"{forwarded_for}, {client[0]}" if forwarded_for else client[0]))
+
+        url = upstream + scope["raw_path"].decode("latin-1")
+        if scope["query_string"]:
+            url += "?" + scope["query_string"].decode("latin-1")
+
+        self.requests[upstream] += 1
+        request = self.client.build_request(scope["method"], url, headers=forwarded, content=bytes(body))
+        # Workers only send the headers once the response is ready, e.g. after a model call
+        sending = asyncio.ensure_future(self.client.send(request, stream=True))
+        disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+        try:
+            await asyncio.wait((sending, disconnected), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            sending.cancel()
+            raise
+        finally:
+            disconnected.cancel()
+
+        if not sending.done():
+            sending.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+            return None
+
+        try:
+            res = sending.result()
+        except httpx.HTTPError as e:
+            logging.warning(f"Failed to forward {scope['method']} {scope['path']} to {upstream}: {e!r}")
+            return JSONResponse({"detail": "Worker unavailable"}, status_code=502)
+
+        response = StreamingResponse(res.aiter_raw(), status_code=res.status_code,
+                                     background=BackgroundTask(res.aclose))
+        # Set as a list, since headers like `Set-Cookie` may be repeated
+        response.raw_headers = [
+            (k.encode("latin-1"), v.encode("latin-1"))
+            for k, v in res.headers.multi_items() if k not in HOP_BY_HOP_HEADERS
+        ]
+        return response
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                limits = httpx.Limits(max_connections=self.max_connections,
+                                      max_keepalive_connections=self.max_connections)
+                self.client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+                self._health_task = asyncio.create_task(self._check_health())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._health_task.cancel()
+                await asyncio.gather(self._health_task, return_exceptions=True)
+                await self.client.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _check_health(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.health_interval)
+
+    async def refresh(self):
+        """Puts the ready upstreams that are not draining on the ring, handing off sessions if it changed."""
+        res = await asyncio.gather(
+            *(self.client.get(f"{upstream}/readyz", timeout=self.health_interval) for upstream in self.upstreams),
+            return_exceptions=True,
+        )
+        ready = [
+            upstream for upstream, r in zip(self.upstreams, res)
+            if isinstance(r, httpx.Response) and r.status_code == 200 and upstream not in self.draining
+        ]
+        if set(ready) != set(self.ring.nodes):
+            await self.rebalance(HashRing(ready, self.replicas))
+
+    async def rebalance(self, ring: HashRing):
+        async with self._rebalance_lock:
+            previous, self.ring = self.ring, ring
+            logging.info(f"Workers on the ring: {', '.join(ring.nodes) or 'none'}")
+            if self.cluster_token and previous and ring:
+                await asyncio.gather(*(self._hand_off(upstream) for upstream in previous.nodes))
+
+    async def drain(self, upstream: str):
+        """Takes the upstream off the ring and hands its sessions to the remaining upstreams."""
+        self.draining.add(upstream)
+        await self.rebalance(HashRing([node for node in self.ring.nodes if node != upstream], self.replicas))
+
+    def add_upstream(self, upstream: str):
+        self.draining.discard(upstream)
+        if upstream not in self.upstreams:
+            self.upstreams.append(upstream)
+
+    def remove_upstream(self, upstream: str):
+        self.draining.discard(upstream)
+        self.upstreams.remove(upstream)
+
+    async def _hand_off(self, upstream: str):
+        headers = {"Authorization": f"Bearer {self.cluster_token}"}
+        try:
+            res = await self.client.post(f"{upstream}/cluster/rebalance", headers=headers, json={
+                "worker": upstream, "workers": list(self.ring.nodes), "replicas": self.replicas,
+            })
+            res.raise_for_status()
+
+            for owner, sessions in res.json().items():
+                res = await self.client.post(f"{owner}/cluster/sessions", headers=headers,
+                                             content=json.dumps(sessions))
+                res.raise_for_status()
+                self.handoffs += len(sessions["quest_triggers"]) + len(sessions["idempotency"])
+        except httpx.HTTPError as e:
+            logging.warning(f"Failed to hand off the sessions of {upstream}: {e!r}")
+
+
+async def _wait_for_disconnect(receive: Receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--upstream", action="append", required=True, help="Base URL of a runner; repeatable")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-sticky", action="store_true", help="Spread requests round-robin instead")
+    parser.add_argument("--health-interval", type=float, default=1.0, help="Seconds between readiness checks")
+    parser.add_argument("--read-timeout", type=float, default=60.0,
+                        help="Seconds to wait for an upstream response; keep above LLM_CLIENT_TIMEOUT_SECONDS")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    proxy = StickyProxy(args.upstream, sticky=not args.no_sticky, health_interval=args.health_interval,
+                        read_timeout=args.read_timeout)
+    uvicorn.run(proxy, host=args.host, port=args.port, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from typing import Any
+
+import orjson
+from bson import ObjectId
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+
+# Fields of `GameSessionData` and its nested models, i.e. what is sent of an aggregated save
+GAME_DATA_FIELDS = ("day_no", "remaining_ap", "journal_data", "journal_active", "item_list")
+QUEST_FIELDS = ("quest_id", "status", "name", "description", "affinitas_reward")
+
+
+def _encode_bson(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class TrustedJSONResponse(ORJSONResponse):
+    """
+    Encodes documents as read from MongoDB with orjson, without validating them into models first.
+    `ObjectId`s are encoded as strings; UUIDs and datetimes are handled by orjson.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_encode_bson, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def game_session_response(save: dict[str, Any], shadow_save_id: ObjectId) -> TrustedJSONResponse:
+    """
+    Returns a `GameSessionResponse` of a save aggregated with `get_save_pipeline`. The save was validated when
+    it was written, so it is only projected to the response fields instead of being validated again.
+    """
+    data = {field: save[field] for field in GAME_DATA_FIELDS if field in save}
+    data["item_list"] = data.get("item_list", [])
+    data["npcs"] = [
+        {
+            "npc_id": npc["npc_id"],
+            "name": npc["name"],
+            "affinitas": npc["affinitas"],
+            "quests": [{field: quest.get(field) for field in QUEST_FIELDS} for quest in npc.get("quests", [])],
+            "chat_history": npc.get("chat_history", []),
+        }
+        for npc in save.get("npcs", [])
+    ]
+
+    return TrustedJSONResponse(
+        {"data": data, "shadow_save_id": shadow_save_id},
+        status_code=status.HTTP_201_CREATED,
+    )
@@ -0,0 +1,56 @@
+from fastapi import Depends, HTTPException, status, Query
+from fastapi.requests import Request
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRouter, APIRoute
+
+from affinitas_backend.server.dependencies import require_admin
+from affinitas_backend.server.profiler import profiler, ProfilerBusyError
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)], include_in_schema=False)
+
+
+@router.post(
+    "/profile",
+    response_class=PlainTextResponse,
+    summary="Profile the worker for a number of seconds",
+)
+async def profile(seconds: float = Query(10.0, gt=0)):
+    """
+    Samples the event loop of the worker handling this request and returns the collapsed stacks.
+    Render them with `flamegraph.pl` or open them in speedscope.
+    """
+    try:
+        return PlainTextResponse(await profiler.profile_for(seconds))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@router.post(
+    "/profile/requests",
+    response_class=PlainTextResponse,
+    summary="Profile the next requests to a route",
+)
+async def profile_requests(
+        request: Request,
+        route: str = Query(..., description="Route template, e.g. `/npcs/{npc_id}/chat`"),
+        method: str = Query("POST"),
+        count: int = Query(1, gt=0),
+        timeout: float = Query(60.0, gt=0, description="Seconds to wait for the requests"),
+):
+    """
+    Samples the event loop while the next `count` requests to the route (on this worker) are handled,
+    and returns the collapsed stacks.
+    """
+    method = method.upper()
+    target = next((
+        r for r in request.app.routes
+        if isinstance(r, APIRoute) and r.path == route and method in r.methods
+    ), None)
+
+    if target is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Route not found: {method} {route}")
+
+    try:
+        return PlainTextResponse(await profiler.profile_requests(target.path_regex, method, count, timeout))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
@@ -8,8 +8,9 @@ from fastapi.routing import APIRouter
 from affinitas_backend.models.schemas.auth import UUIDResponse
 from affinitas_backend.server.dependencies import XClientUUIDHeader
 from affinitas_backend.server.limiter import limiter
+from affinitas_backend.server.middleware import TimedRoute
 
-router = APIRouter(prefix="/auth", tags=["auth"])
+router = APIRouter(prefix="/auth", tags=["auth"], route_class=TimedRoute)
 
 
 @router.post(
@@ -0,0 +1,58 @@
+from collections import defaultdict
+
+from bson import json_util
+from fastapi import Depends, status
+from fastapi.requests import Request
+from fastapi.responses import Response
+from fastapi.routing import APIRouter
+from pydantic import BaseModel, Field
+
+from affinitas_backend.chat import services
+from affinitas_backend.server.dependencies import require_cluster_token
+from affinitas_backend.server.hash_ring import HashRing
+from affinitas_backend.server.idempotency import idempotency_cache
+
+router = APIRouter(prefix="/cluster", tags=["cluster"], dependencies=[Depends(require_cluster_token)],
+                   include_in_schema=False)
+
+
+class RebalanceRequest(BaseModel):
+    worker: str = Field(description="Name of this worker on the ring")
+    workers: list[str] = Field(min_length=1, description="Workers on the new ring")
+    replicas: int = Field(128, gt=0)
+
+
+@router.post(
+    "/rebalance",
+    summary="Hand off the sessions that the new ring assigns to other workers",
+)
+async def rebalance(payload: RebalanceRequest):
+    """
+    Removes the cached session state of the clients that the new ring routes to other workers and returns it
+    per new owner, as `bson.json_util` JSON to be posted to their `/cluster/sessions`.
+    """
+    ring = HashRing(payload.workers, payload.replicas)
+
+    def moved(client_uuid: str) -> bool:
+        return ring.owner(client_uuid) != payload.worker
+
+    handoffs = defaultdict(lambda: {"quest_triggers": [], "idempotency": []})
+    if services.created("npc_chat"):
+        for session in services.npc_chat.quest_triggers.export_sessions(moved):
+            handoffs[ring.owner(session["client_uuid"])]["quest_triggers"].append(session)
+    for entry in idempotency_cache.export_sessions(moved):
+        handoffs[ring.owner(entry["client_uuid"])]["idempotency"].append(entry)
+
+    return Response(json_util.dumps(handoffs), media_type="application/json")
+
+
+@router.post(
+    "/sessions",
+    status_code=status.HTTP_204_NO_CONTENT,
+    summary="Import the sessions handed off by another worker",
+)
+async def import_sessions(request: Request):
+    sessions = json_util.loads(await request.body())
+    if sessions["quest_triggers"]:
+        services.npc_chat.quest_triggers.import_sessions(sessions["quest_triggers"])
+    idempotency_cache.import_sessions(sessions["idempotency"])
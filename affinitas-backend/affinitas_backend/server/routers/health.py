@@ -0,0 +1,32 @@
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+from fastapi.routing import APIRouter
+
+from affinitas_backend.server.warmup import warm_up
+
+router = APIRouter(tags=["health"])
+
+
+@router.get(
+    "/healthz",
+    include_in_schema=False,
+)
+async def healthz():
+    """
+    Liveness probe: the worker is running and its event loop answers, whether or not it has warmed up.
+    """
+    return {"status": "ok"}
+
+
+@router.get(
+    "/readyz",
+    include_in_schema=False,
+)
+async def readyz():
+    """
+    Readiness probe: 200 once the worker has warmed up, 503 while it is warming up or cannot reach MongoDB.
+    """
+    if not warm_up.ready:
+        return ORJSONResponse({"status": warm_up.state}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return {"status": warm_up.state, "warm_up": warm_up.durations}
@@ -0,0 +1,18 @@
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRouter
+
+from affinitas_backend.metrics import registry
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    include_in_schema=False,
+)
+async def metrics():
+    """
+    Exposes the process metrics in the Prometheus text format. Each worker process reports its own metrics.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
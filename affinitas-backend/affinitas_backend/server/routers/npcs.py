@@ -1,4 +1,5 @@
 import logging
+import time
 from typing import Awaitable
 
 from beanie import PydanticObjectId
@@ -6,29 +7,34 @@ from beanie.odm.operators.find.array import ElemMatch
 from beanie.odm.operators.update.array import Push
 from beanie.odm.operators.update.general import Inc, Set
 from beanie.odm.queries.update import UpdateResponse
-from fastapi import Response, HTTPException, status
+from fastapi import Response, HTTPException, status, Depends
 from fastapi.background import BackgroundTasks
 from fastapi.requests import Request
 from fastapi.routing import APIRouter
 from pydantic import TypeAdapter
 
 from affinitas_backend.chat import get_message
-from affinitas_backend.chat import npc_chat_service, master_llm_service
-from affinitas_backend.db.utils import get_npc_quests_pipeline
+from affinitas_backend.db.utils import get_npc_quests_pipeline, get_collection
+from affinitas_backend.metrics import background_write_duration
 from affinitas_backend.models.beanie.npc import NPC
 from affinitas_backend.models.beanie.save import ShadowSave
 from affinitas_backend.models.schemas.chat import NPCChatRequest, NPCChatResponse
 from affinitas_backend.models.schemas.npcs import NPCQuestResponses, NPCQuestRequest, NPCQuestCompleteRequest, \
     NPCQuestCompleteResponse, NPCGiveItemRequest
-from affinitas_backend.server.dependencies import XClientUUIDHeader
+from affinitas_backend.server.dependencies import XClientUUIDHeader, charge_token_budget, IdempotencyKeyHeader, \
+    NPCChatServiceDep, MasterLLMServiceDep
+from affinitas_backend.server.idempotency import idempotent
 from affinitas_backend.server.limiter import limiter
-from affinitas_backend.server.utils import throw_500
+from affinitas_backend.server.middleware import TimedRoute
+from affinitas_backend.server.utils import throw_500, cancel_on_disconnect
+from affinitas_backend.timing import timed
 
-router = APIRouter(prefix="/npcs", tags=["npcs"])
+router = APIRouter(prefix="/npcs", tags=["npcs"], route_class=TimedRoute)
 
 
 @router.post(
     "/{npc_id}/chat",
+    dependencies=[Depends(charge_token_budget)],
     response_model=NPCChatResponse,
     status_code=status.HTTP_200_OK,
     summary="Send a message to an NPC and receive a response",
@@ -42,7 +48,11 @@ router = APIRouter(prefix="/npcs", tags=["npcs"])
                 "**Additional Notes:**\n"
                 "- The message, NPC response, and quest changes are recorded in the `ShadowSave` document.\n"
                 "- Updates are handled asynchronously using background tasks to minimize latency.\n"
-                "**Rate Limit:** 10 requests per minute per client.",
+                "- If the client disconnects or the `X-Client-Deadline` (milliseconds) passes before the reply is "
+                "ready, the LLM call is cancelled and neither the message nor the reply is recorded.\n"
+                "- If the LLM misses its latency SLO, the NPC answers with a generic in-character line and "
+                "`degraded: true`. Such replies leave affinitas, the NPC profile and quests unchanged.\n"
+                "**Rate Limit:** 10 requests per minute per client. Tokens spent are charged to the client's token budget.",
     responses={
         status.HTTP_200_OK: {
             "description": "NPC response with updated affinitas and completed quests.",
@@ -71,12 +81,15 @@ router = APIRouter(prefix="/npcs", tags=["npcs"])
     }
 )
 @limiter.limit("10/minute")
+@idempotent
 async def npc_chat(
         request: Request,
         npc_id: PydanticObjectId,
         payload: NPCChatRequest,
         x_client_uuid: XClientUUIDHeader,
+        npc_chat_service: NPCChatServiceDep,
         background_tasks: BackgroundTasks,
+        idempotency_key: IdempotencyKeyHeader = None,
 ):
     """
     Handles a chat interaction with a given NPC.
@@ -94,15 +107,17 @@ async def npc_chat(
     )
 
     if payload.role == "user":
-        res = await npc_chat_service.get_response(
+        res = await cancel_on_disconnect(request, npc_chat_service.get_response(
             message=message,
             npc_id=npc_id,
             shadow_save_id=shadow_save_id,
-        )
+            client_uuid=str(x_client_uuid),
+        ))
 
         npc_response = res["message"]
         updated_npc_data = res["updated_npc_data"]
         completed_quests = res["completed_quests"]
+        degraded_turn = res["degraded_turn"]
 
         chat = [(payload.role, payload.content), ("ai", npc_response)]
         update_query = (
@@ -120,6 +135,7 @@ async def npc_chat(
                 Push({
                     "npcs.$.chat_history": {"$each": chat},
                     "npcs.$.completed_quests": {"$each": completed_quests},
+                    "npcs.$.degraded_turns": {"$each": [] if degraded_turn is None else [degraded_turn]},
                     "journal_data.chat_history.$[group].chat_history": {"$each": chat},
                 }),
                 array_filters=[
@@ -129,11 +145,13 @@ async def npc_chat(
             )
         )
 
-        response = NPCChatResponse(
-            response=npc_response,
-            affinitas_new=updated_npc_data["affinitas"],
-            completed_quests=TypeAdapter(list[PydanticObjectId]).validate_python(completed_quests)
-        )
+        with timed("validate"):
+            response = NPCChatResponse(
+                response=npc_response,
+                affinitas_new=updated_npc_data["affinitas"],
+                completed_quests=TypeAdapter(list[PydanticObjectId]).validate_python(completed_quests),
+                degraded=degraded_turn is not None
+            )
     else:
         response = Response(
             status_code=status.HTTP_204_NO_CONTENT,
@@ -145,12 +163,13 @@ async def npc_chat(
             .update(Push({"npcs.$.chat_history": {"$each": [(payload.role, payload.content)]}}))
         )
 
-    background_tasks.add_task(await_coroutine, update_query)
+    background_tasks.add_task(await_coroutine, update_query, "/npcs/{npc_id}/chat")
     return response
 
 
 @router.post(
     "/{npc_id}/quest",
+    dependencies=[Depends(charge_token_budget)],
     response_model=NPCQuestResponses,
     status_code=status.HTTP_200_OK,
     summary="Retrieve active quests for a given NPC",
@@ -160,9 +179,10 @@ async def npc_chat(
                 "- Remaining items, if any, are treated as subquests.\n"
                 "- The `X-Client-UUID` header is required for request tracking and authentication.\n"
                 "- All quests are marked as `active` in the database upon retrieval.\n"
-                "- If a quest is linked to another NPC, a system message is logged for that NPC in the background.\n"
+                "- If a quest is linked to another NPC, that NPC is asked about the quest whenever a player message "
+                "contains one of the quest's trigger keywords.\n"
                 "- Quest responses are generated via the master LLM and logged to both the NPC and journal chat history.\n\n"
-                "**Rate Limit:** 10 requests per minute per client.",
+                "**Rate Limit:** 10 requests per minute per client. Tokens spent are charged to the client's token budget.",
     responses={
         status.HTTP_200_OK: {
             "description": "List of active quests and LLM-generated responses for the NPC.",
@@ -190,18 +210,22 @@ async def npc_chat(
     }
 )
 @limiter.limit("10/minute")
+@idempotent
 async def get_quest(
         request: Request,
         npc_id: PydanticObjectId,
         payload: NPCQuestRequest,
         x_client_uuid: XClientUUIDHeader,
-        background_tasks: BackgroundTasks
+        npc_chat_service: NPCChatServiceDep,
+        master_llm_service: MasterLLMServiceDep,
+        background_tasks: BackgroundTasks,
+        idempotency_key: IdempotencyKeyHeader = None,
 ):
     """
     Retrieves and activates quest data for a specific NPC.
 
     - Updates quest statuses to "active".
-    - Triggers system messages for linked NPCs.
+    - Makes the quests visible to the trigger index of linked NPCs.
     - Logs LLM responses to both NPC and journal histories.
     """
     quests = (
@@ -229,27 +253,9 @@ async def get_quest(
             ],
         )
     )
-    background_tasks.add_task(await_coroutine, update_query)
-
-    for quest in quests:
-        linked_npc_id = quest.get("linked_npc")
-        if linked_npc_id:
-            msg = TAKE_QUEST_PROMPT_TEMPLATE.format(
-                quest_id=quest.get("quest_id"),
-                quest_name=quest.get("name"),
-                quest_description=quest.get("description"),
-                keywords=", ".join(map(repr, quest.get("triggers", []))),
-            )
-
-            update_query = (
-                ShadowSave
-                .find(ShadowSave.id == payload.shadow_save_id)
-                .update(
-                    Push({"npcs.$[npc].chat_history": ("system", msg)}),
-                    array_filters=[{"npc.npc_id": linked_npc_id}],
-                )
-            )
-            background_tasks.add_task(await_coroutine, update_query)
+    background_tasks.add_task(await_coroutine, update_query, "/npcs/{npc_id}/quest")
+    # Linked NPCs pick up the newly active quests through their trigger index once the update is done
+    background_tasks.add_task(npc_chat_service.quest_triggers.invalidate, payload.shadow_save_id)
 
     res = await master_llm_service.get_quest_responses(
         quests,
@@ -272,7 +278,7 @@ async def get_quest(
             ],
         )
     )
-    background_tasks.add_task(await_coroutine, update_query2)
+    background_tasks.add_task(await_coroutine, update_query2, "/npcs/{npc_id}/quest")
 
     return TypeAdapter(NPCQuestResponses).validate_python({"quests": res})
 
@@ -288,7 +294,7 @@ async def get_quest(
                 "- Verifies the quest exists and is active under the specified NPC.\n"
                 "- Marks the quest as completed in both the NPC and journal records.\n"
                 "- Increments the NPC’s `affinitas` score by the quest’s reward amount.\n"
-                "- Sends a system message to the NPC via LLM for contextual reaction.\n\n"
+                "- The NPC's prompt reflects the completed quest from then on.\n\n"
                 "**Rate Limit:** 10 requests per minute per client.",
     responses={
         status.HTTP_200_OK: {
@@ -315,18 +321,19 @@ async def complete_quest(
         npc_id: PydanticObjectId,
         payload: NPCQuestCompleteRequest,
         x_client_uuid: XClientUUIDHeader,
+        npc_chat_service: NPCChatServiceDep,
 ):
     """
     Completes an active quest for the specified NPC.
 
     - Updates quest status to 'completed'.
     - Adds affinitas reward to the NPC.
-    - Logs system message and triggers NPC response.
+    - The completion is picked up by the NPC's prompt through the quest state.
     """
     shadow_save_id = payload.shadow_save_id
 
     quest_data = await (
-        NPC
+        get_collection(NPC, "quest_catalog")
         .aggregate([
             {"$match": {"_id": npc_id}},
             {"$unwind": "$quests"},
@@ -338,7 +345,7 @@ async def complete_quest(
                 "description": "$quests.description",
                 "affinitas_reward": "$quests.affinitas_reward"
             }}
-        ]).to_list()
+        ]).to_list(None)
     )
 
     if not quest_data:
@@ -349,16 +356,8 @@ async def complete_quest(
 
     quest_data = quest_data[0]
     quest_id = quest_data["quest_id"]
-    quest_name = quest_data["name"]
-    quest_description = quest_data["description"]
     quest_reward = quest_data["affinitas_reward"]
 
-    sys_msg = COMPLETE_QUEST_PROMPT_TEMPLATE.format(
-        quest_id=quest_id,
-        quest_name=quest_name,
-        quest_description=quest_description
-    )
-
     res: ShadowSave = await (
         ShadowSave
         .find_one(ShadowSave.id == shadow_save_id)
@@ -368,7 +367,6 @@ async def complete_quest(
                 "npcs.$[npc].quests.$[quest].status": "completed",
                 "journal_data.quests.$[group].quests.$[quest].status": "completed"
             }),
-            Push({"npcs.$[npc].chat_history": ("system", sys_msg)}),
             array_filters=[
                 {"npc.npc_id": npc_id},
                 {"quest.quest_id": quest_id, "quest.status": "active"},
@@ -384,12 +382,15 @@ async def complete_quest(
             detail="Active quest not found"
         )
 
+    npc_chat_service.quest_triggers.invalidate(shadow_save_id)
+
     npc = next(npc for npc in res.npcs if npc.npc_id == npc_id)
     return NPCQuestCompleteResponse(affinitas=npc.affinitas)
 
 
 @router.post(
     "/{npc_id}/item",
+    dependencies=[Depends(charge_token_budget)],
     response_model=NPCChatResponse,
     status_code=status.HTTP_200_OK,
     summary="Give an item to an NPC",
@@ -399,8 +400,10 @@ async def complete_quest(
                 "- The item is marked inactive after the transaction.\n"
                 "- A system message is constructed to inform the NPC about the item.\n"
                 "- The NPC generates a reply through the LLM, impersonating the player giving the item.\n"
-                "- The interaction is logged in both the NPC’s and journal’s chat histories.\n\n"
-                "**Rate Limit:** 10 requests per minute per client.",
+                "- The interaction is logged in both the NPC’s and journal’s chat histories.\n"
+                "- If the client disconnects or the `X-Client-Deadline` (milliseconds) passes before the reply is "
+                "ready, the LLM call is cancelled and the item is kept.\n\n"
+                "**Rate Limit:** 10 requests per minute per client. Tokens spent are charged to the client's token budget.",
     responses={
         status.HTTP_200_OK: {
             "description": "NPC successfully received the item and responded. Returns the NPC's message, new affinitas, and any completed quests.",
@@ -433,12 +436,15 @@ async def complete_quest(
     }
 )
 @limiter.limit("10/minute")
+@idempotent
 async def give_item(
         request: Request,
         npc_id: PydanticObjectId,
         payload: NPCGiveItemRequest,
         x_client_uuid: XClientUUIDHeader,
+        npc_chat_service: NPCChatServiceDep,
         background_tasks: BackgroundTasks,
+        idempotency_key: IdempotencyKeyHeader = None,
 ):
     """
     Handles the logic for giving an item to an NPC.
@@ -450,11 +456,12 @@ async def give_item(
     shadow_save_id = payload.shadow_save_id
     item_name = payload.item_name
 
-    item_exists = await ShadowSave.find_one(
-        ShadowSave.id == shadow_save_id,
-        ShadowSave.client_uuid == x_client_uuid,
-        ElemMatch(ShadowSave.item_list, {"name": item_name, "active": True})
-    )
+    with timed("db"):
+        item_exists = await ShadowSave.find_one(
+            ShadowSave.id == shadow_save_id,
+            ShadowSave.client_uuid == x_client_uuid,
+            ElemMatch(ShadowSave.item_list, {"name": item_name, "active": True})
+        )
 
     if not item_exists:
         raise HTTPException(
@@ -464,12 +471,14 @@ async def give_item(
 
     sys_msg = GIVE_ITEM_TEMPLATE.format(item_name=item_name)
 
-    npc_response = await npc_chat_service.get_response(
+    npc_response = await cancel_on_disconnect(request, npc_chat_service.get_response(
         message=get_message("system", sys_msg),
         npc_id=npc_id,
         shadow_save_id=shadow_save_id,
-        invoke_model=True
-    )
+        invoke_model=True,
+        operation="give_item",
+        client_uuid=str(x_client_uuid),
+    ))
 
     if not npc_response:
         throw_500(
@@ -477,12 +486,15 @@ async def give_item(
             f"NPC ID: {npc_id}, Shadow Save ID: {shadow_save_id}, Item Name: {item_name}"
         )
 
+    degraded_turn = npc_response["degraded_turn"]
+
     query = (
         ShadowSave
         .find(ShadowSave.id == shadow_save_id)
         .update(
             Push({
                 "npcs.$[npc].chat_history": {"$each": [("system", sys_msg), ("ai", npc_response["message"])]},
+                "npcs.$[npc].degraded_turns": {"$each": [] if degraded_turn is None else [degraded_turn]},
                 "journal_data.chat_history.$[group].chat_history": ("ai", npc_response["message"]),
             }),
             Set({"item_list.$[item].active": False}),
@@ -494,46 +506,26 @@ async def give_item(
         )
     )
 
-    background_tasks.add_task(await_coroutine, query)
+    background_tasks.add_task(await_coroutine, query, "/npcs/{npc_id}/item")
 
     return NPCChatResponse(
         response=npc_response["message"],
         affinitas_new=npc_response["updated_npc_data"]["affinitas"],
-        completed_quests=npc_response["completed_quests"]
+        completed_quests=npc_response["completed_quests"],
+        degraded=degraded_turn is not None
     )
 
 
-async def await_coroutine(coroutine: Awaitable):
+async def await_coroutine(coroutine: Awaitable, route: str = "unknown"):
+    start = time.perf_counter()
     try:
         await coroutine
     except Exception as e:
         logging.error(f"Background update failed: {e}")
+    finally:
+        background_write_duration.observe(time.perf_counter() - start, route)
 
 
-TAKE_QUEST_PROMPT_TEMPLATE = """\
-The player has accepted this quest:
-
-Quest ID: {quest_id}
-Quest Name: {quest_name}
-Quest Description: {quest_description}
----
-Make use of the keywords below and the quest name and description (if non-null) \
-to decide whether the quest is completed.
-{keywords}
----
-If the player completes the quest, append the quest ID to the `completed_quests` array.\
-"""
-
-COMPLETE_QUEST_PROMPT_TEMPLATE = """\
-The player has completed this quest:
-Quest ID: {quest_id}
-Quest Name: {quest_name}
-Quest Description: {quest_description}
----
-This quest is already completed and should not be included in the `completed_quests` array.
-Keep this in mind in future conversations.\
-"""
-
 GIVE_ITEM_TEMPLATE = """\
 The player has given you the following item:
 Item Name: {item_name}
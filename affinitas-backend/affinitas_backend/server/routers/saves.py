@@ -5,18 +5,21 @@ from fastapi import HTTPException, status
 from fastapi.requests import Request
 from fastapi.routing import APIRouter
 
-from affinitas_backend.config import Config
-from affinitas_backend.db.utils import get_save_pipeline
+from affinitas_backend.config import get_config
+from affinitas_backend.db.utils import get_save_pipeline, get_collection
 from affinitas_backend.models.beanie.save import Save, ShadowSave
 from affinitas_backend.models.schemas.game import GameSavesResponse, GameSessionResponse, SaveIdRequest, \
-    GameSessionData, GameSaveSummary
+    GameSaveSummary
 from affinitas_backend.server.dependencies import XClientUUIDHeader
 from affinitas_backend.server.limiter import limiter
+from affinitas_backend.server.middleware import TimedRoute
+from affinitas_backend.server.responses import game_session_response
 from affinitas_backend.server.utils import throw_500
+from affinitas_backend.timing import timed
 
-router = APIRouter(prefix="/saves", tags=["saves"])
+router = APIRouter(prefix="/saves", tags=["saves"], route_class=TimedRoute)
 
-config = Config()  # noqa
+config = get_config()
 
 
 @router.get(
@@ -68,11 +71,10 @@ async def list_game_saves(
     - Only includes saves belonging to the client UUID.
     """
     saves = await (
-        Save
-        .find(Save.client_uuid == x_client_uuid)
-        .project(GameSaveSummary)
-        .sort(("saved_at", SortDirection.DESCENDING))
-        .to_list()
+        get_collection(Save, "list_game_saves")
+        .find({"client_uuid": x_client_uuid}, GameSaveSummary.Settings.projection)
+        .sort("saved_at", SortDirection.DESCENDING)
+        .to_list(None)
     )
 
     return GameSavesResponse(saves=saves)
@@ -143,9 +145,10 @@ async def load_game_save(
     - Returns game data if successful.
     - Raises 404 if save is not found.
     """
-    save = await Save.aggregate(
-        get_save_pipeline({"_id": payload.save_id})
-    ).to_list(1)
+    with timed("db"):
+        save = await get_collection(Save, "load_game_save").aggregate(
+            get_save_pipeline({"_id": payload.save_id})
+        ).to_list(1)
 
     if not save:
         logging.info(f"Save with ID {payload.save_id} not found")
@@ -155,11 +158,13 @@ async def load_game_save(
         )
 
     save = save[0]
-    shadow_save = ShadowSave(**save)
+    with timed("validate"):
+        shadow_save = ShadowSave(**save)
 
-    await ShadowSave.find(ShadowSave.client_uuid == x_client_uuid).delete()
+    with timed("db"):
+        await ShadowSave.find(ShadowSave.client_uuid == x_client_uuid).delete()
 
-    res = await shadow_save.insert()  # noqa
+        res = await shadow_save.insert()  # noqa
 
     if res is None:
         throw_500(
@@ -169,25 +174,13 @@ async def load_game_save(
         )
 
     try:
-        save.pop("client_uuid", None)
-        save.pop("chat_id", None)
-        save.pop("saved_at", None)
-
-        for npc in save["npcs"]:
-            npc.pop("likes", None)
-            npc.pop("dislikes", None)
-            npc.pop("occupation", None)
-
-        return GameSessionResponse(
-            data=GameSessionData(**save),
-            shadow_save_id=res.id,
-        )
+        with timed("serialize"):
+            return game_session_response(save, res.id)
     except Exception:
         await res.delete()
         raise
 
 
-
 @router.delete(
     "/{save_id}",
     summary="Delete a game save",
@@ -5,21 +5,23 @@ from typing import Annotated
 
 from beanie import PydanticObjectId
 from beanie.odm.operators.update.general import Set
-from fastapi import HTTPException, APIRouter, Request, status, Query
+from fastapi import HTTPException, APIRouter, Request, status, Query, Depends
 
-from affinitas_backend.chat import master_llm_service
-from affinitas_backend.config import Config
-from affinitas_backend.db.utils import get_save_pipeline
+from affinitas_backend.config import get_config
+from affinitas_backend.db.utils import get_save_pipeline, get_collection
 from affinitas_backend.models.beanie.save import DefaultSave, ShadowSave, Save
-from affinitas_backend.models.schemas.game import GameSessionResponse, GameSessionData, GameSaveSummary, \
+from affinitas_backend.models.schemas.game import GameSessionResponse, GameSaveSummary, \
     SaveSessionRequest, GameEndingResponse, ShadowSaveIdRequest, GiveItemRequest
-from affinitas_backend.server.dependencies import XClientUUIDHeader
+from affinitas_backend.server.dependencies import XClientUUIDHeader, charge_token_budget, MasterLLMServiceDep
 from affinitas_backend.server.limiter import limiter
+from affinitas_backend.server.middleware import TimedRoute
+from affinitas_backend.server.responses import game_session_response
 from affinitas_backend.server.utils import throw_500
+from affinitas_backend.timing import timed
 
-router = APIRouter(prefix="/session", tags=["session"])
+router = APIRouter(prefix="/session", tags=["session"], route_class=TimedRoute)
 
-config = Config()  # noqa
+config = get_config()
 
 
 @router.get(
@@ -33,9 +35,10 @@ config = Config()  # noqa
 )
 @limiter.limit("10/minute")
 async def new_game(request: Request, x_client_uuid: XClientUUIDHeader):
-    save = await DefaultSave.aggregate(
-        get_save_pipeline({"_id": config.default_save_version})
-    ).to_list(1)
+    with timed("db"):
+        save = await get_collection(DefaultSave, "new_game").aggregate(
+            get_save_pipeline({"_id": config.default_save_version})
+        ).to_list(1)
 
     if not save:
         throw_500(
@@ -45,15 +48,17 @@ async def new_game(request: Request, x_client_uuid: XClientUUIDHeader):
 
     save = save[0]
 
-    shadow_save = ShadowSave(
-        client_uuid=x_client_uuid,
-        chat_id=uuid.uuid4(),
-        **save,
-    )
+    with timed("validate"):
+        shadow_save = ShadowSave(
+            client_uuid=x_client_uuid,
+            chat_id=uuid.uuid4(),
+            **save,
+        )
 
-    await ShadowSave.find(ShadowSave.client_uuid == x_client_uuid).delete()
+    with timed("db"):
+        await ShadowSave.find(ShadowSave.client_uuid == x_client_uuid).delete()
 
-    res = await shadow_save.insert()  # noqa
+        res = await shadow_save.insert()  # noqa
 
     if res is None:
         throw_500(
@@ -62,15 +67,8 @@ async def new_game(request: Request, x_client_uuid: XClientUUIDHeader):
         )
 
     try:
-        for npc in save["npcs"]:
-            npc.pop("likes", None)  # Not needed in the response data
-            npc.pop("dislikes", None)
-            npc.pop("occupation", None)
-
-        return GameSessionResponse(
-            data=GameSessionData(**save),
-            shadow_save_id=res.id,
-        )
+        with timed("serialize"):
+            return game_session_response(save, res.id)
     except Exception:
         await res.delete()
         raise
@@ -180,6 +178,7 @@ async def quit_game(request: Request, shadow_save_id: Annotated[PydanticObjectId
 
 @router.post(
     "/generate-ending",
+    dependencies=[Depends(charge_token_budget)],
     response_model=GameEndingResponse,
     summary="Generates a game ending.",
     description="Generates a game ending from all the NPC info. "
@@ -188,14 +187,15 @@ async def quit_game(request: Request, shadow_save_id: Annotated[PydanticObjectId
                 "must be called to delete the shadow save entry.",
     status_code=status.HTTP_200_OK,
 )
-async def generate_ending(request: Request, payload: ShadowSaveIdRequest, x_client_uuid: XClientUUIDHeader):
+async def generate_ending(request: Request, payload: ShadowSaveIdRequest, x_client_uuid: XClientUUIDHeader,
+                          master_llm_service: MasterLLMServiceDep):
     npc_infos = (
-        await ShadowSave
+        await get_collection(ShadowSave, "generate_ending")
         .aggregate(
             get_save_pipeline({"_id": payload.shadow_save_id})
             + [{"$project": {"npcs": 1}}]
         )
-        .to_list()
+        .to_list(None)
     )
 
     if not npc_infos:
@@ -207,7 +207,7 @@ async def generate_ending(request: Request, payload: ShadowSaveIdRequest, x_clie
 
     npc_infos = npc_infos[0].get("npcs", [])
 
-    res = master_llm_service.generate_ending(npc_infos)
+    res = await master_llm_service.generate_ending(npc_infos)
 
     if res is None:
         throw_500(
@@ -224,7 +224,7 @@ async def generate_ending(request: Request, payload: ShadowSaveIdRequest, x_clie
     response_model=None,
     summary="Sets the action points for the given shadow save.",
     description="Sets the action points for the given shadow save. "
-                "The action points are set to the given value without any checks. "
+                "The action points must be between 0 and the daily action point limit. "
                 "The `X-Client-UUID` header must be provided. The shadow save entry ",
     status_code=status.HTTP_204_NO_CONTENT,
 )
@@ -232,7 +232,7 @@ async def generate_ending(request: Request, payload: ShadowSaveIdRequest, x_clie
 async def update_shadow_save(
         request: Request,
         day_no: Annotated[int, Query(alias="day-no")],
-        ap: Annotated[int, Query(alias="ap")],
+        ap: Annotated[int, Query(alias="ap", ge=0, le=config.daily_ap_limit)],
         payload: ShadowSaveIdRequest,
         x_client_uuid: XClientUUIDHeader
 ):
@@ -0,0 +1,153 @@
+"""
+Multi-worker runner: starts `--workers` worker processes on consecutive ports from `--worker-port`, behind a
+`StickyProxy` on `--port` that routes each player to one worker by `X-Client-UUID`.
+
+Workers are forked from a fork server that imported the application once, so they start without paying for the
+imports and share the imported modules' memory. Crashed workers are restarted. `SIGTTIN` adds a worker and
+`SIGTTOU` drains the last one (its sessions are handed off) before stopping it.
+
+Usage: python -m affinitas_backend.server.runner --workers 4 [--port 8000] [--worker-port 8100] [--no-sticky]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import time
+from multiprocessing.process import BaseProcess
+
+import uvicorn
+
+from affinitas_backend.config import get_config
+from affinitas_backend.server.proxy import StickyProxy
+
+WORKER_HOST = "127.0.0.1"
+RESTART_BACKOFF_SECONDS = (1, 2, 5, 10, 30)
+
+
+def serve_worker(port: int, log_level: str):
+    from affinitas_backend.server.main import app  # Already imported by the fork server
+
+    uvicorn.Server(uvicorn.Config(app, host=WORKER_HOST, port=port, log_level=log_level)).run()
+
+
+class WorkerManager:
+    def __init__(self, proxy: StickyProxy, worker_port: int, log_level: str, stop_timeout: float = 30.0):
+        self.proxy = proxy
+        self.worker_port = worker_port
+        self.log_level = log_level
+        self.stop_timeout = stop_timeout
+
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["affinitas_backend.server.main"])
+        self.workers: dict[int, BaseProcess] = {}  # port -> process
+        self._restarts: dict[int, tuple[int, float]] = {}  # port -> (consecutive restarts, next attempt)
+
+    def spawn(self, port: int):
+        process = self.context.Process(target=serve_worker, args=(port, self.log_level), name=f"worker-{port}")
+        process.start()
+        self.workers[port] = process
+        self.proxy.add_upstream(_url(port))
+        logging.info(f"Started worker {process.pid} on port {port}")
+
+    async def add_worker(self):
+        self.spawn(max(self.workers, default=self.worker_port - 1) + 1)
+
+    async def remove_worker(self):
+        if len(self.workers) <= 1:
+            return
+
+        port = max(self.workers)
+        await self.proxy.drain(_url(port))
+        process = self.workers.pop(port)
+        self.proxy.remove_upstream(_url(port))
+        await asyncio.to_thread(self._stop, process)
+        logging.info(f"Stopped worker {process.pid} on port {port}")
+
+    async def supervise(self, interval: float = 1.0):
+        """Restarts exited workers, backing off when they keep exiting."""
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for port, process in list(self.workers.items()):
+                if process.is_alive():
+                    continue
+
+                restarts, next_attempt = self._restarts.get(port, (0, now))
+                if now < next_attempt:
+                    continue
+
+                logging.warning(f"Worker {process.pid} on port {port} exited with {process.exitcode}, restarting")
+                self.spawn(port)
+                delay = RESTART_BACKOFF_SECONDS[min(restarts, len(RESTART_BACKOFF_SECONDS) - 1)]
+                self._restarts[port] = (restarts + 1, now + delay)
+
+            # Workers that stayed up for the longest backoff are considered healthy again
+            for port, (_, next_attempt) in list(self._restarts.items()):
+                if now - next_attempt > RESTART_BACKOFF_SECONDS[-1]:
+                    del self._restarts[port]
+
+    def stop_all(self):
+        for process in self.workers.values():
+            process.terminate()
+        for process in self.workers.values():
+            self._stop(process)
+
+    def _stop(self, process: BaseProcess):
+        process.terminate()  # uvicorn shuts down gracefully on SIGTERM
+        process.join(self.stop_timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+def _url(port: int) -> str:
+    return f"http://{WORKER_HOST}:{port}"
+
+
+async def run(args: argparse.Namespace):
+    # Workers answer within the client timeout, or with 499 once the client has gone
+    proxy = StickyProxy([], sticky=not args.no_sticky, health_interval=args.health_interval,
+                        cluster_token=os.environ["CLUSTER_TOKEN"],
+                        read_timeout=get_config().llm_client_timeout_seconds + 10)
+    manager = WorkerManager(proxy, args.worker_port, args.log_level)
+    for i in range(args.workers):
+        manager.spawn(args.worker_port + i)
+
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTTIN, lambda: loop.create_task(manager.add_worker()))
+    loop.add_signal_handler(signal.SIGTTOU, lambda: loop.create_task(manager.remove_worker()))
+
+    server = uvicorn.Server(uvicorn.Config(proxy, host=args.host, port=args.port, log_level=args.log_level))
+    supervisor = asyncio.create_task(manager.supervise())
+    try:
+        await server.serve()
+    finally:
+        supervisor.cancel()
+        await asyncio.to_thread(manager.stop_all)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--worker-port", type=int, default=8100, help="Port of the first worker")
+    parser.add_argument("--no-sticky", action="store_true", help="Spread requests round-robin instead")
+    parser.add_argument("--health-interval", type=float, default=1.0, help="Seconds between readiness checks")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    # Authenticates the proxy to the session hand-off endpoints of the workers, which read it from the environment
+    os.environ.setdefault("CLUSTER_TOKEN", secrets.token_urlsafe(32))
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass  # uvicorn re-raises the signal once it has shut down
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,30 @@
+import asyncio
 import logging
+import math
+import time
+from typing import Awaitable, TypeVar
 
-from fastapi import HTTPException, status
+from fastapi import HTTPException, status, Response
+from fastapi.requests import Request
+from fastapi.responses import JSONResponse
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+
+from affinitas_backend.chat.scheduler import LLMOverloadedError, request_deadline
+from affinitas_backend.chat.usage import CLIENT_GONE
+from affinitas_backend.config import get_config
+from affinitas_backend.metrics import rate_limit_rejections
+
+T = TypeVar("T")
+
+config = get_config()
+
+# Status used by nginx for requests closed by the client. The client never sees it.
+HTTP_499_CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the client disconnected or its deadline passed before the response was ready."""
 
 
 def throw_500(detail: str, *msgs: str):
@@ -9,3 +33,53 @@ def throw_500(detail: str, *msgs: str):
         logging.error(msg)
 
     raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail)
+
+
+def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    logging.warning(f"Rejected {request.method} {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "The server is busy. Please try again shortly."},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceeded):
+    rate_limit_rejections.inc("request")
+    return _rate_limit_exceeded_handler(request, exc)
+
+
+def client_disconnected_handler(request: Request, exc: ClientDisconnectedError):
+    logging.info(f"Abandoned {request.method} {request.url.path}: {exc}")
+    return Response(status_code=HTTP_499_CLIENT_CLOSED_REQUEST)
+
+
+async def cancel_on_disconnect(request: Request, coroutine: Awaitable[T]) -> T:
+    """
+    Awaits `coroutine` and cancels it as soon as the client disconnects or the deadline given in the
+    `X-Client-Deadline` header (milliseconds from now) passes, so that nobody pays for a response that
+    will never be read. Raises `ClientDisconnectedError` in that case.
+    """
+    deadline = None
+    if header := request.headers.get("X-Client-Deadline"):
+        try:
+            deadline = time.monotonic() + float(header) / 1000
+        except ValueError:
+            pass
+
+    request_deadline.set(deadline)
+    task = asyncio.ensure_future(coroutine)
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=config.client_disconnect_poll_seconds)
+            if done:
+                return task.result()
+
+            if deadline is not None and time.monotonic() > deadline:
+                raise ClientDisconnectedError("client deadline passed")
+
+            if await request.is_disconnected():
+                raise ClientDisconnectedError("client disconnected")
+    finally:
+        task.cancel(CLIENT_GONE)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from beanie import PydanticObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from affinitas_backend.chat import services
+from affinitas_backend.config import get_config
+from affinitas_backend.db.utils import get_collection, get_save_pipeline, get_npc_quests_pipeline, \
+    get_dynamic_npc_data_pipeline, get_linked_active_quests_pipeline
+from affinitas_backend.metrics import CallbackMetric
+from affinitas_backend.models.beanie.npc import NPC
+from affinitas_backend.models.beanie.save import DefaultSave, ShadowSave
+from affinitas_backend.server.responses import game_session_response
+
+config = get_config()
+
+# Steps without which the worker cannot serve games; the worker is not ready until they have succeeded
+REQUIRED_STEPS = ("mongo_pool", "default_save")
+
+
+class WarmUp:
+    """
+    Pays the costs of the first requests of a worker before it reports ready: it opens connections to MongoDB
+    and the model provider, builds the chat services, reads the NPC catalog and the default save and runs the
+    aggregation pipelines of the game routes once.
+
+    The other steps only affect latency, so a failed step is logged and the remaining steps still run. The
+    worker turns ready once the `REQUIRED_STEPS` have succeeded and all steps are done or `timeout` has
+    passed; otherwise the warm-up is retried every `retry_interval` seconds.
+    """
+
+    def __init__(self, enabled: bool, timeout: float, mongo_connections: int, retry_interval: float):
+        self.enabled = enabled
+        self.timeout = timeout
+        self.mongo_connections = mongo_connections
+        self.retry_interval = retry_interval
+
+        self.state: Literal["pending", "warming", "ready"] = "pending"
+        self.durations: dict[str, float] = {}
+        self._succeeded: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def start(self, client: AsyncIOMotorClient):
+        """Warms up in the background, so that the worker answers health checks meanwhile."""
+        if not self.enabled:
+            self.state = "ready"
+            return
+
+        self.state = "warming"
+        self._task = asyncio.create_task(self._run(client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, client: AsyncIOMotorClient):
+        start = time.perf_counter()
+        while True:
+            self._succeeded.clear()
+            try:
+                await asyncio.wait_for(self._warm_up(client), self.timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Warm-up did not finish within {self.timeout}s")
+
+            if missing := [step for step in REQUIRED_STEPS if step not in self._succeeded]:
+                logging.warning(f"Warm-up steps {', '.join(missing)} did not succeed, not ready; "
+                                f"retrying in {self.retry_interval:g}s")
+                await asyncio.sleep(self.retry_interval)
+                continue
+
+            break
+
+        self.state = "ready"
+        logging.info(f"Warm-up complete in {time.perf_counter() - start:.2f}s: " + ", ".join(
+            f"{step} {seconds * 1000:.0f}ms" for step, seconds in self.durations.items()
+        ))
+
+    async def _warm_up(self, client: AsyncIOMotorClient):
+        async with self._step("mongo_pool"):
+            # Concurrent commands check out separate connections, which then stay in the pool
+            await asyncio.gather(*(client.admin.command("ping") for _ in range(self.mongo_connections)))
+
+        async with self._step("provider_pool"):
+            await services.http_pool.warm_up()
+
+        async with self._step("services"):
+            services.npc_chat, services.master_llm  # noqa: Built on first use
+
+        npc_ids = []
+        async with self._step("npc_catalog"):
+            npc_ids = [npc["_id"] for npc in await get_collection(NPC, "quest_catalog").find({}).to_list()]
+
+        async with self._step("default_save"):
+            save = await get_collection(DefaultSave, "new_game").aggregate(
+                get_save_pipeline({"_id": config.default_save_version})
+            ).to_list(1)
+            if not save:
+                raise LookupError(f"Default save version {config.default_save_version} not found")
+            game_session_response(save[0], PydanticObjectId())
+
+        async with self._step("pipelines"):
+            # A shadow save that does not exist still has the pipelines parsed and planned by the server
+            shadow_save_id, npc_id = PydanticObjectId(), npc_ids[0] if npc_ids else PydanticObjectId()
+            await ShadowSave.aggregate(get_npc_quests_pipeline(npc_id, shadow_save_id)).to_list()
+            await ShadowSave.aggregate(get_dynamic_npc_data_pipeline(
+                shadow_save_id, npc_id, include_chat_history=True, include_static_data=True
+            )).to_list()
+            await ShadowSave.aggregate(get_linked_active_quests_pipeline(shadow_save_id, npc_id)).to_list()
+
+    @asynccontextmanager
+    async def _step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            logging.warning(f"Warm-up step {name} failed: {e!r}")
+        else:
+            self._succeeded.add(name)
+        finally:
+            self.durations[name] = time.perf_counter() - start
+
+
+warm_up = WarmUp(
+    enabled=config.warmup_enabled,
+    timeout=config.warmup_timeout_seconds,
+    mongo_connections=config.warmup_mongo_connections,
+    retry_interval=config.warmup_retry_seconds,
+)
+
+CallbackMetric("affinitas_ready", "Whether the worker has warmed up and accepts traffic",
+               lambda: {(): int(warm_up.ready)})
+CallbackMetric("affinitas_warmup_step_seconds", "Duration of the warm-up steps of the worker",
+               lambda: {(step,): seconds for step, seconds in warm_up.durations.items()}, ("step",))
@@ -0,0 +1,55 @@
+"""
+Per-request phase timings for the `Server-Timing` header and the access log.
+
+`ServerTimingMiddleware` attaches a `RequestTimings` to sampled requests; `timed(phase)` adds the time spent
+in its block to the current request's phase. Outside sampled requests `timed` returns a shared no-op context.
+"""
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Literal
+
+Phase = Literal["db", "llm", "validate", "serialize"]
+
+_NO_TIMING = nullcontext()
+
+
+class RequestTimings:
+    __slots__ = ("start", "durations", "endpoint_started", "endpoint_finished")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations: dict[str, float] = {}
+        # Marked by `TimedRoute` around the endpoint call
+        self.endpoint_started: float | None = None
+        self.endpoint_finished: float | None = None
+
+    def add(self, phase: str, seconds: float):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+class _Timer:
+    __slots__ = ("timings", "phase", "start")
+
+    def __init__(self, timings: RequestTimings, phase: str):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.phase, time.perf_counter() - self.start)
+
+
+def timed(phase: Phase):
+    """Context manager adding the time spent in its block to `phase` of the current request, if sampled."""
+    timings = request_timings.get()
+    if timings is None:
+        return _NO_TIMING
+
+    return _Timer(timings, phase)
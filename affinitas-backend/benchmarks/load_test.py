@@ -0,0 +1,318 @@
+"""
+Load test driving the documented client flow with concurrent virtual players: auth, new game or load, NPC
+chats, quests, items, day updates, save, ending and quit.
+
+Players are drawn from a weighted mix of profiles (`--mix`), each playing whole sessions in a loop until
+`--duration` seconds have passed. Throughput, p50/p95/p99 latency and error rates are reported per route
+template and written to `--output` as JSON, together with the commit they were measured on; pass a previous
+results file to `--compare` to print the p95 and throughput changes.
+
+Usage:
+    # Against a running server (start it with LLM_PROVIDER=stand-in RATE_LIMIT_ENABLED=false)
+    python -m benchmarks.load_test --players 50 --duration 60
+    # Or let the load test start one, using the stand-in LLM and the MongoDB of the usual `.env` settings
+    python -m benchmarks.load_test --spawn --players 50 --duration 60 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any
+
+import httpx
+
+
+@dataclass(frozen=True)
+class Profile:
+    chats: int  # User messages per session
+    quests: int  # NPCs asked for quests per session; their first quest is completed
+    items: int  # Items given to NPCs per session
+    days: int  # Day updates per session
+    load_save: bool  # Continue the last save instead of starting a new game
+    ending_rate: float  # Fraction of sessions that generate the ending
+
+
+PROFILES = {
+    "chatter": Profile(chats=8, quests=0, items=0, days=1, load_save=False, ending_rate=0.0),
+    "quester": Profile(chats=3, quests=2, items=1, days=2, load_save=False, ending_rate=0.1),
+    "returning": Profile(chats=4, quests=1, items=1, days=1, load_save=True, ending_rate=0.5),
+}
+
+CHAT_LINES = [
+    "Hello! I'm new in town. What do you do here?",
+    "Have you heard anything strange in the woods lately?",
+    "Is there anything I can help you with today?",
+    "What do you think of the mayor?",
+    "I found some moonflowers by the river. Do you need any?",
+]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.sessions = 0
+
+    def record(self, route: str, seconds: float, status: str):
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            statuses = self.statuses[route]
+            errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+            routes[route] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "error_rate": errors / len(latencies),
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "statuses": dict(statuses),
+            }
+
+        total = sum(route["requests"] for route in routes.values())
+        errors = sum(route["error_rate"] * route["requests"] for route in routes.values())
+        return {
+            "elapsed_seconds": elapsed,
+            "sessions": self.sessions,
+            "requests": total,
+            "throughput": total / elapsed,
+            "error_rate": errors / total if total else 0.0,
+            "routes": routes,
+        }
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Player:
+    def __init__(self, client: httpx.AsyncClient, stats: Stats, profile: Profile, think_time: float):
+        self.client = client
+        self.stats = stats
+        self.profile = profile
+        self.think_time = think_time
+        self.headers: dict[str, str] = {}
+
+    async def request(self, method: str, url: str, route: str, **kwargs) -> httpx.Response:
+        if self.think_time:
+            await asyncio.sleep(random.expovariate(1 / self.think_time))
+
+        route = f"{method} {route}"
+        start = time.perf_counter()
+        try:
+            res = await self.client.request(method, url, headers=self.headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(route, time.perf_counter() - start, type(e).__name__)
+            raise RequestFailed(route) from e
+
+        self.stats.record(route, time.perf_counter() - start, str(res.status_code))
+        if res.status_code >= 400:
+            raise RequestFailed(f"{route}: {res.status_code}")
+        return res
+
+    async def run(self, deadline: float):
+        res = await self.request("POST", "/auth/uuid", "/auth/uuid")
+        self.headers["X-Client-UUID"] = res.json()["uuid"]
+
+        while time.monotonic() < deadline:
+            try:
+                await self.play_session()
+                self.stats.sessions += 1
+            except RequestFailed:
+                pass  # Already recorded; start over with a new session
+
+    async def play_session(self):
+        game = None
+        if self.profile.load_save:
+            saves = (await self.request("GET", "/saves/", "/saves/")).json()["saves"]
+            if saves:
+                save_id = max(saves, key=lambda s: s["saved_at"])["save_id"]
+                game = (await self.request("POST", "/saves/", "/saves/", json={"save_id": save_id})).json()
+        if game is None:
+            game = (await self.request("GET", "/session/new", "/session/new")).json()
+
+        shadow_save_id = game["shadow_save_id"]
+        data = game["data"]
+        npc_ids = [npc["npc_id"] for npc in data["npcs"]]
+        items = [item["name"] for item in data["item_list"]]
+
+        for _ in range(self.profile.chats):
+            await self.request(
+                "POST", f"/npcs/{random.choice(npc_ids)}/chat", "/npcs/{npc_id}/chat",
+                json={"role": "user", "content": random.choice(CHAT_LINES), "shadow_save_id": shadow_save_id}
+            )
+
+        for npc_id in random.sample(npc_ids, min(self.profile.quests, len(npc_ids))):
+            quests = (await self.request(
+                "POST", f"/npcs/{npc_id}/quest", "/npcs/{npc_id}/quest", json={"shadow_save_id": shadow_save_id}
+            )).json()["quests"]
+            if quests:
+                await self.request(
+                    "POST", f"/npcs/{npc_id}/quest/complete", "/npcs/{npc_id}/quest/complete",
+                    json={"quest_id": quests[0]["quest_id"], "shadow_save_id": shadow_save_id}
+                )
+
+        for item_name in random.sample(items, min(self.profile.items, len(items))):
+            payload = {"item_name": item_name, "shadow_save_id": shadow_save_id}
+            await self.request("POST", "/session/item", "/session/item", json=payload)
+            await self.request("POST", f"/npcs/{random.choice(npc_ids)}/item", "/npcs/{npc_id}/item", json=payload)
+
+        day_no = data["day_no"]
+        for _ in range(self.profile.days):
+            day_no += 1
+            await self.request(
+                "PATCH", "/session", "/session", params={"day-no": day_no, "ap": 15},
+                json={"shadow_save_id": shadow_save_id}
+            )
+
+        await self.request(
+            "POST", "/session/save", "/session/save", json={"name": "Load test", "shadow_save_id": shadow_save_id}
+        )
+        if random.random() < self.profile.ending_rate:
+            await self.request(
+                "POST", "/session/generate-ending", "/session/generate-ending", json={"shadow_save_id": shadow_save_id}
+            )
+        await self.request("DELETE", "/session", "/session", params={"id": shadow_save_id})
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in PROFILES:
+            raise argparse.ArgumentTypeError(f"Unknown profile {name!r}; expected one of {', '.join(PROFILES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def run(base_url: str, players: int, duration: float, mix: dict[str, float], think_time: float,
+              timeout: float) -> dict[str, Any]:
+    stats = Stats()
+    limits = httpx.Limits(max_connections=players, max_keepalive_connections=players)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        profiles = random.choices(list(mix), weights=list(mix.values()), k=players)
+        start = time.monotonic()
+        deadline = start + duration
+        res = await asyncio.gather(
+            *(Player(client, stats, PROFILES[name], think_time).run(deadline) for name in profiles),
+            return_exceptions=True
+        )
+        elapsed = time.monotonic() - start
+
+    failures = [r for r in res if isinstance(r, Exception)]
+    if failures:
+        print(f"{len(failures)} players failed to authenticate: {failures[0]!r}", file=sys.stderr)
+
+    summary = stats.summary(elapsed)
+    summary["players"] = {name: profiles.count(name) for name in mix}
+    return summary
+
+
+def spawn_server(port: int) -> subprocess.Popen:
+    env = {**os.environ, "LLM_PROVIDER": "stand-in", "RATE_LIMIT_ENABLED": "false"}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "affinitas_backend.server.main:app", "--port", str(port),
+         "--log-level", "warning"],
+        env=env,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with {server.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+
+    server.terminate()
+    raise RuntimeError("The server was not ready within 30 seconds")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary: dict[str, Any]):
+    print(f"{summary['sessions']} sessions, {summary['requests']} requests in {summary['elapsed_seconds']:.1f} s "
+          f"({summary['throughput']:.1f} req/s, {summary['error_rate']:.2%} errors)")
+    print(f"{'route':<36} {'requests':>8} {'req/s':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in summary["routes"].items():
+        print(f"{route:<36} {stats['requests']:>8} {stats['throughput']:>7.1f} {stats['error_rate']:>7.2%} "
+              f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}")
+
+
+def print_comparison(summary: dict[str, Any], baseline: dict[str, Any]):
+    print(f"\nCompared to {baseline.get('commit') or 'the baseline'}:")
+    print(f"{'route':<36} {'p95 change':>11} {'req/s change':>13}")
+    for route, stats in summary["routes"].items():
+        base = baseline["routes"].get(route)
+        if base is None or not base["p95"] or not base["throughput"]:
+            continue
+        print(f"{route:<36} {stats['p95'] / base['p95'] - 1:>+11.1%} "
+              f"{stats['throughput'] / base['throughput'] - 1:>+13.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Start a server with the stand-in LLM on --port")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--players", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to keep starting sessions")
+    parser.add_argument("--mix", type=parse_mix, default="chatter=6,quester=3,returning=1",
+                        help=f"Weighted player profiles: {', '.join(PROFILES)}")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause before each request in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results file of a previous run to compare against")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    server = spawn_server(args.port) if args.spawn else None
+    base_url = f"http://127.0.0.1:{args.port}" if server else args.base_url
+    try:
+        summary = asyncio.run(run(base_url, args.players, args.duration, args.mix, args.think_time, args.timeout))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    summary = {"commit": git_commit(), "args": {k: v for k, v in vars(args).items() if k != "compare"}, **summary}
+    print_summary(summary)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(summary, json.load(f))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Micro-benchmarks of the helpers on the request path: aggregation pipelines, prompt assembly, NPC state updates
+and validation, run on synthetic saves of configurable size.
+
+Each benchmark reports the median time per call and the peak memory allocated by a single call. With
+`--mongo`, the save and NPC data aggregations are also timed on the MongoDB of `MONGODB_URI`, in a scratch
+database that is dropped afterwards.
+
+Save the results as a baseline and compare later runs against it; benchmarks slower (or allocating more) than
+the baseline by more than `--threshold` are flagged, and the exit code is 1:
+
+    python -m benchmarks.micro --npcs 8 --quests 4 --history 200 --save-baseline micro.json
+    python -m benchmarks.micro --npcs 8 --quests 4 --history 200 --compare micro.json
+
+Requires the usual `.env` settings, since the helpers are imported from the application.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable
+
+from beanie import PydanticObjectId
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from affinitas_backend.chat import services
+from affinitas_backend.chat.npc_chat import _update_npc
+from affinitas_backend.chat.state import ChatHistory, NPCState
+from affinitas_backend.chat.utils import pretty_quests, pretty_linked_quests, format_npc_data, \
+    QUEST_PROMPT_TEMPLATE
+from affinitas_backend.config import get_config
+from affinitas_backend.db.utils import get_save_pipeline, get_dynamic_npc_data_pipeline
+from affinitas_backend.models.chat.chat import NPCChatState, NPCData
+from affinitas_backend.models.schemas.game import GameSessionData
+
+config = get_config()
+
+CHAT_LINES = [
+    ("user", "Good morning! Have you seen anything strange near the old mill lately?"),
+    ("ai", "Strange? Aye, lights at night and the miller's dog howling at nothing. I keep my shutters closed."),
+]
+
+
+def make_npc_configs(n_npcs: int, n_quests: int) -> list[dict[str, Any]]:
+    """Documents of the `npcs` collection."""
+    return [
+        {
+            "_id": ObjectId(),
+            "name": f"NPC {i}",
+            "age": 30 + i,
+            "occupation": "Herbalist",
+            "personality": ["kind", "curious", "stubborn"],
+            "likes": ["Moonflowers", "Quiet evenings"],
+            "dislikes": ["Loud noises"],
+            "motivations": ["Protect the village", "Find her lost brother"],
+            "backstory": "Raised by the river, she learned every herb of the valley from her grandmother. " * 4,
+            "affinitas_config": {"initial": 50, "increase": 0.6, "decrease": ["insults", "lies"]},
+            "endings": ["She opens an apothecary.", "She leaves the village for good."],
+            "quests": [
+                {
+                    "_id": ObjectId(),
+                    "name": f"Quest {i}.{j}",
+                    "description": f"Bring {j + 2} bundles of moonflowers from the northern woods before dusk.",
+                    "affinitas_reward": 5,
+                    "triggers": ["moonflower", "northern woods"],
+                }
+                for j in range(n_quests)
+            ],
+            "dialogue_unlocks": ["the lost brother", "the old mill"],
+            "order_no": i,
+        }
+        for i in range(n_npcs)
+    ]
+
+
+def make_save(npc_configs: list[dict[str, Any]], history: int) -> dict[str, Any]:
+    """A document of the save collections, with `history` messages per NPC."""
+    chat_history = [list(CHAT_LINES[i % 2]) for i in range(history)]
+    return {
+        "_id": ObjectId(),
+        "client_uuid": uuid.uuid4(),
+        "chat_id": uuid.uuid4(),
+        "day_no": 3,
+        "remaining_ap": 10,
+        "journal_active": True,
+        "journal_data": {
+            "quests": [
+                {
+                    "npc_id": npc["_id"],
+                    "quests": [
+                        {"quest_id": q["_id"], "status": "active", "name": q["name"]} for q in npc["quests"]
+                    ],
+                }
+                for npc in npc_configs
+            ],
+            "npcs": [{"npc_id": npc["_id"], "description": "A villager.", "active": True} for npc in npc_configs],
+            "town_info": {"description": "A quiet river town.", "active": True},
+            "chat_history": [{"npc_id": npc["_id"], "chat_history": chat_history} for npc in npc_configs],
+        },
+        "item_list": [{"name": "Silver ring", "active": False}, {"name": "Moonflower", "active": True}],
+        "npcs": [
+            {
+                "npc_id": npc["_id"],
+                "affinitas": 50,
+                "likes": [],
+                "dislikes": [],
+                "occupation": None,
+                "quests": [
+                    {"quest_id": q["_id"], "status": ("pending", "active", "completed")[j % 3]}
+                    for j, q in enumerate(npc["quests"])
+                ],
+                "chat_history": chat_history,
+                "completed_quests": [],
+                "degraded_turns": [],
+            }
+            for npc in npc_configs
+        ],
+    }
+
+
+def aggregate_save(save: dict[str, Any], npc_configs: list[dict[str, Any]]) -> dict[str, Any]:
+    """What `get_save_pipeline` returns for the save."""
+    configs = {npc["_id"]: npc for npc in npc_configs}
+    res = copy.deepcopy(save)
+    del res["_id"]
+    for npc in res["npcs"]:
+        cfg = configs[npc["npc_id"]]
+        quests = {q["_id"]: q for q in cfg["quests"]}
+        npc.update(name=cfg["name"], likes=cfg["likes"], dislikes=cfg["dislikes"], occupation=cfg["occupation"])
+        for quest in npc["quests"]:
+            q = quests[quest["quest_id"]]
+            quest.update(name=q["name"], description=q["description"], affinitas_reward=q["affinitas_reward"])
+    return res
+
+
+def npc_state(save: dict[str, Any], npc_configs: list[dict[str, Any]], static_data: bool) -> dict[str, Any]:
+    """What `get_dynamic_npc_data_pipeline` returns for the first NPC, without the chat history."""
+    npc, cfg = save["npcs"][0], npc_configs[0]
+    quests = {q["_id"]: q for q in cfg["quests"]}
+    state = {
+        "affinitas": npc["affinitas"],
+        "likes": list(npc["likes"]),
+        "dislikes": list(npc["dislikes"]),
+        "occupation": npc["occupation"],
+        "completed_quests": list(npc["completed_quests"]),
+        "quests": [
+            {
+                "status": q["status"],
+                "name": quests[q["quest_id"]]["name"],
+                "description": quests[q["quest_id"]]["description"],
+            }
+            for q in npc["quests"]
+        ],
+    }
+    if static_data:
+        state |= {key: cfg[key] for key in NPCData.__annotations__}
+    return state
+
+
+def python_benchmarks(save: dict[str, Any], npc_configs: list[dict[str, Any]]) -> dict[str, Callable[[], Any]]:
+    session = aggregate_save(save, npc_configs)
+    state = npc_state(save, npc_configs, static_data=False)
+    npc_data = npc_state(save, npc_configs, static_data=True)
+    npc_data["occupation"] = npc_data["occupation"] or "Unknown"
+    history = save["npcs"][0]["chat_history"]
+    messages = ChatHistory.from_bson(history).window(config.langchain_max_tokens)
+    linked_quests = [
+        {"quest_id": q["_id"], "name": q["name"], "description": q["description"], "triggers": q["triggers"]}
+        for q in npc_configs[0]["quests"][:1]
+    ]
+    shadow_save_id, npc_id = PydanticObjectId(save["_id"]), PydanticObjectId(npc_configs[0]["_id"])
+    completed_quests = [str(q["_id"]) for q in npc_configs[0]["quests"]]
+
+    chat_state_adapter = TypeAdapter(NPCChatState)
+    npc_data_adapter = TypeAdapter(NPCData)
+    object_ids_adapter = TypeAdapter(list[PydanticObjectId])
+
+    def update_npc():
+        _update_npc(
+            NPCState.from_bson(state),
+            affinitas_change=2,
+            occupation="Herbalist",
+            likes=["Tea"],
+            completed_quests=completed_quests,
+        )
+
+    return {
+        "get_save_pipeline": lambda: get_save_pipeline({"_id": shadow_save_id}),
+        "get_dynamic_npc_data_pipeline": lambda: get_dynamic_npc_data_pipeline(
+            shadow_save_id, npc_id, include_chat_history=True
+        ),
+        "pretty_quests": lambda: pretty_quests(state["quests"]),
+        "pretty_linked_quests": lambda: pretty_linked_quests(linked_quests),
+        "quest_prompt": lambda: QUEST_PROMPT_TEMPLATE.format(
+            npc_data=format_npc_data(npc_data), quest_description=npc_configs[0]["quests"][0]["description"]
+        ),
+        "npc_state": lambda: NPCState.from_bson(state),
+        "chat_history_window": lambda: ChatHistory.from_bson(history).window(config.langchain_max_tokens),
+        "chat_prompt": lambda: services.npc_chat.prompt_template.format_prompt(
+            messages=messages,
+            occupation="Unknown",
+            likes="Unspecified",
+            dislikes="Unspecified",
+            quests=pretty_quests(state["quests"]),
+            linked_quests=pretty_linked_quests(linked_quests),
+            affinitas=state["affinitas"],
+        ),
+        "_update_npc": update_npc,
+        "validate_npc_chat_state": lambda: chat_state_adapter.validate_python(state, strict=True),
+        "validate_npc_data": lambda: npc_data_adapter.validate_python(
+            {key: npc_data[key] for key in NPCData.__annotations__}, strict=True
+        ),
+        "validate_completed_quests": lambda: object_ids_adapter.validate_python(completed_quests),
+        "validate_game_session_data": lambda: GameSessionData(**session),
+    }
+
+
+def measure(fn: Callable[[], Any], min_time: float, repeats: int) -> dict[str, float]:
+    # Calibrate the number of calls per repeat so that a repeat takes about `min_time` seconds
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        calls *= 10
+    calls = max(1, round(calls * min_time / 10 / elapsed))
+
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        times.append((time.perf_counter() - start) / calls)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": statistics.median(times), "peak_bytes": peak - baseline}
+
+
+async def measure_async(fn: Callable[[], Any], calls: int) -> dict[str, float]:
+    await fn()  # Warm up the query plan cache
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    await fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"seconds": statistics.median(times), "peak_bytes": peak - baseline}
+
+
+async def mongo_benchmarks(save: dict[str, Any], npc_configs: list[dict[str, Any]], calls: int) -> dict[str, Any]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(config.mongodb_uri, uuidRepresentation="standard")
+    db = client[f"affinitas_bench_{uuid.uuid4().hex[:8]}"]
+    try:
+        await db.npcs.insert_many(npc_configs)
+        await db.shadow_save.insert_one(save)
+        save_id, npc_id = save["_id"], npc_configs[0]["_id"]
+
+        return {
+            "mongo_save_aggregation": await measure_async(
+                lambda: db.shadow_save.aggregate(get_save_pipeline({"_id": save_id})).to_list(None), calls
+            ),
+            "mongo_npc_data_aggregation": await measure_async(
+                lambda: db.shadow_save.aggregate(get_dynamic_npc_data_pipeline(
+                    save_id, npc_id, include_chat_history=True, include_static_data=True
+                )).to_list(None), calls
+            ),
+        }
+    finally:
+        await client.drop_database(db)
+        client.close()
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float) -> bool:
+    if baseline["sizes"] != results["sizes"]:
+        print(f"Warning: the baseline was measured with {baseline['sizes']}", file=sys.stderr)
+
+    regressed = False
+    print(f"\n{'benchmark':<32} {'time change':>12} {'memory change':>14}")
+    for name, res in results["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+
+        time_change = res["seconds"] / base["seconds"] - 1
+        memory_change = res["peak_bytes"] / base["peak_bytes"] - 1 if base["peak_bytes"] else 0.0
+        flag = ""
+        if time_change > threshold or memory_change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:<32} {time_change:>+12.1%} {memory_change:>+14.1%}{flag}")
+
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--npcs", type=int, default=8)
+    parser.add_argument("--quests", type=int, default=4, help="Quests per NPC")
+    parser.add_argument("--history", type=int, default=200, help="Chat messages per NPC")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--mongo", action="store_true", help="Also time the aggregations on MongoDB")
+    parser.add_argument("--mongo-calls", type=int, default=50)
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--save-baseline", help="Write the results to this file")
+    parser.add_argument("--compare", help="Baseline file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    npc_configs = make_npc_configs(args.npcs, args.quests)
+    save = make_save(npc_configs, args.history)
+
+    results = {"sizes": {"npcs": args.npcs, "quests": args.quests, "history": args.history}, "benchmarks": {}}
+    print(f"{'benchmark':<32} {'time':>12} {'peak memory':>14}")
+    for name, fn in python_benchmarks(save, npc_configs).items():
+        if args.filter and args.filter not in name:
+            continue
+        res = results["benchmarks"][name] = measure(fn, args.min_time, args.repeats)
+        print(f"{name:<32} {res['seconds'] * 1e6:>10.1f}µs {res['peak_bytes'] / 1024:>12.1f}KB")
+
+    if args.mongo:
+        for name, res in asyncio.run(mongo_benchmarks(save, npc_configs, args.mongo_calls)).items():
+            results["benchmarks"][name] = res
+            print(f"{name:<32} {res['seconds'] * 1e6:>10.1f}µs {res['peak_bytes'] / 1024:>12.1f}KB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
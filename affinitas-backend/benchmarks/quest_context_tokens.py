@@ -0,0 +1,118 @@
+"""
+Compares the prompt tokens sent over a long session when quest instructions are stored in the chat history
+(the old behavior) and when they are rendered from the quest state on every turn.
+
+Usage: python -m benchmarks.quest_context_tokens [--turns 200] [--quests 6]
+Requires the usual `.env` settings, since the prompt templates are imported from the application.
+"""
+import argparse
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+from affinitas_backend.chat.utils import NPC_PROMPT_TEMPLATE, pretty_quests, pretty_linked_quests
+
+OLD_TAKE_QUEST_PROMPT_TEMPLATE = """\
+The player has accepted this quest:
+
+Quest ID: {quest_id}
+Quest Name: {quest_name}
+Quest Description: {quest_description}
+---
+Make use of the keywords below and the quest name and description (if non-null) \
+to decide whether the quest is completed.
+{keywords}
+---
+If the player completes the quest, append the quest ID to the `completed_quests` array.\
+"""
+
+OLD_COMPLETE_QUEST_PROMPT_TEMPLATE = """\
+The player has completed this quest:
+Quest ID: {quest_id}
+Quest Name: {quest_name}
+Quest Description: {quest_description}
+---
+This quest is already completed and should not be included in the `completed_quests` array.
+Keep this in mind in future conversations.\
+"""
+
+
+def make_quests(n: int) -> list[dict]:
+    return [
+        {
+            "quest_id": f"6650fbd5ecf473c6f3a5a8{i:02x}",
+            "name": f"Quest {i}",
+            "description": f"Bring the herbalist the {i}th bundle of moonflowers from the northern woods "
+                           f"before the bells ring at dusk.",
+            "triggers": ["moonflower", f"bundle {i}", "northern woods"],
+            "status": "active",
+        }
+        for i in range(n)
+    ]
+
+
+def system_prompt(quests: list[dict], linked_quests: list[dict]) -> str:
+    return NPC_PROMPT_TEMPLATE.format(
+        affinitas=50,
+        occupation="Herbalist",
+        likes="Moonflowers",
+        dislikes="Loud noises",
+        quests=pretty_quests(quests),
+        linked_quests=pretty_linked_quests(linked_quests),
+    )
+
+
+def run(turns: int, n_quests: int) -> tuple[int, int]:
+    quests = make_quests(n_quests)
+    accept_every = max(1, turns // (n_quests * 2))
+
+    old_history, new_history = [], []
+    old_tokens = new_tokens = 0
+    accepted = 0
+
+    for turn in range(turns):
+        # Quests are accepted and completed over the first half of the session
+        if turn % accept_every == 0 and accepted < 2 * n_quests:
+            quest = quests[accepted // 2]
+            template = OLD_TAKE_QUEST_PROMPT_TEMPLATE if accepted % 2 == 0 else OLD_COMPLETE_QUEST_PROMPT_TEMPLATE
+            old_history.append(SystemMessage(template.format(
+                quest_id=quest["quest_id"],
+                quest_name=quest["name"],
+                quest_description=quest["description"],
+                keywords=", ".join(map(repr, quest["triggers"])),
+            )))
+            if accepted % 2 == 1:
+                quest["status"] = "completed"
+            accepted += 1
+
+        message = HumanMessage(f"Turn {turn}: tell me more about the village and what you need today.")
+        # One in ten player messages mentions a trigger of an active quest
+        active = [q for q in quests if q["status"] == "active"]
+        matched = active[:1] if turn % 10 == 0 else []
+
+        old_prompt = [SystemMessage(system_prompt(quests, []))] + old_history + [message]
+        new_prompt = [SystemMessage(system_prompt(quests, matched))] + new_history + [message]
+        old_tokens += count_tokens_approximately(old_prompt)
+        new_tokens += count_tokens_approximately(new_prompt)
+
+        reply = AIMessage("Ah, the village has seen better days, but the harvest festival is near.")
+        old_history += [message, reply]
+        new_history += [message, reply]
+
+    return old_tokens, new_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--quests", type=int, default=6)
+    args = parser.parse_args()
+
+    print(f"{'turns':>6} {'in history':>13} {'from state':>12} {'saved':>7}")
+    for turns in sorted({args.turns // 4, args.turns // 2, args.turns}):
+        old_tokens, new_tokens = run(turns, args.quests)
+        print(f"{turns:>6} {old_tokens:>13} {new_tokens:>12} {1 - new_tokens / old_tokens:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures how throughput scales with the number of workers of the multi-worker runner, by playing the load test
+against runners with each of `--workers` worker counts. The stand-in LLM answers without latency by default,
+so that the workers are CPU-bound. Also reports the hit ratios of the per-worker quest trigger and response
+caches; with `--round-robin`, every count is measured a second time with sticky routing turned off.
+
+Usage: python -m benchmarks.scaling [--workers 1 2 4] [--players 50] [--duration 30] [--round-robin]
+Requires MongoDB and the usual `.env` settings, like `benchmarks.load_test --spawn`.
+"""
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.load_test import run as run_load_test, parse_mix
+
+METRIC_LINE = re.compile(r'^(affinitas_\w+_cache_lookups_total)\{result="(hit|miss)"} (\S+)$')
+
+
+def start_runner(workers: int, port: int, worker_port: int, sticky: bool, latency: float) -> subprocess.Popen:
+    env = {
+        **os.environ, "LLM_PROVIDER": "stand-in", "RATE_LIMIT_ENABLED": "false",
+        "STAND_IN_LATENCY_SECONDS": str(latency), "STAND_IN_LATENCY_JITTER_SECONDS": "0",
+    }
+    args = [sys.executable, "-m", "affinitas_backend.server.runner", "--workers", str(workers),
+            "--port", str(port), "--worker-port", str(worker_port), "--log-level", "warning"]
+    runner = subprocess.Popen(args + ([] if sticky else ["--no-sticky"]), env=env)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if runner.poll() is not None:
+            raise RuntimeError(f"The runner exited with {runner.returncode}")
+        try:
+            res = httpx.get(f"http://127.0.0.1:{port}/readyz", timeout=1)
+            if res.status_code == 200 and len(res.json()["workers"]) == workers:
+                return runner
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+
+    stop_runner(runner)
+    raise RuntimeError(f"{workers} workers were not ready within 60 seconds")
+
+
+def stop_runner(runner: subprocess.Popen):
+    runner.terminate()
+    runner.wait()
+
+
+def cache_lookups(workers: int, worker_port: int) -> dict[str, dict[str, float]]:
+    """Cache name -> hits and misses, summed over the workers."""
+    lookups: dict[str, dict[str, float]] = {}
+    for port in range(worker_port, worker_port + workers):
+        for line in httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=5).text.splitlines():
+            if match := METRIC_LINE.match(line):
+                name, result, value = match.groups()
+                cache = lookups.setdefault(name.removeprefix("affinitas_").removesuffix("_cache_lookups_total"),
+                                           {"hit": 0.0, "miss": 0.0})
+                cache[result] += float(value)
+    return lookups
+
+
+def hit_ratio(lookups: dict[str, dict[str, float]], cache: str) -> float:
+    counts = lookups.get(cache, {"hit": 0.0, "miss": 0.0})
+    total = counts["hit"] + counts["miss"]
+    return counts["hit"] / total if total else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--worker-port", type=int, default=8800)
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load per worker count")
+    parser.add_argument("--mix", type=parse_mix, default="chatter=6,quester=3,returning=1")
+    parser.add_argument("--stand-in-latency", type=float, default=0.0, help="Seconds the stand-in LLM takes")
+    parser.add_argument("--round-robin", action="store_true", help="Also measure without sticky routing")
+    args = parser.parse_args()
+
+    routings = [True, False] if args.round_robin else [True]
+    results = []
+    for workers in args.workers:
+        for sticky in routings:
+            runner = start_runner(workers, args.port, args.worker_port, sticky, args.stand_in_latency)
+            try:
+                summary = asyncio.run(run_load_test(
+                    f"http://127.0.0.1:{args.port}", args.players, args.duration, args.mix, 0.0, 60.0
+                ))
+                lookups = cache_lookups(workers, args.worker_port)
+            finally:
+                stop_runner(runner)
+            results.append((workers, sticky, summary, lookups))
+
+    baseline = results[0][2]["throughput"]
+    print(f"{'workers':>7} {'routing':<11} {'req/s':>8} {'speed-up':>8} {'errors':>7} "
+          f"{'trigger hits':>12} {'response hits':>13}")
+    for workers, sticky, summary, lookups in results:
+        print(f"{workers:>7} {'sticky' if sticky else 'round-robin':<11} {summary['throughput']:>8.1f} "
+              f"{summary['throughput'] / baseline:>7.2f}x {summary['error_rate']:>7.2%} "
+              f"{hit_ratio(lookups, 'quest_trigger'):>12.1%} {hit_ratio(lookups, 'response'):>13.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares encoding a loaded save as a `GameSessionResponse` the default way (validating `GameSessionData`, then
+FastAPI validating and serializing the response model and `json` encoding it) with the trusted orjson path of
+`game_session_response`, on saves of about `--size-mb` megabytes. Also checks that both produce the same JSON.
+
+Usage: python -m benchmarks.serialization [--size-mb 1] [--npcs 8] [--repeats 20]
+Requires the usual `.env` settings, since the models are imported from the application.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import statistics
+import time
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from affinitas_backend.models.schemas.game import GameSessionResponse, GameSessionData
+from affinitas_backend.server.responses import game_session_response
+from benchmarks.micro import make_npc_configs, make_save, aggregate_save
+
+response_field = create_model_field("Response_load_game_save", GameSessionResponse, mode="serialization")
+
+
+async def default_path(save: dict, shadow_save_id: ObjectId) -> bytes:
+    response = GameSessionResponse(data=GameSessionData(**save), shadow_save_id=shadow_save_id)
+    content = await serialize_response(field=response_field, response_content=response)
+    return JSONResponse(content).body
+
+
+async def trusted_path(save: dict, shadow_save_id: ObjectId) -> bytes:
+    return game_session_response(save, shadow_save_id).body
+
+
+def sized_save(size_mb: float, n_npcs: int) -> dict:
+    """Grows the chat histories until the encoded save is about `size_mb` megabytes."""
+    npc_configs = make_npc_configs(n_npcs, 4)
+    history = 16
+    while True:
+        save = aggregate_save(make_save(npc_configs, history), npc_configs)
+        size = len(game_session_response(save, ObjectId()).body)
+        if size >= size_mb * 1024 * 1024:
+            return save
+        history = int(history * max(1.1, size_mb * 1024 * 1024 / size))
+
+
+async def measure(path, save: dict, repeats: int) -> tuple[float, bytes]:
+    times = []
+    body = b""
+    for _ in range(repeats):
+        data = copy.deepcopy(save)  # The routes own the aggregated document
+        start = time.perf_counter()
+        body = await path(data, ObjectId("6651acb12f41d99fc2f91a87"))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), body
+
+
+async def run(size_mb: float, n_npcs: int, repeats: int):
+    save = sized_save(size_mb, n_npcs)
+
+    default_time, default_body = await measure(default_path, save, repeats)
+    trusted_time, trusted_body = await measure(trusted_path, save, repeats)
+
+    if json.loads(default_body) != json.loads(trusted_body):
+        raise AssertionError("The trusted path encodes the save differently")
+
+    print(f"Response size: {len(trusted_body) / 1024 / 1024:.2f} MB, {n_npcs} NPCs, "
+          f"{len(save['npcs'][0]['chat_history'])} messages per NPC")
+    print(f"{'path':<10} {'median':>10} {'MB/s':>8}")
+    for name, seconds in (("default", default_time), ("trusted", trusted_time)):
+        print(f"{name:<10} {seconds * 1000:>8.1f}ms {len(trusted_body) / 1024 / 1024 / seconds:>8.1f}")
+    print(f"Speed-up: {default_time / trusted_time:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=1.0)
+    parser.add_argument("--npcs", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.size_mb, args.npcs, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
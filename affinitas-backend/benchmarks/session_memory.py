@@ -0,0 +1,70 @@
+"""
+Measures the memory a chat turn holds for an NPC's state and history on top of the decoded MongoDB document:
+the previous representation (the state dict and a LangChain message per history entry) against `NPCState` and
+`ChatHistory` with messages built only for the window sent to the model. The last column leaves out the window,
+i.e. what a turn holds outside of the model call.
+
+Usage: python -m benchmarks.session_memory [--history 50 200 1000] [--max-tokens 4000]
+Requires the usual `.env` settings, since the helpers are imported from the application.
+"""
+import argparse
+import copy
+import tracemalloc
+from typing import Any, Callable
+
+from affinitas_backend.chat.state import ChatHistory, NPCState
+from affinitas_backend.chat.utils import get_message
+from affinitas_backend.config import get_config
+from benchmarks.micro import make_npc_configs, make_save, npc_state
+
+config = get_config()
+
+
+def before(npc: dict[str, Any], history: list[list[str]], max_tokens: int) -> Any:
+    return dict(npc), [get_message(role, content) for role, content in history]
+
+
+def after(npc: dict[str, Any], history: list[list[str]], max_tokens: int) -> Any:
+    chat_history = ChatHistory.from_bson(history)
+    return NPCState.from_bson(npc), chat_history, chat_history.window(max_tokens)
+
+
+def compact(npc: dict[str, Any], history: list[list[str]], max_tokens: int) -> Any:
+    return NPCState.from_bson(npc), ChatHistory.from_bson(history)
+
+
+def allocated(build: Callable[..., Any], npc: dict[str, Any], history: list[list[str]], max_tokens: int) -> int:
+    """Bytes still allocated by the result of `build`, excluding the document it was built from."""
+    npc, history = copy.deepcopy(npc), copy.deepcopy(history)
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    res = build(npc, history, max_tokens)  # noqa: Kept alive until measured
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return end - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, nargs="+", default=[50, 200, 1000], help="Messages per NPC")
+    parser.add_argument("--max-tokens", type=int, default=config.langchain_max_tokens,
+                        help="History window sent to the model")
+    parser.add_argument("--npcs", type=int, default=8, help="NPCs per session")
+    args = parser.parse_args()
+
+    npc_configs = make_npc_configs(1, 4)
+    print(f"Window: {args.max_tokens} tokens, {args.npcs} NPCs per session")
+    print(f"{'messages':>8} {'before':>12} {'after':>12} {'saved':>7} {'w/o window':>12}")
+    for history in args.history:
+        save = make_save(npc_configs, history)
+        npc, chat_history = npc_state(save, npc_configs, static_data=False), save["npcs"][0]["chat_history"]
+
+        old = allocated(before, npc, chat_history, args.max_tokens) * args.npcs
+        new = allocated(after, npc, chat_history, args.max_tokens) * args.npcs
+        state = allocated(compact, npc, chat_history, args.max_tokens) * args.npcs
+        print(f"{history:>8} {old / 1024:>10.1f}KB {new / 1024:>10.1f}KB {1 - new / old:>7.1%} "
+              f"{state / 1024:>10.1f}KB")
+
+
+if __name__ == "__main__":
+    main()
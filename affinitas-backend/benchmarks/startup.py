@@ -0,0 +1,105 @@
+"""
+Measures the cold start of a worker in fresh interpreters: importing the application, running the startup of its
+lifespan, warming up until the worker is ready (per step) and running the shutdown. Without the lifespan, the
+chat services are built on their first use instead. Also lists the packages that take the most time to import,
+from `python -X importtime`.
+
+Usage: python -m benchmarks.startup [--runs 5] [--top 10] [--no-lifespan]
+Requires the usual `.env` settings; the lifespan connects to MongoDB, skip it with `--no-lifespan` if none is
+running.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+CHILD = """
+import asyncio, json, sys, time
+
+start = time.perf_counter()
+from affinitas_backend.server.main import app
+from affinitas_backend.server.lifespan import lifespan
+from affinitas_backend.chat import services
+from affinitas_backend.server.warmup import warm_up
+timings = {"import": time.perf_counter() - start}
+
+
+async def run():
+    start = time.perf_counter()
+    async with lifespan(app):
+        timings["lifespan startup"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        while not warm_up.ready:
+            if time.perf_counter() - start > warm_up.timeout:
+                raise RuntimeError(f"Not ready after {warm_up.timeout:.0f}s, see the warm-up warnings")
+            await asyncio.sleep(0.01)
+        timings["warm-up"] = time.perf_counter() - start
+        timings.update({f"  {step}": seconds for step, seconds in warm_up.durations.items()})
+
+        start = time.perf_counter()
+    timings["lifespan shutdown"] = time.perf_counter() - start
+
+
+if sys.argv[1] == "lifespan":
+    asyncio.run(run())
+else:
+    start = time.perf_counter()
+    services.npc_chat, services.master_llm
+    timings["services"] = time.perf_counter() - start
+
+print(json.dumps(timings))
+"""
+
+
+def run_child(lifespan: bool) -> dict[str, float]:
+    res = subprocess.run(
+        [sys.executable, "-c", CHILD, "lifespan" if lifespan else "import"],
+        capture_output=True, text=True,
+    )
+    if res.returncode:
+        raise SystemExit(f"The worker failed to start:\n{res.stderr.strip().splitlines()[-1]}")
+    return json.loads(res.stdout.splitlines()[-1])
+
+
+def import_profile() -> Counter:
+    """Own import time in seconds per top-level package."""
+    res = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import affinitas_backend.server.main"],
+        capture_output=True, text=True, check=True,
+    )
+    packages = Counter()
+    for line in res.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        packages[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to start")
+    parser.add_argument("--top", type=int, default=10, help="Packages listed by import time")
+    parser.add_argument("--no-lifespan", action="store_true", help="Only import the app and build the services")
+    args = parser.parse_args()
+
+    runs = [run_child(not args.no_lifespan) for _ in range(args.runs)]
+
+    print(f"Median of {args.runs} runs")
+    print(f"{'stage':<20} {'median':>10} {'min':>10} {'max':>10}")
+    for stage in runs[0]:
+        values = [run[stage] for run in runs]
+        print(f"{stage:<20} {statistics.median(values) * 1000:>8.1f}ms {min(values) * 1000:>8.1f}ms "
+              f"{max(values) * 1000:>8.1f}ms")
+
+    if args.top:
+        print("\nSlowest packages to import (own time, importing the app)")
+        for package, seconds in import_profile().most_common(args.top):
+            print(f"{package:<30} {seconds * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()